@@ -11,8 +11,8 @@ from amaranth.hdl.rec import DIR_NONE, DIR_FANOUT, DIR_FANIN, Layout, Record
 from amaranth.hdl.mem import Memory
 from amaranth.hdl.xfrm import DomainRenamer
 from amaranth.cli import main_parser, main_runner
-from amaranth.sim import Simulator, Delay, Tick, Passive, Active
-from amaranth.asserts import Assert, Assume, Cover, Past
+from amaranth.sim import Simulator, Delay, Tick, Passive, Active, Settle
+from amaranth.asserts import Assert, Assume, Cover, Past, AnyConst
 from amaranth.lib.fifo import AsyncFIFOBuffered
 #from amaranth.lib.cdc import AsyncFFSynchronizer
 from amaranth.lib.cdc import FFSynchronizer
@@ -44,15 +44,23 @@ class Delayer(Elaboratable):
 			- From the top.tim file after running 'build' for upload:
 			Info: Max frequency for clock '$glbnet$clk': 212.09 MHz (PASS at 25.00 MHz)
 			- I think this is fine 
+			- engine="prescaled" keeps the timer off the critical path at higher clk_freqs, 
+			following the high speed counter idea in the README. The countdown is split into a 
+			low stage of prescaler_bits, that counts every clock, and a high stage that only counts 
+			when the low stage wraps, so its decrement and compare are registered a clock ahead. 
+			Then only the low stage is in any single clock path.
 
 		- delay
-			- can implement delays down to 2 clock cycles - which is great! woo-hoo!
-			- this is by having two separate timer mechanisms: one for large delays,
-			and one for small delays (less than 8 or so clock cycles)
+			- the state calling delay_for_clks(clks) lasts exactly clks clocks, for any clks from 1
+			up to longest_period, whether clks is a constant or a Value
+			- this is by loading one shared countdown on the first clock of the state, through a ui
+			that is not registered, so there is no pipeline delay to compensate for
 	
-	To do:
-		- Finish adding formal verification. Currently not sure how to handle the
-		cases where the simulator throws reset around...
+	Notes:
+		- The ui passed to set_m_and_ui_to_use() needs to be delayer.ui itself (or connected 
+		combinatorially), as a registered connection would add to every delay.
+		- As the countdown is shared, only one delay can be running at a time, and the calling 
+		state should only be left once its delay is done.
 
 	"""
 
@@ -68,11 +76,19 @@ class Delayer(Elaboratable):
 		# ("count",	32,	DIR_FANIN)
 	]
 
-	def __init__(self, clk_freq, utest: FHDLTestCase = None):
+	engines = ["binary", "prescaled"]
+
+	def __init__(self, clk_freq, engine = "binary", utest: FHDLTestCase = None):
 		super().__init__()
 		self.utest = utest # so unit tests can be run on this class itself
 		self.clk_freq = clk_freq
 		self.longest_period = 1.1 * 100e-6 # is this an OK assumption?
+		self.engine = engine
+		self.prescaler_bits = 4 # width of the low stage, for the prescaled engine
+
+		assert self.engine in Delayer.engines, f"Unknown engine {self.engine}, expected one of {Delayer.engines}"
+		if self.engine == "prescaled":
+			assert self._get_counter_bitwidth() > self.prescaler_bits, "The prescaled engine needs a high stage"
 
 		def get_current_load_bitwidth():
 			L = Delayer.ui_layout
@@ -82,6 +98,7 @@ class Delayer(Elaboratable):
 		# 	Delayer.ui_layout.append(("load", self._get_counter_bitwidth(), DIR_FANOUT))
 
 		self.ui = Record(Delayer.ui_layout)
+		self.num_call_sites = 0 # used to name the flag each call site uses
 		self.set_m_and_ui_to_use(None, None) # initialises to an invalid state, ensuring it is set properly before use
 		# self.debug = Record(Delayer.debug_layout)
 
@@ -95,13 +112,14 @@ class Delayer(Elaboratable):
 		self.remote_ui = _ui
 		self.remote_m = m
 
-	def delay_for_time(self, duration_sec):
+	def get_clks_for_time(self, duration_sec):
 		if isinstance(duration_sec, enum.Enum):
 			duration_sec = duration_sec.value
 
-		clks = int(np.ceil(duration_sec * self.clk_freq))
+		return int(np.ceil(duration_sec * self.clk_freq))
 
-		return self.delay_for_clks(clks)
+	def delay_for_time(self, duration_sec):
+		return self.delay_for_clks(self.get_clks_for_time(duration_sec))
 	
 	def delay_for_clks(self, clks):
 		# note: This is designed as an interface, to be used by other modules.
@@ -110,90 +128,123 @@ class Delayer(Elaboratable):
 		# We get around this by using a remote m and ui
 		assert not isinstance(self.remote_m, type(None)), "self.remote_m is not initialised yet, call delayer.set_m_and_ui_to_use()"
 		assert not isinstance(self.remote_ui, type(None)), "self.remote_ui is not initialised yet, call delayer.set_m_and_ui_to_use()"
-		m = self.remote_m
-		_ui = self.remote_ui
-
-		print("Clks is ", clks)
-
-		def constant_shift_timer(clks):
-			print("Using smaller shifter")
-			clks -= 1
-			shift_timer = Signal(reset=-1, shape=clks)
-			m.d.sync += shift_timer.eq(shift_timer[1:])
-			with m.If(shift_timer == 1):
-				m.d.sync += shift_timer.eq(shift_timer.reset) # reset when done, so it can be reused
-			return shift_timer == 1
-		
-		def normal_timer(clks):
-			with m.FSM(name="delay_fsm"):#, domain=self.domain):
-				with m.State("IDLE"):
-					m.d.sync += _ui.load.eq(clks-8) # to account for measured 8-cycle user delay
-					m.next = "LOADED"
-				with m.State("LOADED"):
-					m.d.sync += _ui.load.eq(0)
-					m.next = "DONE"
-				with m.State("DONE"): # is this extra state needed? to avoid driving ui.load?
-					with m.If(_ui.done):
-						m.next = "IDLE"
-					# assume that this fsm will stop when the containing fsm exits it?
-
-			return _ui.done
+		return self.delay_for_clks_using(self.remote_m, self.remote_ui, clks)
+
+	def delay_for_clks_using(self, m, _ui, clks):
+		# as delay_for_clks(), but with the m and ui given, e.g. by a TimerBank's timers
+		max_clks = 1 << self._get_counter_bitwidth()
+
+		# set on the first clock of the calling state, when the countdown is loaded with clks-1, 
+		# and cleared again when done, so the delay can be reused. 
+		# The countdown then reads 1 on the clks'th clock of the state
+		waiting = Signal(name=f"delay_{self.num_call_sites}_waiting")
+		self.num_call_sites += 1
 
 		# for variable delays,
 		if isinstance(clks, Value):
-			# with m.If(clks > 8):
-			return normal_timer(clks)
-			# with m.Else():
-			# 	# somewhow make short timer work?
+			with m.If(~waiting):
+				with m.If(clks > 1):
+					m.d.sync += waiting.eq(1)
+					m.d.comb += _ui.load.eq(clks - 1)
+			with m.Elif(_ui.done):
+				m.d.sync += waiting.eq(0)
 
+			return Mux(waiting, _ui.done, clks <= 1)
 
 		# now handle the case for constant delays
-		elif (clks > 8):
-			# handle large constant delays, or variable delays
-			# clks -= 8 # this compensates for delays etc in the implementation
-			new_clks = clks-8
-			assert self._get_counter_bitwidth() >= bits_for(new_clks), f"""The desired delay of {new_clks} clks 
-				requires {bits_for(new_clks)} bits, but this timer assumes {self.longest_period}
-				sec with {self._get_counter_bitwidth()} as the max"""
-			# assert clks > 0, "Not enough clocks to delay in this way. todo: correct threshold"
-				
-			return normal_timer(clks)
-		
-		elif (clks <= 8) and (clks > 1): # "this technique may not work efficiently for larger clks"
-			return constant_shift_timer(clks)
-		
-		elif clks == 1:
+		assert (clks >= 1) and (clks <= max_clks), f"""Unable to implement a timer for {clks} clks, 
+			as this timer assumes {self.longest_period} sec, or {max_clks} clks, as the max"""
+
+		if clks == 1:
 			return True
 
+		with m.If(~waiting):
+			m.d.sync += waiting.eq(1)
+			m.d.comb += _ui.load.eq(clks - 1)
+		with m.Elif(_ui.done):
+			m.d.sync += waiting.eq(0)
+
+		return waiting & _ui.done
+
+	def get_sim_clks_remaining(self):
+		# for simulation processes, the clocks until done is raised, or 0 if no delay is running
+		yield Settle() # so the countdown has been clocked, if called just after a clock edge
+		if self.engine == "prescaled":
+			count = (yield self.high) * (1 << self.prescaler_bits) + (yield self.low)
+		else:
+			count = (yield self.countdown)
+		return max(count - 1, 0)
+
+	def sim_fast_forward(self, clks):
+		# for simulation processes, this shortens the running delay by <clks>, so the clocks it 
+		# would have spent counting down don't need simulating. It should be called just after a clock edge
+		remaining = yield from self.get_sim_clks_remaining()
+		assert clks < remaining, f"Can only fast forward by less than the {remaining} clks remaining"
+		count = remaining - clks + 1
+
+		if self.engine == "prescaled":
+			high = count >> self.prescaler_bits
+			yield self.low.eq(count & ((1 << self.prescaler_bits) - 1))
+			yield self.high.eq(high)
+			yield self.high_is_zero.eq(high == 0)
+			yield self.high_is_one.eq(high == 1)
+			yield self.high_minus_one.eq(high - 1)
 		else:
-			assert 0, f"Unable to implement a timer for clocks of {clks}"
+			yield self.countdown.eq(count)
 
 
 	def elaborate(self, platform):
 		m = Module()
 
-		_ui = Record.like(self.ui)
-		# _debug = Record.like(self.debug)
-		m.d.sync += [
-			self.ui.connect(_ui),
-			# self.debug.connect(_debug)
-		]
+		def add_binary_countdown():
+			countdown = self.countdown = Signal(shape=self._get_counter_bitwidth())
+
+			with m.If(self.ui.load != 0):
+				m.d.sync += countdown.eq(self.ui.load)
+			with m.Elif(countdown > 0):
+				m.d.sync += countdown.eq(countdown - 1)
 
-		countdown = Signal(shape=self._get_counter_bitwidth())
+			m.d.comb += self.ui.done.eq(countdown==1) # not registered, so the delay is exact
 
-		def add_countdown_behaviour():
+		def add_prescaled_countdown():
+			# the countdown is high*2**prescaler_bits + low, and goes down by one each clock, as with the binary engine
+			low = self.low = Signal(self.prescaler_bits)
+			high = self.high = Signal(self._get_counter_bitwidth() - self.prescaler_bits)
+			high_is_zero = self.high_is_zero = Signal(reset=1)
+
+			# the high stage holds for at least two clocks after it changes, so what it needs 
+			# next time the low stage wraps can be registered a clock ahead
+			high_is_one = self.high_is_one = Signal()
+			high_minus_one = self.high_minus_one = Signal.like(high)
 			m.d.sync += [
-				countdown.eq(Mux(countdown>0, countdown-1, countdown)),
-				_ui.done.eq(countdown==1), # so a single pulse will occur as it reaches 0
-				# _ui.inactive.eq( (countdown==0) )#& ~_ui.done )
+				high_is_one.eq(high == 1),
+				high_minus_one.eq(high - 1),
 			]
-		
-		def add_reload_behaviour():
-			with m.If(_ui.load != 0):
-				m.d.sync += countdown.eq(_ui.load) # and plus one? or +/- a bias?
-		
-		add_countdown_behaviour()
-		add_reload_behaviour()
+
+			with m.If(self.ui.load != 0):
+				load_high = self.ui.load[self.prescaler_bits:len(low)+len(high)]
+				m.d.sync += [
+					low.eq(self.ui.load[:self.prescaler_bits]),
+					high.eq(load_high),
+					high_is_zero.eq(load_high == 0),
+					high_is_one.eq(load_high == 1), # in case the low stage wraps on the next clock
+					high_minus_one.eq(load_high - 1),
+				]
+			with m.Elif(low != 0):
+				m.d.sync += low.eq(low - 1)
+			with m.Elif(~high_is_zero):
+				m.d.sync += [
+					low.eq(low - 1), # wraps around to all ones
+					high.eq(high_minus_one),
+					high_is_zero.eq(high_is_one),
+				]
+
+			m.d.comb += self.ui.done.eq(high_is_zero & (low == 1))
+
+		if self.engine == "prescaled":
+			add_prescaled_countdown()
+		else:
+			add_binary_countdown()
 
 		return m
 
@@ -214,7 +265,7 @@ if __name__=="__main__":
 			("tb_fanout_flags",[
 				("trigger",		1,	DIR_FANOUT)
 			])
-		] + Delayer.ui_layout # todo - how to make the sharedTimer.ui layout be nested?
+		]
 
 		def __init__(self, config_params, utest_params = None, utest: FHDLTestCase = None):
 			super().__init__()
@@ -224,19 +275,23 @@ if __name__=="__main__":
 			self.utest_params = utest_params
 			self.utest = utest
 
+			if not hasattr(self.config_params, "engine"): self.config_params.engine = "binary"
+
+			# put in constructor so we can access in simulation processes
+			self.delayer = Delayer(clk_freq=self.config_params.clk_freq, engine=self.config_params.engine)
+
 		def elaborate(self, platform = None):
 			m = Module()
 
-			m.submodules.delayer = delayer = Delayer(clk_freq=self.config_params.clk_freq)
+			m.submodules.delayer = delayer = self.delayer
 
 			_ui = Record(Testbench.Testbench_ui_layout) #.like(self.ui)
 			# m.d.sync_1e6 += [
 			m.d.sync += [
 				self.ui.connect(_ui),
-				_ui.connect(delayer.ui, exclude=["tb_fanin_flags", "tb_fanout_flags"])
 			]
 
-			delayer.set_m_and_ui_to_use(m, _ui)
+			delayer.set_m_and_ui_to_use(m, delayer.ui)
 
 			if isinstance(self.utest, FHDLTestCase):
 				add_clock(m, "sync")
@@ -248,7 +303,8 @@ if __name__=="__main__":
 				# reset_sync = Signal(reset_less=True)
 				# m.d.sync += ResetSignal("sync").eq(reset_sync)
 
-				if test_id == "DelayerTestbench_sim_ThatSpecifiedDelay_TakesExpectedDuration":
+				if test_id in ["DelayerTestbench_sim_ThatSpecifiedDelay_TakesExpectedDuration",
+						"DelayerTestbench_sim_ThatFastForwardedDelay_EndsEarlyByTheClksSkipped"]:
 					assert platform == None, f"This is a time simulation, requiring a platform of None. Unexpected platform status of {platform}"
 
 					with m.FSM(name="testbench_fsm") as fsm:
@@ -268,39 +324,32 @@ if __name__=="__main__":
 						with m.State("DONE"):
 							...
 
-				elif test_id == "DelayerTestbench_bmc_ThatSpecifiedDelay_TakesExpectedDuration":
+				elif test_id in ["DelayerTestbench_bmc_ThatSpecifiedDelay_TakesExpectedDuration", 
+						"DelayerTestbench_bmc_ThatVariableDelay_TakesExpectedDuration"]:
 					assert platform == "formal", "This test can only run in formal mode"
 
-					timer_done = Signal()
-					timer_ought_to_finish = Signal()
-
-					# print(f"Using test period of {self.utest_params.test_period}, expected clks of {self.utest_params.expected_clks}")
-
-					with m.If(~ResetSignal("sync")): # todo - how to deal with reset signals? I recall something like this used to work last year
-
-						m.d.comb += [
-							timer_ought_to_finish.eq(Past(Initial(), clocks=self.utest_params.expected_clks-1)),
-						]
-
-						with m.If(~Initial()):
-							m.d.sync += [
-								Assume(_ui.load == 0),
-								# Assume(~ResetSignal("sync")), # causes 'assumptions are unsatisfiable' error
-							]
-
-					
-						with m.FSM(name="testbench_fsm"):
-							with m.State("RUNNING"): 
-								with m.If(delayer.delay_for_time(self.utest_params.test_period)):
-									m.next = "DONE"
-							with m.State("DONE"):
-								m.d.sync += [								
-									Assert(timer_ought_to_finish) # note! fails at small values
-									# Cover(_ui.done == 1)
-								]
+					# the delay runs over and over, and each time its state must last exactly expected_clks
+					if self.utest_params.variable_delay:
+						delay_clks = AnyConst(range(1, self.utest_params.expected_clks + 1))
+					else:
+						delay_clks = self.utest_params.expected_clks
+					clks_in_state = Signal(range(self.utest_params.expected_clks + 1))
+
+					with m.FSM(name="testbench_fsm"):
+						with m.State("IDLE"):
+							m.next = "RUNNING"
+						with m.State("RUNNING"): 
+							m.d.sync += clks_in_state.eq(clks_in_state + 1)
+							if self.utest_params.variable_delay:
+								done = delayer.delay_for_clks(delay_clks)
+							else:
+								done = delayer.delay_for_time(self.utest_params.test_period)
+							with m.If(done):
+								m.d.comb += Assert(clks_in_state == delay_clks - 1)
+								m.d.sync += clks_in_state.eq(0)
 								m.next = "IDLE"
-							with m.State("IDLE"):
-								...
+							with m.Else():
+								m.d.comb += Assert(clks_in_state < delay_clks - 1)
 
 
 			elif isinstance(platform, ULX3S_85F_Platform): 
@@ -338,16 +387,35 @@ if __name__=="__main__":
 
 					utest_params = Params()
 					utest_params.test_period = period
+					utest_params.variable_delay = False
 
 					def min_num_of_clk_cycles(freq_hz, period_sec):
 						return int(np.ceil(period_sec * freq_hz))
 					utest_params.expected_clks = min_num_of_clk_cycles(config_params.clk_freq, utest_params.test_period)
 					
-					dut = Testbench(config_params, utest_params, utest=self)
+					for engine in Delayer.engines:
+						config_params.engine = engine
+						dut = Testbench(config_params, utest_params, utest=self)
 					
-					self.assertFormal(dut, mode="bmc", depth=utest_params.expected_clks*2) # or cover/hybrid?
+						# long enough for the delay to be reused
+						self.assertFormal(dut, mode="bmc", depth=utest_params.expected_clks*2 + 4) # or cover/hybrid?
 				[test(period) for period in [1e-6, 100e-9, 50e-9, 10e-9, 1e-9] ]
 
+		class DelayerTestbench_bmc_ThatVariableDelay_TakesExpectedDuration(FHDLTestCase):
+			def test_formal(self):
+				config_params = Params()
+				config_params.clk_freq = 24e6
+
+				utest_params = Params()
+				utest_params.variable_delay = True
+				utest_params.expected_clks = 40 # the longest, as any delay of 1 to this many clks is tried, so the prescaler wraps
+
+				for engine in Delayer.engines:
+					config_params.engine = engine
+					dut = Testbench(config_params, utest_params, utest=self)
+
+					self.assertFormal(dut, mode="bmc", depth=utest_params.expected_clks*2 + 4)
+
 		# class formalTests_thatDelayCanBeReused_forConstAndSignal(FHDLTestCase):
 		# 	def test_formal(self):
 		# 		prams.clk_freq = 24e6
@@ -378,9 +446,10 @@ if __name__=="__main__":
 		
 		class DelayerTestbench_sim_ThatSpecifiedDelay_TakesExpectedDuration(FHDLTestCase):
 			def test_sim(self):
-				def test(period):
+				def test(period, engine):
 					config_params = Params()
 					config_params.clk_freq = 24e6
+					config_params.engine = engine
 
 					utest_params = Params()
 					utest_params.test_period = period
@@ -400,13 +469,13 @@ if __name__=="__main__":
 						test_clks = 0
 					
 						while True:
+							if (yield dut.ui.tb_fanin_flags.in_done):
+								break
+
 							if (yield dut.ui.tb_fanin_flags.in_start) or started:
 								started = True
 								measured_clks += 1
 							
-							if (yield dut.ui.tb_fanin_flags.in_done):
-								break
-							
 							test_clks += 1
 							if test_clks > (2*expected_clks) + 50:
 								print("Timeout, aborting")
@@ -418,17 +487,57 @@ if __name__=="__main__":
 
 						
 						print( f"The timer took with {measured_clks} cycles, and should have taken {expected_clks}")
-						# self.assertEqual(expected_clks, measured_clks, f"The timer took with {measured_clks} cycles, but should have taken {expected_clks}")
+						self.assertEqual(expected_clks, measured_clks, f"The timer took with {measured_clks} cycles, but should have taken {expected_clks}")
+					
+					sim = Simulator(dut)
+					sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+					sim.add_sync_process(process)
+
+					with sim.write_vcd(
+						f"{current_filename}_{self.get_test_id()}_period={period}_{engine}.vcd"):
+						sim.run()
+
+				[test(period, engine) for period in [100e-6, 10e-6, 1e-6, 100e-9, 50e-9, 10e-9, 1e-9] for engine in Delayer.engines]
+
+		class DelayerTestbench_sim_ThatFastForwardedDelay_EndsEarlyByTheClksSkipped(FHDLTestCase):
+			def test_sim(self):
+				def test(period, skip_from_clk, engine):
+					config_params = Params()
+					config_params.clk_freq = 24e6
+					config_params.engine = engine
+
+					utest_params = Params()
+					utest_params.test_period = period
+					
+					dut = Testbench(config_params, utest_params, utest=self)
+
+					expected_clks = int(np.ceil(config_params.clk_freq * utest_params.test_period))
+					
+					def process():
+						while not (yield dut.ui.tb_fanin_flags.in_start):
+							yield
+
+						# the start flag is registered, so the delay has been running for a clock already
+						measured_clks = 1
+						skipped_clks = 0
+						while not (yield dut.ui.tb_fanin_flags.in_done):
+							if measured_clks == skip_from_clk:
+								skipped_clks = (yield from dut.delayer.get_sim_clks_remaining()) - 3
+								yield from dut.delayer.sim_fast_forward(skipped_clks)
+							measured_clks += 1
+							yield
+
+						self.assertEqual(expected_clks, measured_clks - 1 + skipped_clks, f"The timer took {measured_clks - 1} cycles, after skipping {skipped_clks}")
 					
 					sim = Simulator(dut)
 					sim.add_clock(period=1/config_params.clk_freq, domain="sync")
 					sim.add_sync_process(process)
 
 					with sim.write_vcd(
-						f"{current_filename}_{self.get_test_id()}_period={period}.vcd"):
+						f"{current_filename}_{self.get_test_id()}_period={period}_{engine}.vcd"):
 						sim.run()
 
-				[test(period) for period in [100e-6, 10e-6, 1e-6, 100e-9, 50e-9, 10e-9, 1e-9] ]
+				[test(period, skip_from_clk, engine) for period in [100e-6, 10e-6] for skip_from_clk in [1, 5, 17] for engine in Delayer.engines]
 
 	if args.action in ["generate", "simulate"]:
 		# now run each FHDLTestCase above 
@@ -0,0 +1,206 @@
+import sys, os
+from termcolor import cprint
+from typing import List
+import textwrap
+import numpy as np
+import enum
+from functools import reduce
+from operator import or_
+
+from amaranth import Elaboratable, Module, Signal, Mux, ClockSignal, ClockDomain, ResetSignal, Cat, Const
+from amaranth.hdl.ast import Rose, Stable, Fell, Past, Initial, Value
+from amaranth.hdl.rec import DIR_NONE, DIR_FANOUT, DIR_FANIN, Layout, Record
+from amaranth.cli import main_parser, main_runner
+from amaranth.sim import Simulator, Delay, Tick, Passive, Active
+
+from amtest.boards.ulx3s.common.clks import add_clock
+from amtest.utils import FHDLTestCase, Params
+
+from Delayer import Delayer
+
+
+class Timer:
+	"""
+	A named timer, from TimerBank.get_timer().
+	It has the same delay_for_time() / delay_for_clks() as a Delayer, and its own load and done,
+	so the timers of one bank can be used from different modules.
+	"""
+
+	def __init__(self, bank, name, m, counter):
+		self.name = name
+		self.counter = counter
+		self.m = m
+		self.delayer = bank.delayers[counter]
+		self.ui = Record(Delayer.ui_layout, name=f"timer_{name}")
+
+	def delay_for_time(self, duration_sec):
+		return self.delay_for_clks(self.delayer.get_clks_for_time(duration_sec))
+
+	def delay_for_clks(self, clks):
+		return self.delayer.delay_for_clks_using(self.m, self.ui, clks)
+
+
+class TimerBank(Elaboratable):
+	"""
+	Serves many named timers from a few shared countdowns, so e.g. the init, refresh and low power
+	waits, of one or more modules, use one timing resource rather than a Delayer each.
+
+	Desired usage:
+		...
+		counter = timer_bank.get_counter()
+		init_timer = timer_bank.get_timer("init", m, counter)
+		refresh_timer = timer_bank.get_timer("refresh", m, counter)
+		...
+		with m.If(refresh_timer.delay_for_time(ic_timing.T_RC)):
+			m.next = "DO_ANOTHER_REFRESH?"
+		...
+
+	Notes:
+		- Timers on the same counter share its countdown, so they must never be running at the
+		same time, as for the call sites of one Delayer. Timers that may overlap go on different counters.
+		- get_counter() gives each module a counter of its own, so modules sharing the bank never share a countdown, 
+		and a timer from get_timer() without a counter has a counter of its own. The bank adds counters as needed
+		- Each timer's load is ORed into its counter, and each call site only adds a one bit flag.
+		- The bank needs to be elaborated after the modules using it, i.e. added as a submodule after them,
+		so all of its timers are known.
+	"""
+
+	def __init__(self, clk_freq, num_counters = 0, engine = "binary", utest: FHDLTestCase = None):
+		super().__init__()
+		self.utest = utest
+		self.clk_freq = clk_freq
+		self.engine = engine
+
+		self.delayers = [Delayer(clk_freq=clk_freq, engine=engine) for _ in range(num_counters)]
+		self.counters_given = set() # from get_counter(), or by a timer put on them
+		self.timers = {}
+		self.elaborated = False
+
+	def get_counter(self):
+		# the index of a counter that no one else is using, adding one if they are all in use
+		assert not self.elaborated, "A counter was asked for after the timer bank was elaborated, so add the bank as a submodule after the modules using it"
+		counter = min(set(range(len(self.delayers) + 1)) - self.counters_given)
+		if counter == len(self.delayers):
+			self.delayers.append(Delayer(clk_freq=self.clk_freq, engine=self.engine))
+		self.counters_given.add(counter)
+		return counter
+
+	def get_timer(self, name, m, counter = None):
+		assert not self.elaborated, f"Timer {name} was added after the timer bank was elaborated, so add the bank as a submodule after the modules using it"
+		assert name not in self.timers, f"There is already a timer named {name}"
+		if counter == None:
+			counter = self.get_counter()
+		assert counter < len(self.delayers), f"Timer {name} is on counter {counter}, but there are only {len(self.delayers)}"
+		self.counters_given.add(counter)
+
+		self.timers[name] = Timer(self, name, m, counter)
+		return self.timers[name]
+
+	def elaborate(self, platform = None):
+		m = Module()
+		self.elaborated = True
+
+		for i, delayer in enumerate(self.delayers):
+			m.submodules[f"counter_{i}"] = delayer
+
+			timers = [timer for timer in self.timers.values() if timer.counter == i]
+			if len(timers) == 0:
+				continue
+
+			m.d.comb += delayer.ui.load.eq(reduce(or_, [timer.ui.load for timer in timers]))
+			m.d.comb += [timer.ui.done.eq(delayer.ui.done) for timer in timers]
+
+		return m
+
+
+if __name__=="__main__":
+	from pathlib import Path
+	current_filename = str(Path(__file__).absolute()).split(".py")[0]
+
+	parser = main_parser()
+	args = parser.parse_args()
+
+	class Testbench(Elaboratable):
+		def __init__(self, config_params, utest_params = None, utest: FHDLTestCase = None):
+			super().__init__()
+
+			self.config_params = config_params
+			self.utest_params = utest_params
+			self.utest = utest
+
+			# put in constructor so we can access in simulation processes
+			self.in_state = {name: Signal(name=f"in_{name}") for name in self.utest_params.delay_clks}
+
+		def elaborate(self, platform = None):
+			m = Module()
+
+			timer_bank = TimerBank(clk_freq=self.config_params.clk_freq)
+
+			if isinstance(self.utest, FHDLTestCase):
+				add_clock(m, "sync")
+				test_id = self.utest.get_test_id()
+
+				if test_id == "TimerBankTestbench_sim_ThatNamedTimers_TakeExpectedDurations":
+					# a and b run one after the other, so share a counter, while c runs alongside them on its own
+					delay_clks = self.utest_params.delay_clks
+					ab_counter = timer_bank.get_counter()
+					timers = {
+						"a": timer_bank.get_timer("a", m, ab_counter),
+						"b": timer_bank.get_timer("b", m, ab_counter),
+						"c": timer_bank.get_timer("c", m),
+					}
+
+					def add_fsm(name, states):
+						with m.FSM(name=f"{name}_fsm") as fsm:
+							for state, next_state in zip(states, states[1:] + ["DONE"]):
+								with m.State(state):
+									with m.If(timers[state].delay_for_clks(delay_clks[state])):
+										m.next = next_state
+							with m.State("DONE"):
+								...
+						m.d.comb += [self.in_state[state].eq(fsm.ongoing(state)) for state in states]
+
+					add_fsm("ab", ["a", "b"])
+					add_fsm("c", ["c"])
+
+			m.submodules.timer_bank = timer_bank # after the timers are added
+
+			return m
+
+	if args.action == "generate":
+		...
+
+	elif args.action == "simulate":
+
+		class TimerBankTestbench_sim_ThatNamedTimers_TakeExpectedDurations(FHDLTestCase):
+			def test_sim(self):
+				config_params = Params()
+				config_params.clk_freq = 24e6
+
+				utest_params = Params()
+				utest_params.delay_clks = {"a": 7, "b": 30, "c": 20}
+
+				dut = Testbench(config_params, utest_params, utest=self)
+
+				def process():
+					measured_clks = {name: 0 for name in utest_params.delay_clks}
+					for _ in range(100):
+						for name in utest_params.delay_clks:
+							measured_clks[name] += (yield dut.in_state[name])
+						yield
+
+					self.assertEqual(measured_clks, utest_params.delay_clks)
+
+				sim = Simulator(dut)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				sim.add_sync_process(process)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+	if args.action in ["generate", "simulate"]:
+		# now run each FHDLTestCase above
+		import unittest
+		sys.argv[1:] = [] # so the args used for this file don't interfere with unittest
+		unittest.main()
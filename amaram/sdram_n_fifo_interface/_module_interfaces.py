@@ -60,6 +60,7 @@ class controller_readwrite_interfaces:
 				("task",	rw_cmds,	DIR_FANOUT),
 				("addr",	config_params.rw_params.get_ADDR_BITS(),	DIR_FANOUT),
 				("w_data",	config_params.rw_params.DATA_BITS.value,	DIR_FANOUT),
+				("ready",	1,	DIR_FANIN), # whether a new burst can be started this clock
 			]),
 			("r_cipo", [
 				# this is to recieve the pipelined read that is
@@ -68,7 +69,8 @@ class controller_readwrite_interfaces:
 				("addr",	config_params.rw_params.get_ADDR_BITS(),	DIR_FANIN),
 				("r_data",	config_params.rw_params.DATA_BITS.value,	DIR_FANIN),
 			]),
-			("in_progress",		1,		DIR_FANIN)
+			("in_progress",		1,		DIR_FANIN),
+			("refresh_in_progress",	1,	DIR_FANOUT) # the refresh controller has the bus, and precharges all banks
 		]
 
 		return ui_layout
@@ -130,6 +132,12 @@ class controller_pin_interfaces:
 		return io_layout
 
 class controller_refresh_interfaces:
+	@staticmethod
+	def get_refresh_deadline_bits(config_params):
+		# the deadline is at most 2*refresh_debt_limit refresh intervals away, when all those refreshes are pulled in
+		clks_per_refresh = int(np.ceil(config_params.ic_refresh_timing.T_REF.value * config_params.clk_freq) / config_params.ic_refresh_timing.NUM_REF.value)
+		return bits_for(2 * config_params.refresh_debt_limit * clks_per_refresh)
+
 	@staticmethod
 	def get_ui_layout(config_params):
 		ui_layout = [
@@ -137,7 +145,13 @@ class controller_refresh_interfaces:
 				# ("startup_complete",	1,		DIR_FANIN),
 				("request_to_refresh_soon",	1,	DIR_FANIN),	# 
 				("enable_refresh",	1,			DIR_FANOUT),
+				("sdram_idle",	1,				DIR_FANOUT),	# nothing is waiting to use the sdram, so refreshes can be pulled in
+				("sdram_empty",	1,				DIR_FANOUT),	# no data is stored in the sdram, so refreshes can be skipped
 				("refresh_in_progress",	1,		DIR_FANIN),
-				("refresh_lapsed",	1,			DIR_FANIN) # to indicate whether data loss from a lack of refreshing has occurred
+				("refresh_lapsed",	1,			DIR_FANIN), # to indicate whether data loss from a lack of refreshing has occurred
+				("low_power",	1,				DIR_FANIN),	# the sdram is in self refresh or power down
+				("self_refresh",	1,			DIR_FANOUT),	# hold the sdram in self refresh, e.g. through a warm restart
+				("warm_restarted",	1,			DIR_FANIN),	# the last reset skipped the initialisation, so the sdram contents were kept
+				("refresh_deadline",	controller_refresh_interfaces.get_refresh_deadline_bits(config_params),	DIR_FANIN), # clocks until a refresh can't be postponed any longer
 			]
 		return ui_layout
\ No newline at end of file
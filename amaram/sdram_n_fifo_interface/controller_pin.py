@@ -55,8 +55,10 @@ class controller_pin(Elaboratable):
 		# if isinstance(self.utest, FHDLTestCase):
 		if (self.utest_params.use_sdram_model if hasattr(self.utest_params, "use_sdram_model") else False):
 			from model_sdram import model_sdram_sims, model_sdram
-			# put in the constructor so we can access the simulation processes
-			self.sdram_model = model_sdram(self.config_params, self.utest_params)
+			# put in the constructor so we can access the simulation processes.
+			# A model class in utest_params.model_sdram_rtl, i.e. model_sdram_rtl, is used instead if given
+			model_class = self.utest_params.model_sdram_rtl if hasattr(self.utest_params, "model_sdram_rtl") else model_sdram
+			self.sdram_model = model_class(self.config_params, self.utest_params)
 	
 	def get_sim_sync_processes(self):
 		for process, domain in self.sdram_model.get_sim_sync_processes():
@@ -422,6 +424,7 @@ if __name__ == "__main__":
 				utest_params = Params()
 				utest_params.test_cmds = sdram_cmds
 				utest_params.use_sdram_model = True
+				utest_params.model_check_timing = False # as each command is sent two clocks after the last
 
 				tb = Testbench(config_params, utest_params, utest=self)
 
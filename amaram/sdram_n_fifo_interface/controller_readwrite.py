@@ -14,7 +14,7 @@ from amaranth.hdl.xfrm import DomainRenamer
 from amaranth.cli import main_parser, main_runner
 from amaranth.sim import Simulator, Delay, Tick, Passive, Active, Settle
 from amaranth.asserts import Assert, Assume, Cover, Past
-from amaranth.lib.fifo import AsyncFIFOBuffered
+from amaranth.lib.fifo import AsyncFIFOBuffered, SyncFIFO
 #from amaranth.lib.cdc import AsyncFFSynchronizer
 from amaranth.lib.cdc import FFSynchronizer
 from amaranth.build import Platform
@@ -34,7 +34,7 @@ from amtest.utils import FHDLTestCase, Params
 from controller_pin import controller_pin
 from Delayer import Delayer
 
-from parameters_standard_sdram import sdram_cmds, rw_cmds
+from parameters_standard_sdram import sdram_cmds, rw_cmds, mode_latency, get_mode_latency, addr_mapping
 
 from controller_refresh import controller_refresh
 from _module_interfaces import controller_pin_interfaces, controller_readwrite_interfaces
@@ -85,8 +85,8 @@ for writes, this class needs to do:
 
 	|<---t_ra ?------------------------>|	
 			(assume t_ra_clks = 3)
-										col from Past(..., clocks=t_ra_clks)
-										data from col from Past(..., clocks=t_ra_clks, t_ra_clks+1)
+										col held from the request, in the bank that takes it
+										data held in a fifo from the request, until the write is issued
 
 
 for reads, similar but with a 'pipeline' thing to send data back to the fifo controller
@@ -123,6 +123,10 @@ dqm: from datasheet
 then, imagine these commands, but interlaced, so the sdram has near 100% uptime!
 note that there is a bit of 'wasted' clock cycles when transitioning from read to writes, but writes commands (from the fifo controller) can transition to reads in the next clock cycle..
 
+the bank fsms don't drive the cmd/addr bus themselves. Each posts the command it wants into bank_cmd_array,
+and a scheduler issues at most one legal command per clock, so the activate for one bank can overlap
+the burst of another on the dq bus. As this can delay a write, its data waits in a fifo until then.
+
 
 """
 
@@ -147,6 +151,15 @@ class controller_readwrite(Elaboratable):
 		# add some default parameters. Could this be done better?
 		if not hasattr(self.config_params, "burstlen"): 	self.config_params.burstlen = 8
 		if not hasattr(self.config_params, "readback_addr_offset"): self.config_params.readback_addr_offset = 4 # to match timing of readback data when going through various clocked buffers
+		if not hasattr(self.config_params, "open_page_policy"): self.config_params.open_page_policy = False # leave rows open after a burst, rather than auto-precharging
+		if not hasattr(self.config_params, "latency"): self.config_params.latency = get_mode_latency(self.config_params.clk_freq, self.config_params.ic_timing).value # cas latency, in clocks
+		if not hasattr(self.config_params, "cmd_queue_depth"): self.config_params.cmd_queue_depth = 4 # requests that can wait for their bank
+		# one entry is kept spare for a request posted before ready falls, so with a depth of 1 ready is
+		# never high, and with 2 it is only high when the queue is empty
+		assert self.config_params.cmd_queue_depth >= 3, f"cmd_queue_depth of {self.config_params.cmd_queue_depth} is too shallow, it needs to be at least 3"
+		if not hasattr(self.config_params, "addr_mapping"): self.config_params.addr_mapping = addr_mapping.ROW_COL_BANK
+		if not hasattr(self.config_params, "bank_xor_row"): self.config_params.bank_xor_row = False # xor the bank with the low row bits, to spread rows over banks
+		if not hasattr(self.config_params, "full_page_bursts"): self.config_params.full_page_bursts = False # use the full page burst mode, ending each burst with a burst stop
 		
 		
 	def elaborate(self, platform = None):
@@ -156,9 +169,36 @@ class controller_readwrite(Elaboratable):
 		ic_timing = self.config_params.ic_timing
 		rw_params = self.config_params.rw_params
 
-		# assume this for now, but later generate the values from these from the given timing settings
-		t_ra_clks = 3
-		t_cas_clks = 3
+		# the cas latency is also loaded into the mode register by the refresh controller
+		assert (mode_latency(self.config_params.latency) != mode_latency.MODE_CAS_2) or \
+			((1/self.config_params.clk_freq) >= ic_timing.T_CK_CL2.value), "cas latency of 2 is too short for this clock frequency"
+		t_ra_clks = min_num_of_clk_cycles(self.config_params.clk_freq, ic_timing.T_RCD.value)
+		t_cas_clks = self.config_params.latency
+
+		# the rest of the timing is only checked by the command scheduler
+		t_rp_clks = min_num_of_clk_cycles(self.config_params.clk_freq, ic_timing.T_RP.value)
+		t_rc_clks = min_num_of_clk_cycles(self.config_params.clk_freq, ic_timing.T_RC.value)
+		t_ras_clks = min_num_of_clk_cycles(self.config_params.clk_freq, ic_timing.T_RAS.value)
+		t_rrd_clks = min_num_of_clk_cycles(self.config_params.clk_freq, ic_timing.T_RRD.value)
+		t_dpl_clks = min_num_of_clk_cycles(self.config_params.clk_freq, ic_timing.T_DPL.value)
+		t_dal_clks = min_num_of_clk_cycles(self.config_params.clk_freq, ic_timing.T_DAL.value)
+
+		# With the full page burst mode, a burst can be up to a whole row long, and is ended with a burst stop.
+		# There is no auto precharge for full page bursts, so the row is left open like the open page policy
+		if self.config_params.full_page_bursts:
+			assert self.config_params.burstlen <= (1 << rw_params.COL_BITS.value), "a full page burst can't be longer than a row"
+		else:
+			assert self.config_params.burstlen in [1, 2, 4, 8], "without full page bursts, the burst length must be 1, 2, 4 or 8"
+		leave_rows_open = self.config_params.open_page_policy or self.config_params.full_page_bursts
+
+		# With the open page policy, rows are left open after a burst, so a row hit can go straight to 
+		# its read/write, and a row miss first precharges the old row
+		if leave_rows_open:
+			cmd_write = sdram_cmds.CMD_WRITE
+			cmd_read = sdram_cmds.CMD_READ
+		else:
+			cmd_write = sdram_cmds.CMD_WRITE_AP
+			cmd_read = sdram_cmds.CMD_READ_AP
 
 		# make inter-module interfaces
 		_ui = Record.like(self.ui)
@@ -180,7 +220,6 @@ class controller_readwrite(Elaboratable):
 		# connect the readback pipeline internally
 		m.d.sync += [
 			_ui.r_cipo.read_active.eq(_controller_pin_ui.rw_cipo.read_active), 
-			_ui.r_cipo.addr.eq(Past(_controller_pin_ui.rw_cipo.addr, clocks=t_cas_clks + t_ra_clks - 1)), 
 			_ui.r_cipo.r_data.eq(_controller_pin_ui.rw_cipo.dq)
 		]
 
@@ -190,25 +229,62 @@ class controller_readwrite(Elaboratable):
 		# _controller_pin_ui.rw_cipo.addr.eq(Past(self.controller_pin_ui.rw_cipo.addr, clocks=t_cas_clks))
 
 
-		# make_row_column_and_bank_from_address
-		row = Signal(rw_params.ROW_BITS.value)
-		col = Signal(rw_params.COL_BITS.value)
-		bank = Signal(rw_params.BANK_BITS.value)
-		data = Signal(rw_params.DATA_BITS.value)
-
 		num_banks = 1<<rw_params.BANK_BITS.value
-
 		burst_bits = bits_for(self.config_params.burstlen-1)
+
+		def make_row_column_and_bank_from_address(addr, name):
+			# a burst always stays within one row of one bank, as its words only differ in the low column bits.
+			# Reads are identified by the address the caller gave, so the readback path needs no mapping
+			row = Signal(rw_params.ROW_BITS.value, name=f"{name}_row")
+			col = Signal(rw_params.COL_BITS.value, name=f"{name}_col")
+			bank = Signal(rw_params.BANK_BITS.value, name=f"{name}_bank")
+			unhashed_bank = Signal(rw_params.BANK_BITS.value, name=f"{name}_unhashed_bank")
+
+			mapping = addr_mapping(self.config_params.addr_mapping)
+			if mapping == addr_mapping.ROW_COL_BANK:
+				m.d.comb += Cat(col[:burst_bits], unhashed_bank, col[burst_bits:], row).eq(addr)
+			elif mapping == addr_mapping.ROW_BANK_COL:
+				m.d.comb += Cat(col, unhashed_bank, row).eq(addr)
+			elif mapping == addr_mapping.BANK_ROW_COL:
+				m.d.comb += Cat(col, row, unhashed_bank).eq(addr)
+
+			if self.config_params.bank_xor_row:
+				m.d.comb += bank.eq(unhashed_bank ^ row[:rw_params.BANK_BITS.value])
+			else:
+				m.d.comb += bank.eq(unhashed_bank)
+			return row, col, bank
+
+		data = Signal(rw_params.DATA_BITS.value)
+		task = Signal(rw_cmds)
+		addr = Signal(rw_params.get_ADDR_BITS())
+
 		burst_index = Signal(burst_bits)
 		m.d.sync += [
-			Cat(col[:burst_bits], bank, col[burst_bits:], row).eq(_ui.rw_copi.addr),
 			data.eq(_ui.rw_copi.w_data),
+			task.eq(_ui.rw_copi.task),
+			addr.eq(_ui.rw_copi.addr),
 
 			# this index is where are we in the current burst,
 			burst_index.eq(_ui.rw_copi.addr[:burst_bits])
 		]
 
-		
+		new_request = Signal()
+		m.d.comb += new_request.eq((burst_index == 0) & (task != rw_cmds.RW_IDLE))
+
+		# requests wait here until the bank they are for is idle, so a burst can be posted while earlier ones 
+		# are still on the bus. The row, column and bank are decoded from the request at the front of the queue
+		m.submodules.cmd_queue = cmd_queue = SyncFIFO(width=len(task) + len(addr), depth=self.config_params.cmd_queue_depth)
+		queued_task = Signal(rw_cmds)
+		queued_addr = Signal(rw_params.get_ADDR_BITS())
+		m.d.comb += [
+			cmd_queue.w_data.eq(Cat(task, addr)),
+			cmd_queue.w_en.eq(new_request),
+			Cat(queued_task, queued_addr).eq(cmd_queue.r_data),
+
+			# one entry is kept spare, for a burst posted in the clocks before the caller sees ready fall
+			_ui.rw_copi.ready.eq((cmd_queue.w_level + new_request) < (self.config_params.cmd_queue_depth - 1)),
+		]
+		row, col, bank = make_row_column_and_bank_from_address(queued_addr, name="queued")
 
 		# # set default values
 		# m.d.sync += [
@@ -227,16 +303,170 @@ class controller_readwrite(Elaboratable):
 			("dqm",					1)
 		]) for i in range(num_banks)) # for debuging, so we can see bus contention etc
 
+		# each bank posts the command it wants to issue here, and the scheduler grants at most one per clock. 
+		# The wait counters count down to zero, at which point that kind of command is legal for that bank again
+		ticket_bits = bits_for(num_banks)
+		wait_bits = bits_for(self.config_params.burstlen + max(t_rc_clks, t_ras_clks, t_dpl_clks, t_dal_clks, t_rp_clks))
+		bank_cmd_array = Array(Record([
+			("request",		1),
+			("cmd",			sdram_cmds),
+			("a",			rw_params.A_BITS.value),
+			("grant",		1),
+			("accepted",	1), # a new request was accepted by this bank this clock
+			("ticket",		ticket_bits), # the order of this bank's read/write, relative to other banks
+			("act_wait",	wait_bits),
+			("cas_wait",	wait_bits),
+			("pre_wait",	wait_bits),
+		]) for i in range(num_banks))
+
+		# reads/writes are issued in the order their requests were accepted, so bursts use the dq bus in request order
+		next_ticket = Signal(ticket_bits)
+		serving_ticket = Signal(ticket_bits)
+		with m.If(Cat([_bank_cmd.accepted for _bank_cmd in bank_cmd_array]).any()):
+			m.d.comb += cmd_queue.r_en.eq(1)
+			m.d.sync += next_ticket.eq(next_ticket + 1)
+
+		# write data is held here until its write is issued, as the request may be queued, and the scheduler 
+		# may delay that write by a variable number of clocks
+		m.submodules.w_data_fifo = w_data_fifo = SyncFIFO(width=rw_params.DATA_BITS.value, 
+			depth=(num_banks + self.config_params.cmd_queue_depth)*self.config_params.burstlen)
+		w_data_words_to_push = Signal(range(self.config_params.burstlen))
+		write_posted = Signal()
+		m.d.comb += [
+			write_posted.eq(new_request & (task == rw_cmds.RW_WRITE)),
+			w_data_fifo.w_data.eq(data),
+			w_data_fifo.w_en.eq(write_posted | (w_data_words_to_push != 0)),
+		]
+		with m.If(write_posted):
+			m.d.sync += w_data_words_to_push.eq(self.config_params.burstlen-1)
+		with m.Elif(w_data_words_to_push != 0):
+			m.d.sync += w_data_words_to_push.eq(w_data_words_to_push - 1)
+
+		# the address of each read is queued here at its read cmd, and is then counted through its burst as the words 
+		# come back, so r_cipo.addr is the address of the word in r_cipo.r_data. Reads finish in the order they are issued.
+		# A read's address is in the fifo from its read cmd until its last word comes back, and reads are at least a burst
+		# apart, so this is deep enough for back to back reads, with one more as a full fifo can't be written in the
+		# clock its oldest address is read out. A read also isn't issued while the fifo is full
+		read_pipeline_clks = 1 + self.config_params.latency + self.config_params.readback_addr_offset
+		read_tag_fifo_depth = int(np.ceil(read_pipeline_clks / self.config_params.burstlen)) + 2
+		m.submodules.read_tag_fifo = read_tag_fifo = SyncFIFO(width=rw_params.get_ADDR_BITS(), depth=read_tag_fifo_depth)
+		readback_beat = Signal(burst_bits)
+		with m.If(_controller_pin_ui.rw_cipo.read_active):
+			m.d.sync += [
+				_ui.r_cipo.addr.eq(read_tag_fifo.r_data + readback_beat),
+				readback_beat.eq(readback_beat + 1),
+			]
+			with m.If(readback_beat == self.config_params.burstlen-1):
+				m.d.comb += read_tag_fifo.r_en.eq(1)
+				m.d.sync += readback_beat.eq(0)
+
 		adding_to_readback_bus = Signal()
 		m.d.comb += [
 			adding_to_readback_bus.eq(Cat([_bank_using.readback_bus for _bank_using in bank_using_array]).any()),
 			_controller_pin_ui.dqm.eq(Cat([_bank_using.dqm for _bank_using in bank_using_array]).all()),
 			_controller_pin_ui.rw_copi.read_active.eq(Cat([_bank_using.read_active for _bank_using in bank_using_array]).any()),
-			_ui.in_progress.eq(Cat([_bank_using.in_progress for _bank_using in bank_using_array]).any())
+			_ui.in_progress.eq(Cat([_bank_using.in_progress for _bank_using in bank_using_array]).any() | cmd_queue.r_rdy | new_request)
 		]
 
+		def wait_at_least(counter, clks):
+			# the command this counter guards becomes legal again clks clocks after this one
+			clks = max(clks, 1)
+			return counter.eq(Mux(counter > (clks-1), counter, clks-1))
+
+		def add_command_scheduler():
+			""" 
+			This is the only place that drives the cmd/addr bus. Each clock it issues at most one 
+			of the commands posted by the banks, picking one that meets tRRD, tRCD, tRAS, tRP, tRC, 
+			tDPL/tDAL and dq bus turnaround. Reads/writes go first, as they keep the dq bus busy, 
+			and the activate or precharge for another bank can then overlap that burst. 
+			With full page bursts, a burst stop has to be issued on the exact clock its burst ends, 
+			so it goes before everything else.
+			"""
+			rrd_wait = Signal(wait_bits)			# any activate, to the next activate
+			cas_busy = Signal(wait_bits)			# the dq bus is busy with the previous burst
+			read_to_write_wait = Signal(wait_bits)	# read data has to leave the dq bus before write data is driven
+
+			for counter in [rrd_wait, cas_busy, read_to_write_wait] + \
+					[getattr(_bank_cmd, name) for _bank_cmd in bank_cmd_array for name in ["act_wait", "cas_wait", "pre_wait"]]:
+				with m.If(counter != 0):
+					m.d.sync += counter.eq(counter - 1)
+
+			# which posted commands are legal this clock
+			cas_legal = []
+			act_pre_legal = []
+			for bank_id, bank_cmd in enumerate(bank_cmd_array):
+				cas_legal.append(Signal(name=f"bank_{bank_id}_cas_legal"))
+				act_pre_legal.append(Signal(name=f"bank_{bank_id}_act_pre_legal"))
+				m.d.comb += [
+					cas_legal[-1].eq(
+						(((bank_cmd.cmd == cmd_read) & read_tag_fifo.w_rdy) | ((bank_cmd.cmd == cmd_write) & (read_to_write_wait == 0))) & 
+						(bank_cmd.cas_wait == 0) & (cas_busy == 0) & (bank_cmd.ticket == serving_ticket)),
+					act_pre_legal[-1].eq(
+						((bank_cmd.cmd == sdram_cmds.CMD_ACT) & (bank_cmd.act_wait == 0) & (rrd_wait == 0)) |
+						((bank_cmd.cmd == sdram_cmds.CMD_PRE) & (bank_cmd.pre_wait == 0))),
+				]
+
+			passes = ["cas", "act_pre"]
+			if self.config_params.full_page_bursts:
+				passes.insert(0, "bst")
+
+			first = True
+			for cmd_pass in passes:
+				for bank_id, (bank_cmd, bank_using) in enumerate(zip(bank_cmd_array, bank_using_array)):
+					legal = {
+						"bst" : bank_cmd.cmd == sdram_cmds.CMD_BST,
+						"cas" : cas_legal[bank_id],
+						"act_pre" : act_pre_legal[bank_id],
+					}[cmd_pass]
+					with (m.If if first else m.Elif)(bank_cmd.request & legal):
+						m.d.comb += bank_cmd.grant.eq(1)
+						m.d.sync += [
+							bank_using.cmd_and_addr_bus.eq(1),
+							_controller_pin_ui.cmd.eq(bank_cmd.cmd),
+							_controller_pin_ui.rw_copi.ba.eq(bank_id), # constant for this bank
+							_controller_pin_ui.rw_copi.a.eq(bank_cmd.a),
+						]
+
+						if cmd_pass == "cas":
+							m.d.sync += [
+								serving_ticket.eq(serving_ticket + 1),
+								cas_busy.eq(self.config_params.burstlen-1),
+							]
+							with m.If(bank_cmd.cmd == cmd_write):
+								# the last write data is at burstlen-1, then tDPL before precharge, or tDAL before the auto precharge finishes
+								m.d.sync += wait_at_least(bank_cmd.pre_wait, self.config_params.burstlen-1 + t_dpl_clks)
+								if not leave_rows_open:
+									m.d.sync += wait_at_least(bank_cmd.act_wait, self.config_params.burstlen-1 + t_dal_clks)
+							with m.Else():
+								m.d.sync += [
+									read_to_write_wait.eq(t_cas_clks + self.config_params.burstlen), # plus a clock of turnaround
+									wait_at_least(bank_cmd.pre_wait, self.config_params.burstlen),
+								]
+								if not leave_rows_open:
+									m.d.sync += wait_at_least(bank_cmd.act_wait, self.config_params.burstlen + t_rp_clks)
+						elif cmd_pass == "act_pre":
+							with m.If(bank_cmd.cmd == sdram_cmds.CMD_ACT):
+								m.d.sync += [
+									rrd_wait.eq(max(t_rrd_clks, 1) - 1),
+									bank_cmd.cas_wait.eq(max(t_ra_clks, 1) - 1),
+									wait_at_least(bank_cmd.act_wait, t_rc_clks),
+									wait_at_least(bank_cmd.pre_wait, t_ras_clks),
+								]
+							with m.Else():
+								m.d.sync += wait_at_least(bank_cmd.act_wait, t_rp_clks)
+					first = False
+
 		# for bank_id, bank_using in enumerate([bank_using_array[0]]):
-		for bank_id, bank_using in enumerate(bank_using_array):
+		for bank_id, (bank_using, bank_cmd) in enumerate(zip(bank_using_array, bank_cmd_array)):
+			req_task = Signal(rw_cmds, name=f"bank_{bank_id}_req_task")
+			req_addr = Signal(rw_params.get_ADDR_BITS(), name=f"bank_{bank_id}_req_addr")
+			req_row, req_col, _ = make_row_column_and_bank_from_address(req_addr, name=f"bank_{bank_id}_req")
+			beat = Signal(range(2*t_cas_clks + self.config_params.burstlen), name=f"bank_{bank_id}_beat")
+
+			# only used when rows are left open, to track which row this bank has left open
+			open_row = Signal(rw_params.ROW_BITS.value, name=f"bank_{bank_id}_open_row")
+			row_open = Signal(name=f"bank_{bank_id}_row_open")
+
 			with m.FSM(name=f"rw_bank_{bank_id}_fsm") as fsm:
 				""" 
 				todo:
@@ -251,122 +481,145 @@ class controller_readwrite(Elaboratable):
 					bank_using.dqm.eq(1),
 					bank_using.cmd_and_addr_bus.eq(0),
 					bank_using.data_bus.eq(0),
-					bank_using.in_progress.eq(~fsm.ongoing("IDLE"))
+					# also wait for any auto precharge to finish, so a refresh can't start before then.
+					# A request accepted this clock has left the queue but not yet left IDLE, so count it too
+					bank_using.in_progress.eq(~fsm.ongoing("IDLE") | bank_cmd.accepted | (bank_cmd.act_wait != 0))
 				]
 
 				with m.State("IDLE"):
-					with m.If((bank == bank_id) & (burst_index == 0) & (Past(_ui.rw_copi.task) != rw_cmds.RW_IDLE)):
+					with m.If(cmd_queue.r_rdy & (bank == bank_id)):
+						m.d.comb += bank_cmd.accepted.eq(1)
 						m.d.sync += [
-							bank_using.cmd_and_addr_bus.eq(1),
-							_controller_pin_ui.cmd.eq(sdram_cmds.CMD_ACT),
-							_controller_pin_ui.rw_copi.ba.eq(bank_id),#Past(bank_id)),	 # past of a const doesn't make sense
-							_controller_pin_ui.rw_copi.a.eq(row),#Past(row)),
+							req_task.eq(queued_task),
+							req_addr.eq(queued_addr),
+							bank_cmd.ticket.eq(next_ticket),
 						]
-						m.next = "WAS_ACTIVE_NOP1"
+						if leave_rows_open:
+							with m.If(row_open & (open_row == row)):
+								m.next = "CAS"
+							with m.Elif(row_open):
+								m.next = "PRECHARGE"
+							with m.Else():
+								m.next = "ACTIVATE"
+						else:
+							m.next = "ACTIVATE"
 
-				with m.State("WAS_ACTIVE_NOP1"): # todo - instead of this gap thing, use a delayer with T_RA
-					m.next = "NOP3"
+				with m.State("PRECHARGE"):
+					m.d.comb += [
+						bank_cmd.request.eq(1),
+						bank_cmd.cmd.eq(sdram_cmds.CMD_PRE),
+					]
+					with m.If(bank_cmd.grant):
+						m.d.sync += row_open.eq(0)
+						m.next = "ACTIVATE"
+
+				with m.State("ACTIVATE"):
+					m.d.comb += [
+						bank_cmd.request.eq(1),
+						bank_cmd.cmd.eq(sdram_cmds.CMD_ACT),
+						bank_cmd.a.eq(req_row),
+					]
+					with m.If(bank_cmd.grant):
+						m.d.sync += [
+							open_row.eq(req_row),
+							row_open.eq(1)
+						]
+						m.next = "CAS"
 
-				with m.State("NOP3"):
-					with m.If(Past(_ui.rw_copi.task, clocks=t_ra_clks) == rw_cmds.RW_WRITE):
-						m.next = "WRITE_0"
-					
-					with m.Elif(Past(_ui.rw_copi.task, clocks=t_ra_clks) == rw_cmds.RW_READ):
-						m.next = "READ_-3"
+				with m.State("CAS"):
+					m.d.comb += [
+						bank_cmd.request.eq(1),
+						bank_cmd.a.eq(req_col),
+					]
+					with m.If(req_task == rw_cmds.RW_WRITE):
+						m.d.comb += bank_cmd.cmd.eq(cmd_write)
+						with m.If(bank_cmd.grant):
+							m.d.comb += w_data_fifo.r_en.eq(1)
+							m.d.sync += [
+								bank_using.data_bus.eq(1),
+								_controller_pin_ui.rw_copi.dq.eq(w_data_fifo.r_data),
+								bank_using.dqm.eq(0),  # dqm low synchronous with write data
+							]
+							m.d.sync += beat.eq(1)
+							if self.config_params.burstlen > 1:
+								m.next = "WRITE"
+							else:
+								m.next = "BURST_STOP" if self.config_params.full_page_bursts else "IDLE"
 
 					with m.Else():
-						m.next = "ERROR"
+						m.d.comb += bank_cmd.cmd.eq(cmd_read)
+						with m.If(bank_cmd.grant):
+							# do a check to see if the dqm condition was met. Should this be in simulation
+							# rather than in rtl?
+							# with m.If(Cat([Past(_controller_pin_ui.dqm, clocks=1+j) for j in range(3)]) != 0b111):
+							# 	m.next = "ERROR"
+							m.d.sync += [
+								bank_using.dqm.eq(0),
+								beat.eq(1),
+							]
+							# this records the global address that the read occurred at,
+							# so it can more easily identify read data in the read pipeline
+							m.d.comb += [
+								read_tag_fifo.w_data.eq(req_addr),
+								read_tag_fifo.w_en.eq(1),
+							]
+							m.next = "READ"
 				
 				##################### write ###############################
 
-				with m.State("WRITE_0"):
+				# beat counts the clocks since the write cmd, which had the first word
+				with m.State("WRITE"):
+					m.d.comb += w_data_fifo.r_en.eq(1)
 					m.d.sync += [
-						bank_using.cmd_and_addr_bus.eq(1),
 						bank_using.data_bus.eq(1),
-						_controller_pin_ui.cmd.eq(sdram_cmds.CMD_WRITE_AP),
-						_controller_pin_ui.rw_copi.ba.eq(bank_id), # constant for this bank
-
-						# 13mar2022 note: bug if this does not start from zero. It seems that the use of past(<clks>) here is used before <clks> has elapsed, 
-						# resulting in a zero-value, that can be bypassed if we start from zero. And potentially this goes away if we refresh first... let's start from zero for now.
-						_controller_pin_ui.rw_copi.a.eq(Past(col, clocks=t_ra_clks)),
-						_controller_pin_ui.rw_copi.dq.eq(Past(data, clocks=t_ra_clks)),
-
+						_controller_pin_ui.rw_copi.dq.eq(w_data_fifo.r_data),
 						bank_using.dqm.eq(0),  # dqm low synchronous with write data
+						beat.eq(beat + 1),
 					]
-					m.next = "WRITE_1"
-				
-				for i in range(self.config_params.burstlen-1): # is the -1 needed?
-					byte_id = i+1
-					with m.State(f"WRITE_{byte_id}"):
-						m.d.sync += [
-							bank_using.data_bus.eq(1),
-							_controller_pin_ui.rw_copi.dq.eq(Past(data, clocks=t_ra_clks)),
-							bank_using.dqm.eq(0),  # dqm low synchronous with write data
+					with m.If(beat == self.config_params.burstlen-1):
+						m.next = "BURST_STOP" if self.config_params.full_page_bursts else "IDLE" #"IDLE_END"
+
+				# a full page burst would carry on until the end of the row and wrap around, 
+				# so stop it in the clock after the last write data
+				if self.config_params.full_page_bursts:
+					with m.State("BURST_STOP"):
+						m.d.comb += [
+							bank_cmd.request.eq(1),
+							bank_cmd.cmd.eq(sdram_cmds.CMD_BST),
 						]
-
-						if byte_id < (self.config_params.burstlen)-1:
-							m.next = f"WRITE_{byte_id+1}"
-						else:
-							m.next = "IDLE" #"IDLE_END"
+						with m.If(bank_cmd.grant):
+							m.next = "IDLE"
 
 				##################### read ###############################
 
-				with m.State("READ_-3"):
-					# do a check to see if the dqm condition was met. Should this be in simulation
-					# rather than in rtl?
-					# with m.If(Cat([Past(_controller_pin_ui.dqm, clocks=1+j) for j in range(3)]) != 0b111):
-					# 	m.next = "ERROR"
-
-					m.d.sync += [
-						bank_using.cmd_and_addr_bus.eq(1),
-						_controller_pin_ui.cmd.eq(sdram_cmds.CMD_READ_AP),
-						_controller_pin_ui.rw_copi.ba.eq(bank_id), # constant for this bank
-						_controller_pin_ui.rw_copi.a.eq(Past(col, clocks=t_ra_clks)),
-						bank_using.dqm.eq(0),
-
-						# this records the global address that the read occurred at,
-						# so it can more easily identify read data in the read pipeline
-						_controller_pin_ui.rw_copi.addr.eq(Past(_ui.rw_copi.addr, clocks=t_ra_clks)),
-						# _controller_pin_ui.rw_copi.addr.eq(Past(_ui.rw_copi.addr, clocks=t_ra_clks)),
-					]
-					m.next = "READ_-2"
-				
-				for i in range(self.config_params.burstlen+2):
-					byte_id = i-2
-					with m.State(f"READ_{byte_id}"):
-						if byte_id in [b-2 for b in range(self.config_params.burstlen-1)]:
-							m.d.sync += [
-								bank_using.dqm.eq(0), # assuming this is 2 clks before a read
-								_controller_pin_ui.rw_copi.addr.eq(Past(_ui.rw_copi.addr, clocks=t_ra_clks)),
-								# _controller_pin_ui.rw_copi.addr.eq(_controller_pin_ui.rw_copi.addr + 1),
-							]
-						
-						if byte_id in [b for b in range(self.config_params.burstlen)]:
-							m.d.sync += [
-								# bank_using.dqm.eq(0),  # dqm low synchronous with write data
-								bank_using.read_active.eq(1)
+				# beat counts the clocks since the read cmd. The words are read back t_cas_clks later, 
+				# then the bank stays busy for another t_cas_clks
+				with m.State("READ"):
+					with m.If(beat < self.config_params.burstlen):
+						m.d.sync += bank_using.dqm.eq(0) # assuming this is 2 clks before a read
+
+					# the burst stop ends the read data t_cas_clks later, so issue it burstlen clocks after the read
+					if self.config_params.full_page_bursts:
+						with m.If(beat == self.config_params.burstlen):
+							m.d.comb += [
+								bank_cmd.request.eq(1),
+								bank_cmd.cmd.eq(sdram_cmds.CMD_BST),
 							]
 
-						if byte_id < (self.config_params.burstlen)-1:
-							m.next = f"READ_{byte_id+1}"
-						else:
-							# m.d.sync += bank_using.read_active.eq(0)
-							# m.next = "IDLE" #"IDLE_END"
-							m.next = f"IDLE_{-t_ra_clks}"
-					
-				for i in range(-t_ra_clks, 0):
-					with m.State(f"IDLE_{i}"):
-						if i == -3:
-							m.d.sync += bank_using.read_active.eq(0)
+					with m.If((beat >= t_cas_clks) & (beat < t_cas_clks + self.config_params.burstlen)):
+						m.d.sync += bank_using.read_active.eq(1)
+					with m.Elif(beat == t_cas_clks + self.config_params.burstlen):
+						m.d.sync += bank_using.read_active.eq(0)
 
-						if i < -1:
-							m.next = f"IDLE_{i+1}"
-						else:
-							m.next = "IDLE"
+					m.d.sync += beat.eq(beat + 1)
+					with m.If(beat == 2*t_cas_clks + self.config_params.burstlen - 1):
+						m.next = "IDLE"
 
-				with m.State("ERROR"):
-					...
+			# the refresh controller precharges all banks before refreshing, so no rows are left open
+			with m.If(_ui.refresh_in_progress):
+				m.d.sync += row_open.eq(0)
 
+		add_command_scheduler()
 
 		...
 
@@ -423,22 +676,41 @@ if __name__ == "__main__":
 				yield process, domain
 
 			test_id = self.utest.get_test_id()
-			if test_id == "readwriteCtrl_sim_thatWritingThenReadingBack_readsCorrectValues":
+			if test_id in [
+					"readwriteCtrl_sim_thatWritingThenReadingBack_readsCorrectValues",
+					"readwriteCtrl_sim_withRtlModel_thatWritingThenReadingBack_readsCorrectValues",
+					"readwriteCtrl_sim_withRtlModelAndRecordedTrace_thatTheCommandBus_meetsTheTimingAndReadsBackWhatWasWritten",
+					"readwriteCtrl_sim_withCasLatencyOf2_thatWritingThenReadingBack_readsCorrectValues",
+					"readwriteCtrl_sim_withShortBursts_thatWritingThenReadingBack_readsCorrectValues",
+					"readwriteCtrl_sim_withRowBankColMappingAndBankXor_thatWritingThenReadingBackAcrossRows_readsCorrectValues",
+					"readwriteCtrl_sim_withOpenPagePolicy_thatWritingThenReadingBackAcrossRows_readsCorrectValues",
+					"readwriteCtrl_sim_withFullPageBursts_thatWritingThenReadingBack_readsCorrectValues",
+					"readwriteCtrl_sim_withRtlModelAndFullPageBursts_thatWritingThenReadingBack_readsCorrectValues",
+					"readwriteCtrl_sim_withRtlModelAndAliasedRows_thatWordsOverwrittenFromAnotherRow_readBackAsBead"]:
+				self.words_read_back = 0
+				num_full_bursts = 8 # e.g.
+
 				def use_ui_and_see_if_correct_rw_behaviour():
-					num_full_bursts = 8 # e.g.
 
 					# note: bug if this does not start from zero. It seems that the use of past(<clks>) here is used before <clks> has elapsed, 
 					# resulting in a zero-value, that can be bypassed if we start from zero. And potentially this goes away if we refresh first... let's start from zero for now.
-					addr_offset = 0x0000
+					# Later offsets can be used to make each bank change row, e.g. to cause row misses with the open page policy
+					addr_offsets = self.utest_params.addr_offsets if hasattr(self.utest_params, "addr_offsets") else [0x0000]
 
-					while not (yield self.refresher.ui.initialised):
-						yield self.readwriter.ui.rw_copi.task.eq(rw_cmds.RW_IDLE)
-						yield
+					yield self.readwriter.ui.rw_copi.task.eq(rw_cmds.RW_IDLE)
+					model = self.pin_ctrl.sdram_model.model if hasattr(self.pin_ctrl.sdram_model, "model") else self.pin_ctrl.sdram_model
+					yield from self.refresher.sim_wait_until_initialised(model)
 
-					for action in [rw_cmds.RW_WRITE, rw_cmds.RW_READ]:
+					for action, addr_offset in [(action, addr_offset) for action in [rw_cmds.RW_WRITE, rw_cmds.RW_READ] for addr_offset in addr_offsets]:
 						for i in range(self.config_params.burstlen * num_full_bursts):
 							i += addr_offset
 
+							# a burst can only be started when the controller is ready for it
+							if (i % self.config_params.burstlen) == 0:
+								while not (yield self.readwriter.ui.rw_copi.ready):
+									yield self.readwriter.ui.rw_copi.task.eq(rw_cmds.RW_IDLE)
+									yield
+
 							if action == rw_cmds.RW_WRITE:
 								yield self.readwriter.ui.rw_copi.w_data.eq(i)
 							elif action == rw_cmds.RW_READ:
@@ -459,9 +731,13 @@ if __name__ == "__main__":
 						for _ in range(10):
 							yield
 					
-					# a few extra clocks at the end
+					# wait for the queued requests to finish, then a few extra clocks at the end
+					while (yield self.readwriter.ui.in_progress):
+						yield
 					for _ in range(20):
 						yield
+
+					assert self.words_read_back == self.config_params.burstlen * num_full_bursts * len(addr_offsets), "every word written was read back"
 				yield use_ui_and_see_if_correct_rw_behaviour, "sync"
 
 
@@ -475,6 +751,13 @@ if __name__ == "__main__":
 							data = (yield self.readwriter.ui.r_cipo.r_data)
 							addr = (yield self.readwriter.ui.r_cipo.addr)
 							print(f"Read at address={hex(addr)}, data={hex(data)}")
+							# unless the rtl model only stores the low row bits, and the word was then written again from another row
+							overwritten_addr_offsets = self.utest_params.overwritten_addr_offsets if hasattr(self.utest_params, "overwritten_addr_offsets") else []
+							if any((offset <= addr < offset + self.config_params.burstlen * num_full_bursts) for offset in overwritten_addr_offsets):
+								assert data == 0xBEAD, "a word overwritten from another row reads back as 0xBEAD"
+							else:
+								assert data == addr, "each word was written with its own address as data"
+							self.words_read_back += 1
 						yield
 				yield print_readback_data, "sync"
 
@@ -491,7 +774,8 @@ if __name__ == "__main__":
 			m.d.sync += [
 				self.pin_ctrl.ui.bus_is_refresh_not_readwrite.eq(self.refresher.ui.enable_refresh | self.refresher.ui.refresh_in_progress),
 				self.refresher.controller_pin_ui.connect(self.pin_ctrl.ui.refresh),
-				self.readwriter.controller_pin_ui.connect(self.pin_ctrl.ui.readwrite)
+				self.readwriter.controller_pin_ui.connect(self.pin_ctrl.ui.readwrite),
+				self.readwriter.ui.refresh_in_progress.eq(self.refresher.ui.enable_refresh | self.refresher.ui.refresh_in_progress)
 			]
 
 			if isinstance(self.utest, FHDLTestCase):
@@ -637,7 +921,282 @@ if __name__ == "__main__":
 					f"{current_filename}_{self.get_test_id()}.vcd"):
 					sim.run()
 
-				
+		class readwriteCtrl_sim_withShortBursts_thatWritingThenReadingBack_readsCorrectValues(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_sims
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 143e6
+				config_params.burstlen = 2 # so more reads are in flight than there are banks
+				config_params.latency = 3
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.debug_flags = Array(Signal(name=f"debug_flag_{i}") for i in range(6))
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+		class readwriteCtrl_sim_withRtlModel_thatWritingThenReadingBack_readsCorrectValues(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_rtl
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 143e6
+				config_params.burstlen = 8
+				config_params.latency = 3
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.model_sdram_rtl = model_sdram_rtl # so the model has no simulation processes
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+		class readwriteCtrl_sim_withRtlModelAndRecordedTrace_thatTheCommandBus_meetsTheTimingAndReadsBackWhatWasWritten(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_rtl
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 143e6
+				config_params.burstlen = 8
+				config_params.latency = 3
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.model_sdram_rtl = model_sdram_rtl
+				utest_params.model_record_trace = True # the timing and data are checked from the trace, after the simulation
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+				self.assertEqual(tb.pin_ctrl.sdram_model.cmd_trace.check(), {})
+
+		class readwriteCtrl_sim_withRtlModelAndFullPageBursts_thatWritingThenReadingBack_readsCorrectValues(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_rtl
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 143e6
+				config_params.burstlen = 32 # so the model's mode register is reset to full page bursts, as the refresh controller loads
+				config_params.latency = 3
+				config_params.full_page_bursts = True
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.model_sdram_rtl = model_sdram_rtl
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+		class readwriteCtrl_sim_withRtlModelAndAliasedRows_thatWordsOverwrittenFromAnotherRow_readBackAsBead(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_rtl
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 143e6
+				config_params.burstlen = 8
+				config_params.latency = 3
+				config_params.model_rtl_row_bits = 1 # so rows 0 and 2 share their words in the model
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.model_sdram_rtl = model_sdram_rtl
+				# everything is written before it is read back, so the words in row 0 are overwritten from row 2
+				utest_params.addr_offsets = [0x0000, 2 << (rw_params.COL_BITS.value + rw_params.BANK_BITS.value)]
+				utest_params.overwritten_addr_offsets = [0x0000]
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+		class readwriteCtrl_sim_withRowBankColMappingAndBankXor_thatWritingThenReadingBackAcrossRows_readsCorrectValues(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_sims
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 143e6
+				config_params.burstlen = 8
+				config_params.latency = 3
+				config_params.addr_mapping = addr_mapping.ROW_BANK_COL
+				config_params.bank_xor_row = True
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.debug_flags = Array(Signal(name=f"debug_flag_{i}") for i in range(6))
+				# consecutive bursts stay in one bank, and the next row is moved to the next bank by the xor
+				utest_params.addr_offsets = [0x0000, 1 << (rw_params.COL_BITS.value + rw_params.BANK_BITS.value)]
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+		class readwriteCtrl_sim_withCasLatencyOf2_thatWritingThenReadingBack_readsCorrectValues(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_sims
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 100e6 # slow enough for a cas latency of 2, which is then used as .latency isn't given
+				config_params.burstlen = 8
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.debug_flags = Array(Signal(name=f"debug_flag_{i}") for i in range(6))
+
+				tb = Testbench(config_params, utest_params, utest=self)
+				assert config_params.latency == 2
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+		class readwriteCtrl_sim_withOpenPagePolicy_thatWritingThenReadingBackAcrossRows_readsCorrectValues(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_sims
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 143e6
+				config_params.burstlen = 8
+				config_params.latency = 3
+				config_params.open_page_policy = True
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.debug_flags = Array(Signal(name=f"debug_flag_{i}") for i in range(6))
+				# the second offset is in the next row of every bank, so each bank sees hits, then misses
+				utest_params.addr_offsets = [0x0000, 1 << (rw_params.BANK_BITS.value + rw_params.COL_BITS.value)]
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+		class readwriteCtrl_sim_withFullPageBursts_thatWritingThenReadingBack_readsCorrectValues(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+				from model_sdram import model_sdram_sims
+
+				config_params = Params()
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.clk_freq = 143e6
+				config_params.burstlen = 32 # longer than the 8 words allowed without full page bursts, but short enough to simulate quickly
+				config_params.latency = 3
+				config_params.full_page_bursts = True
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.use_sdram_model = True
+				utest_params.debug_flags = Array(Signal(name=f"debug_flag_{i}") for i in range(6))
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
 
 	if args.action in ["generate", "simulate"]:
 		# now run each FHDLTestCase above 
@@ -11,7 +11,7 @@ from amaranth.hdl.rec import DIR_NONE, DIR_FANOUT, DIR_FANIN, Layout, Record
 from amaranth.hdl.mem import Memory
 from amaranth.hdl.xfrm import DomainRenamer
 from amaranth.cli import main_parser, main_runner
-from amaranth.sim import Simulator, Delay, Tick, Passive, Active
+from amaranth.sim import Simulator, Delay, Tick, Passive, Active, Settle
 from amaranth.asserts import Assert, Assume, Cover, Past
 from amaranth.lib.fifo import AsyncFIFOBuffered
 #from amaranth.lib.cdc import AsyncFFSynchronizer
@@ -31,9 +31,10 @@ from amtest.boards.ulx3s.common.clks import add_clock
 from amtest.utils import FHDLTestCase, Params
 
 from controller_pin import controller_pin
-from Delayer import Delayer
+from TimerBank import TimerBank
 
-from parameters_standard_sdram import sdram_cmds, rw_cmds
+from parameters_standard_sdram import (sdram_cmds, rw_cmds, mode_burst_length, mode_burst_type, 
+	mode_latency, mode_operation, mode_write_burst, get_mode_latency)
 from _module_interfaces import controller_pin_interfaces, controller_refresh_interfaces
 
 """ 
@@ -49,6 +50,15 @@ Goals
 		for refresh, and then assert 'disable'.
 	- To indicate to other modules when any refresh is occuring or ends with the 'idle' flag,
 		so they are able to transition back into using the sdram.
+- To skip refreshes entirely while 'sdram_empty' is high, as then there is no data to preserve.
+- To put the sdram in a low power mode after 'sdram_idle' has been high for low_power_idle_time. 
+	This is self refresh, or power down if there is no data to preserve. It is left once 'sdram_idle' 
+	falls, in low_power_exit_clks, which includes T_XSR.
+- To hold the sdram in self refresh while 'self_refresh' is high, e.g. ahead of a soft reset. With 
+	warm_restart, the initialisation is then skipped after the reset, and the sdram just leaves self refresh.
+- To hide refreshes from the other modules where possible. Up to refresh_debt_limit refreshes 
+	are postponed while the sdram is busy, and up to that many are pulled in early while 
+	'sdram_idle' is high, so most refreshes are done when nothing else is waiting.
 """
 
 class controller_refresh(Elaboratable):
@@ -57,23 +67,40 @@ class controller_refresh(Elaboratable):
 	- initial power up, mode register set
 	- refreshes, incl. self- and auto- (which may involve power saving?)
 
-	todo 15nov2021 - make this handle delayed refreshes, 
-	so the refresh requirements are never exceeded
+	The refresh debt counts the refreshes due (one every T_REF/NUM_REF) less those done. 
+	It goes negative when refreshes are pulled in, and a refresh is only requested 
+	while the sdram is busy once the debt reaches refresh_debt_limit.
 	"""
 	
 
-	def __init__(self, config_params, utest_params = None, utest: FHDLTestCase = None):
+	def __init__(self, config_params, utest_params = None, utest: FHDLTestCase = None, timer_bank: TimerBank = None):
 		super().__init__()
-		self.controller_pin_ui = Record(controller_pin_interfaces.get_sub_ui_layout(config_params))
-		self.ui = Record(controller_refresh_interfaces.get_ui_layout(config_params))
 
 		self.config_params = config_params
 		self.utest_params = utest_params
 		self.utest = utest
+		self.timer_bank = timer_bank # to share one with other modules, otherwise this makes its own
+
+		if not hasattr(self.config_params, "open_page_policy"): self.config_params.open_page_policy = False # whether the readwrite controller leaves rows open
+		if not hasattr(self.config_params, "burstlen"): self.config_params.burstlen = 8
+		if not hasattr(self.config_params, "full_page_bursts"): self.config_params.full_page_bursts = False # whether the readwrite controller uses full page bursts, ended by a burst stop
+		if not hasattr(self.config_params, "latency"): self.config_params.latency = get_mode_latency(self.config_params.clk_freq, self.config_params.ic_timing).value # cas latency, in clocks
+		if not hasattr(self.config_params, "refresh_debt_limit"): self.config_params.refresh_debt_limit = 8 # refreshes that can be postponed or pulled in, up to 8 for JEDEC sdr sdram
+		if not hasattr(self.config_params, "low_power_idle_time"): self.config_params.low_power_idle_time = None # seconds of sdram_idle before self refresh/power down, or None to stay powered
+		if not hasattr(self.config_params, "warm_restart"): self.config_params.warm_restart = False # whether a reset while in self refresh skips the initialisation
+		if not hasattr(self.config_params, "delayer_engine"): self.config_params.delayer_engine = "binary" # or "prescaled", for a timer that is off the critical path
+
+		# after the defaults, as the refresh deadline width depends on the debt limit
+		self.controller_pin_ui = Record(controller_pin_interfaces.get_sub_ui_layout(config_params))
+		self.ui = Record(controller_refresh_interfaces.get_ui_layout(config_params))
 		
 		self.clks_per_period = int(np.ceil(self.config_params.ic_refresh_timing.T_REF.value * self.config_params.clk_freq))
 		self.increment_per_refresh = int(self.clks_per_period / self.config_params.ic_refresh_timing.NUM_REF.value)
 
+		# the clocks from sdram_idle falling to refresh_in_progress falling, when leaving self refresh. 
+		# A clock to raise clk_en, T_XSR of nops, then a clock to finish
+		self.low_power_exit_clks = 1 + int(np.ceil(self.config_params.ic_timing.T_XSR.value * self.config_params.clk_freq)) + 1
+
 	def elaborate(self, platform = None):
 		
 		m = Module()
@@ -81,11 +108,17 @@ class controller_refresh(Elaboratable):
 		ic_timing = self.config_params.ic_timing
 		ic_refresh_timing = self.config_params.ic_refresh_timing
 
-		# these four lines allow the concise delayer. ...() structure below
-		m.submodules.delayer = delayer = Delayer(clk_freq=self.config_params.clk_freq)
-		delayer_ui = Record.like(delayer.ui)
-		m.d.sync += delayer_ui.connect(delayer.ui)
-		delayer.set_m_and_ui_to_use(m, delayer_ui)
+		# these timers allow the concise timer.delay_for_time() structure below.
+		# Only one is running at a time, so they all share a counter of the timer bank, 
+		# which is this module's own, so other modules sharing the bank don't disturb them
+		if self.timer_bank != None:
+			timer_bank = self.timer_bank
+		else:
+			timer_bank = TimerBank(clk_freq=self.config_params.clk_freq, engine=self.config_params.delayer_engine)
+		counter = timer_bank.get_counter()
+		init_timer = self.init_timer = timer_bank.get_timer("refresher_init", m, counter) # kept for sim_wait_until_initialised()
+		refresh_timer = timer_bank.get_timer("refresher_refresh", m, counter)
+		low_power_timer = timer_bank.get_timer("refresher_low_power", m, counter)
 
 		_ui = Record.like(self.ui)
 		_controller_pin_ui = Record.like(self.controller_pin_ui)
@@ -103,27 +136,62 @@ class controller_refresh(Elaboratable):
 			_controller_pin_ui.clk_en.eq(1)
 		]
 
-		with m.FSM(domain="sync", name="controller_refresh_fsm") as fsm:
-
-			 # up to 8192. set the level lower down, based on refresh level
-			refreshes_to_do = Signal(shape=bits_for(ic_refresh_timing.NUM_REF.value))
+		# rows may have been left open by the readwrite controller, so precharge them first
+		leave_rows_open = self.config_params.open_page_policy or self.config_params.full_page_bursts
+		first_refresh_state = "PRECHARGE_ALL" if leave_rows_open else "DO_ANOTHER_REFRESH?"
+
+		if self.config_params.full_page_bursts:
+			mode_burstlen = mode_burst_length.MODE_BURSTLEN_PAGE
+		else:
+			mode_burstlen = mode_burst_length[f"MODE_BURSTLEN_{self.config_params.burstlen}"]
+
+		# counts how long the sdram has been idle for, up to when the low power mode is used
+		use_low_power = self.config_params.low_power_idle_time != None
+		if use_low_power:
+			low_power_idle_clks = self.low_power_idle_clks = int(np.ceil(self.config_params.low_power_idle_time * self.config_params.clk_freq))
+			idle_clks = self.idle_clks = Signal(range(low_power_idle_clks + 1)) # kept for sim_fast_forward_refresh_gap()
+			with m.If(~_ui.sdram_idle):
+				m.d.sync += idle_clks.eq(0)
+			with m.Elif(idle_clks != low_power_idle_clks):
+				m.d.sync += idle_clks.eq(idle_clks + 1)
+			long_idle = idle_clks == low_power_idle_clks
+		else:
+			long_idle = Const(0)
+			self.idle_clks = None
+
+		# survives a reset of the sync domain, as the clk_en pin is held low through the reset, 
+		# so the sdram is still initialised and in self refresh afterwards
+		if self.config_params.warm_restart:
+			sdram_in_self_refresh = Signal(reset_less=True)
+		else:
+			sdram_in_self_refresh = Const(0)
 
-			# assuming refreshing exists to preserve data that has already been loaded,
-			# i.e. after reset, there is no data yet to preserve, so the reset value reflects this 
-			refresh_level = Signal(shape=bits_for(self.clks_per_period), reset=self.clks_per_period)
+		with m.FSM(domain="sync", name="controller_refresh_fsm") as fsm:
+			self.fsm = fsm # kept for sim_fast_forward_refresh_gap(), as are the counters below
+
+			# Refresh timing is kept by two narrow counters, rather than one counting every clock of T_REF.
+			# The fine counter is a prescaler that wraps once per refresh interval (T_REF/NUM_REF), and the 
+			# coarse counter is the refresh debt, which only changes by one at a time. 
+			# The debt is negative when refreshes have been pulled in, and positive when they have been postponed.
+			# It reaches NUM_REF if a whole T_REF passes without refreshing, and then it stops there.
+			debt_limit = self.config_params.refresh_debt_limit
+			refresh_debt = self.refresh_debt = Signal(range(-debt_limit, ic_refresh_timing.NUM_REF.value + 1))
+			refresh_interval = self.refresh_interval = Signal(range(self.increment_per_refresh), reset=self.increment_per_refresh-1)
 		
 			m.d.sync += [
-				refresh_level.eq(Mux(refresh_level > 0, refresh_level - 1, 0)),
+				# one more refresh is due every increment_per_refresh clocks
+				refresh_interval.eq(Mux(refresh_interval > 0, refresh_interval - 1, refresh_interval.reset)),
+				refresh_debt.eq(refresh_debt 
+					+ ((refresh_interval == 0) & (refresh_debt < ic_refresh_timing.NUM_REF.value)) 
+					- (_controller_pin_ui.cmd == sdram_cmds.CMD_REF)),
 
-				# so if refresh_level is 0, then refreshes_to_do needs to be 8192. note that 8192 is 1<<13
-				# and if refresh_level is self.clks_per_period, then refreshes_to_do would be zero. 
-				# so we should scale the highest 14 bytes of self.clks_per_period-refresh_level and set it here,
-				# in order to get a number between 0 and 8192. Note that this will round down, which provides a 
-				# way to actually reach zero and so finish periodically.
-				refreshes_to_do.eq((self.clks_per_period-refresh_level)[-14:]),
+				# clocks until the debt limit is reached, so the fifo logic can plan its bursts around the next refresh.
+				# (debt_limit-1-refresh_debt) is small when it's used, so only its low bits go into the constant multiply
+				_ui.refresh_deadline.eq(Mux(refresh_debt < debt_limit,
+					(debt_limit - 1 - refresh_debt)[:bits_for(2*debt_limit - 1)] * self.increment_per_refresh + refresh_interval, 0)),
 
 				# provide an external indicator, e.g. for a LED or some error flag
-				_ui.refresh_lapsed.eq(fsm.ongoing("ERROR_REFRESH_LAPSED"))
+				_ui.refresh_lapsed.eq(fsm.ongoing("ERROR_REFRESH_LAPSED")),
 			]
 
 			with m.State("AFTER_RESET"):
@@ -136,40 +204,46 @@ class controller_refresh(Elaboratable):
 						with m.State("POWERUP"):
 							m.next = "POWERUP_WAITING"
 						with m.State("POWERUP_WAITING"):
-							with m.If(delayer.delay_for_time(ic_timing.T_STARTUP)):
+							with m.If(init_timer.delay_for_time(ic_timing.T_STARTUP)):
 								m.next = "PRECH_BANKS"
 
 						with m.State("PRECH_BANKS"):
 							m.d.sync += _controller_pin_ui.cmd.eq(sdram_cmds.CMD_PALL)
 							m.next = "PRECH_BANKS_WAITING"
 						with m.State("PRECH_BANKS_WAITING"):
-							with m.If(delayer.delay_for_time(ic_timing.T_RP)):
+							with m.If(init_timer.delay_for_time(ic_timing.T_RP)):
 								m.next = "AUTO_REFRESH_1"
 
 						with m.State("AUTO_REFRESH_1"):
 							m.d.sync += _controller_pin_ui.cmd.eq(sdram_cmds.CMD_REF)
 							m.next = "AUTO_REFRESH_1_WAITING"
 						with m.State("AUTO_REFRESH_1_WAITING"):
-							with m.If(delayer.delay_for_time(ic_timing.T_RC)):
+							with m.If(init_timer.delay_for_time(ic_timing.T_RC)):
 								m.next = "AUTO_REFRESH_2"
 						
 						with m.State("AUTO_REFRESH_2"):
 							m.d.sync += _controller_pin_ui.cmd.eq(sdram_cmds.CMD_REF)
 							m.next = "AUTO_REFRESH_2_WAITING"
 						with m.State("AUTO_REFRESH_2_WAITING"):
-							with m.If(delayer.delay_for_time(ic_timing.T_RC)):
+							with m.If(init_timer.delay_for_time(ic_timing.T_RC)):
 								m.next = "LOAD_MODE_REG"
 
 						with m.State("LOAD_MODE_REG"):
 							m.d.sync += [
 								_controller_pin_ui.cmd.eq(sdram_cmds.CMD_MRS),
-								_controller_pin_ui.rw_copi.a[:10].eq(0b0000110011) # burst=8, sequential; latency=3
+								_controller_pin_ui.rw_copi.a[:10].eq(Cat( # sequential; burst length and latency from config_params
+									Const(mode_burstlen.value, 3),
+									Const(mode_burst_type.MODE_BSTTYPE_SEQ.value, 1),
+									Const(mode_latency(self.config_params.latency).value, 3),
+									Const(mode_operation.MODE_STANDARD.value, 2),
+									Const(mode_write_burst.MODE_WBST_ENABLE.value, 1),
+								)),
 								# _controller_pin_ui.a[:10].eq(0b0000110010) # burst=4, sequential; latency=3
 								# _controller_pin_ui.a[:10].eq(0b0000110001) # burst=2, sequential; latency=3
 							]
 							m.next = "LOAD_MODE_REG_WAITING"
 						with m.State("LOAD_MODE_REG_WAITING"):
-							with m.If(delayer.delay_for_time(ic_timing.T_MRD)):
+							with m.If(init_timer.delay_for_time(ic_timing.T_MRD)):
 								m.next = "DONE"
 
 						with m.State("DONE"):
@@ -177,17 +251,38 @@ class controller_refresh(Elaboratable):
 							...
 					
 					return _ui.initialised
-				with m.If(initialise_and_load_mode_register()):
-					m.d.sync += refreshes_to_do.eq(0) 
+				initialised = initialise_and_load_mode_register()
+				with m.If(sdram_in_self_refresh):
+					# a warm restart, so skip the power up wait and mode register set
+					m.d.sync += [
+						_ui.refresh_in_progress.eq(1),
+						_ui.warm_restarted.eq(1),
+					]
+					m.next = "SELF_REFRESH_EXIT"
+				with m.Elif(initialised):
+					m.d.sync += [
+						refresh_debt.eq(0),
+						refresh_interval.eq(refresh_interval.reset),
+					]
 					m.next = "READY_FOR_NORMAL_OPERATION"
 
 
 			with m.State("READY_FOR_NORMAL_OPERATION"):
 				# at this point, the sdram chip is available for normal read/write operation
-				# with m.If(delayer.delay_for_clks(self.increment_per_refresh - (self.clks_per_period-refresh_level))):
-				# with m.If(refreshes_to_do > int(0.5 * ic_refresh_timing.NUM_REF.value)): # if we're at 50% refresh level,
-				with m.If(refreshes_to_do > 10): # let's arbitarily set 10 as our threshold
-					# m.d.sync += refreshes_to_do.eq(1)
+				# nothing stored in the sdram needs preserving, so skip refreshes, and start 
+				# again with a fresh refresh budget once some data is stored
+				with m.If(long_idle | _ui.self_refresh):
+					m.next = "REQUEST_REFRESH_SOON" # to get the bus, for the low power mode
+
+				with m.Elif(_ui.sdram_empty):
+					m.d.sync += [
+						refresh_debt.eq(0),
+						refresh_interval.eq(refresh_interval.reset),
+					]
+
+				# postpone refreshes while the sdram is busy, until the debt limit is reached,
+				# and pull them in while it is idle
+				with m.Elif((refresh_debt >= debt_limit) | (_ui.sdram_idle & (refresh_debt > -debt_limit))):
 					m.next = "REQUEST_REFRESH_SOON"
 
 			with m.State("REQUEST_REFRESH_SOON"):
@@ -196,54 +291,167 @@ class controller_refresh(Elaboratable):
 					m.d.sync += [
 						_ui.refresh_in_progress.eq(1),
 					]
-					m.next = "DO_ANOTHER_REFRESH?"
-				with m.Elif(refreshes_to_do == ic_refresh_timing.NUM_REF.value):
+					m.next = first_refresh_state
+				with m.Elif(refresh_debt == ic_refresh_timing.NUM_REF.value):
 					m.next = "ERROR_REFRESH_LAPSED"
 				
 			with m.State("ERROR_REFRESH_LAPSED"): 
 				# this means data loss occurred. but if there's no data, then it's fine.
 				# However in this case, if we're now treating the data as lost, then
-				# we should reset the refresh_level to max, i.e. otherwise we would
+				# we should clear the refresh debt, i.e. otherwise we would
 				# be wasting time preserving garbage data.
 				m.d.sync += _ui.request_to_refresh_soon.eq(1)
 				with m.If(_ui.enable_refresh):
-					m.d.sync += [
-						refresh_level.eq(refresh_level.reset),
-					]
-					m.next = "DO_ANOTHER_REFRESH?"
+					m.d.sync += refresh_debt.eq(0)
+					m.next = first_refresh_state
+
+			if leave_rows_open:
+				with m.State("PRECHARGE_ALL"):
+					m.d.sync += _controller_pin_ui.cmd.eq(sdram_cmds.CMD_PALL)
+					m.next = "PRECHARGE_ALL_WAITING"
+				with m.State("PRECHARGE_ALL_WAITING"):
+					with m.If(refresh_timer.delay_for_time(ic_timing.T_RP)):
+						m.next = "DO_ANOTHER_REFRESH?"
 
 			with m.State("DO_ANOTHER_REFRESH?"):
 				m.d.sync += _ui.request_to_refresh_soon.eq(0)
-				with m.If(refreshes_to_do > 0):
-					# m.d.sync += refreshes_to_do.eq(refreshes_to_do - 1) # so we only do one refresh normally
+				# catch up on postponed refreshes, then keep pulling them in for as long as nothing else needs the sdram
+				with m.If((refresh_debt > 0) | (_ui.sdram_idle & ~_ui.sdram_empty & (refresh_debt > -debt_limit))):
 					m.next = "AUTO_REFRESH"
 
+				with m.Elif(long_idle | _ui.self_refresh):
+					# all banks are precharged, as needed for self refresh and power down
+					with m.If(_ui.sdram_empty & ~_ui.self_refresh):
+						m.next = "POWER_DOWN"
+					with m.Else():
+						m.next = "SELF_REFRESH_ENTRY"
+
 				with m.Else():
 					# finish up here
 					m.d.sync += _ui.refresh_in_progress.eq(0)
 					with m.If(~_ui.initialised):
-						m.d.sync += [
-							refresh_level.eq(refresh_level.reset),
-							 _ui.initialised.eq(1)
-						]
+						m.d.sync += _ui.initialised.eq(1)
 					m.next = "READY_FOR_NORMAL_OPERATION"
 			
 			with m.State("AUTO_REFRESH"):
-				m.d.sync += [
-					_controller_pin_ui.cmd.eq(sdram_cmds.CMD_REF),
-					refresh_level.eq(Mux(
-							refresh_level < (self.clks_per_period - self.increment_per_refresh),
-							refresh_level + self.increment_per_refresh,
-							self.clks_per_period))					
-					]
-					
+				m.d.sync += _controller_pin_ui.cmd.eq(sdram_cmds.CMD_REF) # the refresh debt is paid off as this is issued
+
 				m.next = "AUTO_REFRESH_WAITING"
 			with m.State("AUTO_REFRESH_WAITING"):
-				with m.If(delayer.delay_for_time(ic_timing.T_RC)):
+				with m.If(refresh_timer.delay_for_time(ic_timing.T_RC)):
 					m.next = "DO_ANOTHER_REFRESH?"
 
+			# The refresh budget is held fresh in the low power modes, as the sdram refreshes itself 
+			# in self refresh, and there's no data to preserve in power down. 
+			# The bus is kept, as refresh_in_progress stays high
+			def hold_fresh_refresh_budget():
+				m.d.sync += [
+					refresh_debt.eq(0),
+					refresh_interval.eq(refresh_interval.reset),
+				]
+
+			if use_low_power:
+				stay_in_self_refresh = _ui.sdram_idle | _ui.self_refresh
+			else:
+				stay_in_self_refresh = _ui.self_refresh
+
+			with m.State("SELF_REFRESH_ENTRY"):
+				m.d.sync += [
+					_controller_pin_ui.cmd.eq(sdram_cmds.CMD_SELF),
+					_controller_pin_ui.clk_en.eq(0),
+				]
+				if self.config_params.warm_restart:
+					m.d.sync += sdram_in_self_refresh.eq(1)
+				m.next = "SELF_REFRESH"
+			with m.State("SELF_REFRESH"):
+				hold_fresh_refresh_budget()
+				with m.If(stay_in_self_refresh):
+					m.d.sync += _controller_pin_ui.clk_en.eq(0)
+				with m.Else():
+					m.next = "SELF_REFRESH_EXIT" # clk_en goes high, then no commands for T_XSR
+			with m.State("SELF_REFRESH_EXIT"):
+				if self.config_params.warm_restart:
+					# cleared here rather than in AFTER_RESET, which is also active during the reset
+					m.d.sync += sdram_in_self_refresh.eq(0)
+				with m.If(low_power_timer.delay_for_time(ic_timing.T_XSR)):
+					m.d.sync += [
+						_ui.refresh_in_progress.eq(0),
+						_ui.initialised.eq(1), # needed after a warm restart
+					]
+					m.next = "READY_FOR_NORMAL_OPERATION"
+
+			with m.State("POWER_DOWN"):
+				hold_fresh_refresh_budget()
+				with m.If(_ui.sdram_idle & _ui.sdram_empty & ~_ui.self_refresh):
+					m.d.sync += _controller_pin_ui.clk_en.eq(0)
+				with m.Else():
+					m.next = "POWER_DOWN_EXIT"
+			with m.State("POWER_DOWN_EXIT"):
+				# a clock with clk_en high is enough to leave power down
+				m.d.sync += _ui.refresh_in_progress.eq(0)
+				m.next = "READY_FOR_NORMAL_OPERATION"
+
+		m.d.sync += _ui.low_power.eq(fsm.ongoing("SELF_REFRESH") | fsm.ongoing("POWER_DOWN"))
+
+		if self.timer_bank == None:
+			m.submodules.timer_bank = timer_bank # after the timers are added
+
 		
 		return m
+
+	def sim_wait_until_initialised(self, model = None, margin_clks = 2):
+		"""
+		For simulation processes, this returns once the sdram is initialised, as 
+		'while not (yield refresher.ui.initialised): yield' does, except that each wait of the 
+		initialisation, e.g. the 100us power up wait, is fast forwarded rather than simulated clock by clock.
+		Only nops are sent during these waits, and the refresh timing is reset once initialised, 
+		so the clocks skipped don't change anything else. The model, if given, is told of them.
+		"""
+		while not (yield self.ui.initialised):
+			clks = (yield from self.init_timer.delayer.get_sim_clks_remaining()) - margin_clks
+			if clks > 0:
+				if model != None:
+					model.fast_forward(clks)
+				yield from self.init_timer.delayer.sim_fast_forward(clks)
+			yield
+
+	def sim_fast_forward_refresh_gap(self, clks, model = None, margin_clks = 2):
+		"""
+		For simulation processes, this skips up to <clks> clocks of the refresher waiting in READY_FOR_NORMAL_OPERATION, 
+		stopping <margin_clks> before another refresh becomes due or the low power mode is entered, so the gaps 
+		between refreshes needn't be simulated clock by clock. The refresh interval and idle counters are moved on 
+		by the clocks skipped, and the model, if given, is told of them. 
+		The ui must be held steady, and nothing else may be using the sdram, as its timing isn't moved on.
+		Returns the clocks skipped, which is 0 if the refresher has something to do now.
+		"""
+		yield Settle() # so the counters have been clocked, if called just after a clock edge
+		if (not (yield self.fsm.ongoing("READY_FOR_NORMAL_OPERATION"))) or (yield self.ui.self_refresh):
+			return 0
+
+		sdram_idle = yield self.ui.sdram_idle
+		sdram_empty = yield self.ui.sdram_empty
+		if not sdram_empty:
+			# the refresh timing is held at reset while the sdram is empty, 
+			# otherwise the debt goes up by one as the interval wraps
+			debt_limit = self.config_params.refresh_debt_limit
+			refresh_debt = yield self.refresh_debt
+			if (refresh_debt >= debt_limit) or (sdram_idle and (refresh_debt > -debt_limit)):
+				return 0 # a refresh is about to be requested
+			clks = min(clks, (yield self.refresh_interval) - margin_clks)
+
+		if (self.idle_clks != None) and sdram_idle:
+			clks = min(clks, self.low_power_idle_clks - (yield self.idle_clks) - margin_clks)
+
+		if clks <= 0:
+			return 0
+
+		if model != None:
+			model.fast_forward(clks)
+		if not sdram_empty:
+			yield self.refresh_interval.eq((yield self.refresh_interval) - clks)
+		if (self.idle_clks != None) and sdram_idle:
+			yield self.idle_clks.eq((yield self.idle_clks) + clks)
+		return clks
 	
 
 if __name__ == "__main__":
@@ -268,13 +476,22 @@ if __name__ == "__main__":
 			self.utest_params = utest_params
 			self.utest = utest
 
-			# put in constructor so we can access in simulation processes
-			self.refresher = controller_refresh(self.config_params)
+			# put in constructor so we can access in simulation processes.
+			# The refresher can share its timer bank with another module, which runs a timer of its own throughout
+			share_timer_bank = self.utest_params.share_timer_bank if hasattr(self.utest_params, "share_timer_bank") else False
+			self.timer_bank = TimerBank(clk_freq=self.config_params.clk_freq) if share_timer_bank else None
+			self.other_timer_done = Signal()
+			self.refresher = controller_refresh(self.config_params, timer_bank=self.timer_bank)
 			self.pin_ctrl = controller_pin(self.config_params, self.utest_params)
 
+			# a soft reset of the sync domain, as from some user logic
+			self.soft_reset = Signal()
+
 		def get_sim_sync_processes(self):
 			for process, domain in self.pin_ctrl.get_sim_sync_processes():
 				yield process, domain
+
+			model = self.pin_ctrl.sdram_model.model if hasattr(self.pin_ctrl, "sdram_model") else None
 				
 			def use_refresher_with_resource_blocking_task():
 				def resource_blocking_task():
@@ -308,9 +525,159 @@ if __name__ == "__main__":
 					print("Timeout error!")
 
 
+			def skip_refreshes_while_empty():
+				yield self.refresher.ui.sdram_idle.eq(1)
+				yield self.refresher.ui.sdram_empty.eq(1)
+				yield from self.refresher.sim_wait_until_initialised(model)
+
+				def count_refreshes(clks):
+					refresh_count = 0
+					for _ in range(clks):
+						yield self.refresher.ui.enable_refresh.eq((yield self.refresher.ui.request_to_refresh_soon))
+						if (yield self.refresher.controller_pin_ui.cmd) == sdram_cmds.CMD_REF.value:
+							refresh_count += 1
+						yield
+					return refresh_count
+
+				refresh_count = yield from count_refreshes(2 * self.config_params.refresh_debt_limit * self.refresher.increment_per_refresh)
+				assert refresh_count == 0, "there is no data in the sdram to refresh"
+
+				# then once data is stored, refreshing starts again without reinitialising
+				yield self.refresher.ui.sdram_empty.eq(0)
+				refresh_count = yield from count_refreshes(self.refresher.increment_per_refresh)
+				assert refresh_count > 0
+				assert (yield self.refresher.ui.initialised)
+
+			def enter_and_leave_self_refresh_when_idle():
+				yield self.refresher.ui.sdram_idle.eq(1)
+				yield from self.refresher.sim_wait_until_initialised(model)
+
+				while not (yield self.refresher.ui.low_power):
+					yield self.refresher.ui.enable_refresh.eq((yield self.refresher.ui.request_to_refresh_soon))
+					yield
+				yield self.refresher.ui.enable_refresh.eq(0)
+				for _ in range(100):
+					assert (yield self.refresher.ui.low_power)
+					assert not (yield self.refresher.controller_pin_ui.clk_en)
+					yield
+
+				# then leave self refresh, as if a fifo has data to store
+				yield self.refresher.ui.sdram_idle.eq(0)
+				exit_clks = 0
+				while (yield self.refresher.ui.refresh_in_progress):
+					exit_clks += 1
+					yield
+				# plus the clocks to get through the refresher's ui
+				assert exit_clks <= self.refresher.low_power_exit_clks + 2, f"took {exit_clks} clocks to leave self refresh"
+
+			def keep_sdram_in_self_refresh_through_a_warm_restart():
+				yield from self.refresher.sim_wait_until_initialised(model)
+				assert not (yield self.refresher.ui.warm_restarted)
+
+				yield self.refresher.ui.self_refresh.eq(1)
+				while not (yield self.refresher.ui.low_power):
+					yield self.refresher.ui.enable_refresh.eq((yield self.refresher.ui.request_to_refresh_soon))
+					yield
+				yield self.refresher.ui.enable_refresh.eq(0)
+
+				# the sdram is kept in self refresh through the reset
+				yield self.soft_reset.eq(1)
+				for _ in range(100):
+					yield
+					assert not (yield self.refresher.controller_pin_ui.clk_en)
+				yield self.soft_reset.eq(0)
+				yield self.refresher.ui.self_refresh.eq(0)
+
+				# then it only has to leave self refresh, rather than be initialised again
+				restart_clks = 0
+				while not (yield self.refresher.ui.initialised):
+					restart_clks += 1
+					yield
+				assert (yield self.refresher.ui.warm_restarted)
+				assert restart_clks <= self.refresher.low_power_exit_clks + 2, f"took {restart_clks} clocks to warm restart"
+
+			def pull_in_refreshes_while_idle():
+				yield self.refresher.ui.sdram_idle.eq(1)
+				yield from self.refresher.sim_wait_until_initialised(model)
+
+				# with nothing else using the sdram, the refreshes are done before they are due
+				refresh_count = 0
+				for _ in range(self.refresher.increment_per_refresh):
+					yield self.refresher.ui.enable_refresh.eq((yield self.refresher.ui.request_to_refresh_soon))
+					if (yield self.refresher.controller_pin_ui.cmd) == sdram_cmds.CMD_REF.value:
+						refresh_count += 1
+					yield
+				assert refresh_count >= self.config_params.refresh_debt_limit, f"only {refresh_count} refreshes were pulled in"
+
+				# so the next refresh can be postponed for up to twice the debt limit
+				debt_limit = self.config_params.refresh_debt_limit
+				assert (yield self.refresher.ui.refresh_deadline) >= (2*debt_limit - 1) * self.refresher.increment_per_refresh
+
+			def fast_forward_the_gaps_between_refreshes():
+				yield self.refresher.ui.sdram_idle.eq(1)
+				yield from self.refresher.sim_wait_until_initialised(model)
+
+				# the model keeps count of the clocks, including those skipped
+				clks_to_run = int(self.utest_params.runtime * self.config_params.clk_freq)
+				end_clk = model.clks + clks_to_run
+				refresh_count = 0
+				clks_simulated = 0
+				while model.clks < end_clk:
+					yield from self.refresher.sim_fast_forward_refresh_gap(end_clk - model.clks, model)
+					yield self.refresher.ui.enable_refresh.eq((yield self.refresher.ui.request_to_refresh_soon))
+					if (yield self.refresher.controller_pin_ui.cmd) == sdram_cmds.CMD_REF.value:
+						refresh_count += 1
+					yield
+					clks_simulated += 1
+
+				# each refresh is still done once it is due, give or take those pulled in
+				refreshes_due = clks_to_run / self.refresher.increment_per_refresh
+				assert abs(refresh_count - refreshes_due) <= self.config_params.refresh_debt_limit + 1, f"{refresh_count} refreshes were done, when {refreshes_due} were due"
+				assert clks_simulated < clks_to_run / 10, f"{clks_simulated} of the {clks_to_run} clocks were simulated"
+
+			self.other_timer_periods = []
+			def measure_other_timer():
+				yield Passive()
+				clks = None # until it is first done, as the simulation starts part way through a period
+				while True:
+					yield
+					if clks != None:
+						clks += 1
+					if (yield self.other_timer_done):
+						if clks != None:
+							self.other_timer_periods.append(clks)
+						clks = 0
+
+			def refresh_alongside_another_timer():
+				# the refresher initialises the sdram, then pulls in refreshes one after another, 
+				# with its timers running alongside the other one
+				yield self.refresher.ui.sdram_idle.eq(1)
+				yield from self.refresher.sim_wait_until_initialised(model)
+				refresh_count = 0
+				for _ in range(self.refresher.increment_per_refresh):
+					yield self.refresher.ui.enable_refresh.eq((yield self.refresher.ui.request_to_refresh_soon))
+					if (yield self.refresher.controller_pin_ui.cmd) == sdram_cmds.CMD_REF.value:
+						refresh_count += 1
+					yield
+				assert refresh_count >= 2, f"only {refresh_count} refreshes were done"
+
+
 			test_id = self.utest.get_test_id()
 			if test_id == "RefreshCtrl_sim_withModelAndBlockingTask_modelStaysRefreshed":
 				yield use_refresher_with_resource_blocking_task, "sync"
+			elif test_id == "RefreshCtrl_sim_withSdramIdle_pullsInRefreshes":
+				yield pull_in_refreshes_while_idle, "sync"
+			elif test_id == "RefreshCtrl_sim_withSdramEmpty_skipsRefreshes":
+				yield skip_refreshes_while_empty, "sync"
+			elif test_id == "RefreshCtrl_sim_withLongIdle_entersAndLeavesSelfRefresh":
+				yield enter_and_leave_self_refresh_when_idle, "sync"
+			elif test_id == "RefreshCtrl_sim_withWarmRestart_skipsInitialisation":
+				yield keep_sdram_in_self_refresh_through_a_warm_restart, "sync"
+			elif test_id == "RefreshCtrl_sim_withFastForwardedGaps_modelStaysRefreshed":
+				yield fast_forward_the_gaps_between_refreshes, "sync"
+			elif test_id == "RefreshCtrl_sim_withSharedTimerBank_thatAnotherModulesTimer_runsAlongsideTheRefreshes":
+				yield measure_other_timer, "sync"
+				yield refresh_alongside_another_timer, "sync"
 			
 		def elaborate(self, platform = None):
 			m = Module()
@@ -319,6 +686,14 @@ if __name__ == "__main__":
 
 			m.submodules.pin_ctrl = self.pin_ctrl
 
+			if self.timer_bank != None:
+				# another module's timer, which is done every other_timer_clks, whatever the refresher is doing
+				other_timer = self.timer_bank.get_timer("other", m)
+				m.d.comb += self.other_timer_done.eq(other_timer.delay_for_clks(self.utest_params.other_timer_clks))
+				m.submodules.timer_bank = self.timer_bank # after the timers are added
+
+			m.d.comb += ResetSignal("sync").eq(self.soft_reset)
+
 			# connect the bus-selection mechanism
 			placeholder_record = Record.like(self.refresher.controller_pin_ui)
 			m.d.sync += [
@@ -326,6 +701,8 @@ if __name__ == "__main__":
 				self.refresher.controller_pin_ui.connect(self.pin_ctrl.ui.refresh),
 				placeholder_record.connect(self.pin_ctrl.ui.readwrite)
 			]
+			# the readwrite controller holds clk_en high, so the model is clocked between refreshes
+			m.d.comb += placeholder_record.clk_en.eq(1)
 
 			if isinstance(self.utest, FHDLTestCase):
 				add_clock(m, "sync")
@@ -373,6 +750,164 @@ if __name__ == "__main__":
 					f"{current_filename}_{self.get_test_id()}.vcd"):
 					sim.run()
 
+		class RefreshCtrl_sim_withSdramIdle_pullsInRefreshes(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+
+				utest_params = Params()
+				utest_params.use_sdram_model = True
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+
+		class RefreshCtrl_sim_withSdramEmpty_skipsRefreshes(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+
+				utest_params = Params()
+				utest_params.use_sdram_model = True
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+
+		class RefreshCtrl_sim_withLongIdle_entersAndLeavesSelfRefresh(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.low_power_idle_time = 1e-6
+
+				utest_params = Params()
+				utest_params.use_sdram_model = True
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+
+		class RefreshCtrl_sim_withWarmRestart_skipsInitialisation(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.warm_restart = True
+
+				utest_params = Params()
+				utest_params.use_sdram_model = True
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+		class RefreshCtrl_sim_withFastForwardedGaps_modelStaysRefreshed(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+
+				utest_params = Params()
+				utest_params.use_sdram_model = True
+				utest_params.enable_detailed_model_printing = False
+				utest_params.runtime = 40e-3 # longer than T_REF, so the model checks a full window of refreshes
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				sim.run()
+
+				self.assertTrue(tb.pin_ctrl.sdram_model.model.check_refresh_retention())
+
+		class RefreshCtrl_sim_withSharedTimerBank_thatAnotherModulesTimer_runsAlongsideTheRefreshes(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+
+				utest_params = Params()
+				utest_params.use_sdram_model = True
+				utest_params.enable_detailed_model_printing = False
+				utest_params.share_timer_bank = True
+				utest_params.other_timer_clks = 50 # so it is loaded part way through the refresher's waits
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run()
+
+				# the model checks the refresher's timing, e.g. T_RP and T_RC, and the other timer is never disturbed
+				self.assertGreater(len(tb.other_timer_periods), 0)
+				self.assertEqual(set(tb.other_timer_periods), {utest_params.other_timer_clks})
+
 
 	if args.action in ["generate", "simulate"]:
 		# now run each FHDLTestCase above 
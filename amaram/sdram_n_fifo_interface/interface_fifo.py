@@ -68,6 +68,13 @@ class interface_fifo(Elaboratable):
 		# user interface
 		self.ui_fifo = Record(sdram_fifo_interfaces.get_ui_fifo_layout(self.config_params))
 
+		# With full page bursts, each fifo chunk is one long burst within a row, ended by a burst stop,
+		# rather than numbursts bursts that each need their own activate and precharge
+		if not hasattr(self.config_params, "full_page_bursts"): self.config_params.full_page_bursts = False
+		if self.config_params.full_page_bursts:
+			if not hasattr(self.config_params, "burstlen"): self.config_params.burstlen = 1 << self.config_params.rw_params.COL_BITS.value # a whole row
+			if not hasattr(self.config_params, "numbursts"): self.config_params.numbursts = 1
+
 		# put in constructor so we can access in simulation processes
 		self.readwriter = controller_readwrite(self.config_params)
 		self.refresher = controller_refresh(self.config_params)
@@ -82,6 +89,10 @@ class interface_fifo(Elaboratable):
 
 		# self.config_params.read_pipeline_clk_delay = 10 # todo - change the logic to get rid of this? or is this needed to avoid overreading?
 		self.config_params.num_adjacent_words = self.config_params.burstlen*self.config_params.numbursts
+
+		# refreshes are pulled in while the fifo waits for time for a sequence, so the most that can be pulled in has to leave enough
+		assert (2*self.config_params.refresh_debt_limit - 1) * self.refresher.increment_per_refresh >= 2*self.config_params.num_adjacent_words, \
+			f"A sequence of {self.config_params.num_adjacent_words} words won't fit between refreshes, so increase refresh_debt_limit or reduce numbursts"
 	
 	def get_sim_sync_processes(self):
 		for process, domain in self.pin_ctrl.get_sim_sync_processes():
@@ -253,7 +264,8 @@ class interface_fifo(Elaboratable):
 		m.d.sync += [
 			self.pin_ctrl.ui.bus_is_refresh_not_readwrite.eq(self.refresher.ui.enable_refresh | self.refresher.ui.refresh_in_progress),
 			self.refresher.controller_pin_ui.connect(self.pin_ctrl.ui.refresh),
-			self.readwriter.controller_pin_ui.connect(self.pin_ctrl.ui.readwrite)
+			self.readwriter.controller_pin_ui.connect(self.pin_ctrl.ui.readwrite),
+			rw_ui.refresh_in_progress.eq(self.refresher.ui.enable_refresh | self.refresher.ui.refresh_in_progress)
 		]
 
 		##### determine what to do next ##############################
@@ -262,6 +274,7 @@ class interface_fifo(Elaboratable):
 		next_srcfifo_readable_to_sdram = Signal()
 		srcfifo_r_level_high_enough_to_burstread = Signal()
 		too_busy_to_refresh = Signal() # 7apr2022 - how to deal with this case better?
+		refresh_before_next_sequence = Signal()
 		ram_wont_overfill = Signal()
 		using_ram = Signal()
 
@@ -279,6 +292,10 @@ class interface_fifo(Elaboratable):
 			next_srcfifo_readable_to_sdram.eq(srcfifo_r_level_high_enough_to_burstread & ram_wont_overfill & using_ram)
 		]
 
+		# a sequence of num_adjacent_words can take up to about twice that many clocks, 
+		# as its bursts wait for the bank timing and the read latency. Refreshes are skipped while the sdram is empty, so don't wait for one then
+		m.d.sync += refresh_before_next_sequence.eq((self.refresher.ui.refresh_deadline < (2 * self.config_params.num_adjacent_words)) & (fifo_control.words_stored_in_ram != 0))
+
 		m.d.sync += [
 			ram_wont_overread.eq(fifo_control.words_stored_in_ram >= self.config_params.num_adjacent_words),
 			dstfifo_w_space_enough.eq((dst_fifo.depth - dst_fifo.r_level) >= ((2*self.config_params.num_adjacent_words + self.config_params.read_pipeline_clk_delay))),
@@ -293,6 +310,7 @@ class interface_fifo(Elaboratable):
 
 		##### implement the fsm to control the sdram chip/model ##############################
 		with m.FSM(name="fifo_controller_fsm") as fsm:
+			self.fsm = fsm # so the testbench can follow when sequences start
 			
 			burst_index = Signal(shape=bits_for(self.config_params.burstlen-1))
 			numburst_index = Signal(shape=bits_for(self.config_params.numbursts-1))
@@ -316,7 +334,10 @@ class interface_fifo(Elaboratable):
 
 				Note that this needs to be an.. even number of clock cycles (or equal to the burstlen cycles?), if doing a memory access at the moment? so trying REFRESH_OR_IDLE_2 state to see if that fixes a bug
 				"""
-				with m.If(self.refresher.ui.request_to_refresh_soon):
+				# a refresh that has been pulled in can wait for the sdram to go idle, unless 
+				# there isn't time for another sequence before it has to be done
+				with m.If(self.refresher.ui.request_to_refresh_soon & 
+						(refresh_before_next_sequence | ~(next_srcfifo_readable_to_sdram | next_dstfifo_writeable_from_sdram))):
 					with m.If(~rw_ui.in_progress): # wait for sany reads/writes to finish / banks to go idle, is this needed?
 						m.d.sync += self.refresher.ui.enable_refresh.eq(1) # sync?
 
@@ -324,6 +345,9 @@ class interface_fifo(Elaboratable):
 					pass # wait for it to finish, 
 					m.d.sync += self.refresher.ui.enable_refresh.eq(0)
 
+				with m.Elif(self.refresher.ui.enable_refresh | refresh_before_next_sequence):
+					pass # wait for the refresh to start, or to be requested, as sdram_idle is now high
+
 				with m.Else():
 					# m.next = "REFRESH_OR_IDLE_2"
 					with m.If(next_srcfifo_readable_to_sdram):
@@ -368,10 +392,6 @@ class interface_fifo(Elaboratable):
 						fifo_control.w_next_addr.eq(fifo_control.w_next_addr + 1)
 					]
 									
-				write_word_address_for_word_at_start_of_burst()
-				write_word_data_for_each_word_in_burst()
-					
-
 				def when_burst_ends_change_fifo_or_readwrite():
 					with m.If((burst_index + 1) == self.config_params.burstlen): # burst finished
 						m.d.sync += burst_index.eq(0)
@@ -381,7 +401,7 @@ class interface_fifo(Elaboratable):
 
 							# m.d.sync += fifo_index.eq(next_srcfifo_index) # prepare to do the next fifo
 
-							with m.If(self.refresher.ui.request_to_refresh_soon & ~too_busy_to_refresh):# | all_dstfifos_written):
+							with m.If(refresh_before_next_sequence & ~too_busy_to_refresh):# | all_dstfifos_written):
 								m.next = "REFRESH_OR_IDLE"
 
 							with m.Else():
@@ -402,7 +422,13 @@ class interface_fifo(Elaboratable):
 					with m.Else():
 						m.d.sync += burst_index.eq(burst_index + 1)
 						
-				when_burst_ends_change_fifo_or_readwrite()
+				# only start a burst once the readwrite controller can queue it, then it runs to the end
+				with m.If((burst_index != 0) | rw_ui.rw_copi.ready):
+					write_word_address_for_word_at_start_of_burst()
+					write_word_data_for_each_word_in_burst()
+					when_burst_ends_change_fifo_or_readwrite()
+				with m.Else():
+					m.d.sync += rw_ui.rw_copi.task.eq(rw_cmds.RW_IDLE)
 
 			with m.State("READ_SDRAM_TO_DSTFIFOS"):
 			# 	# this state exists to ensure that the dqm pin is kept high for <latency> clock cycles,
@@ -442,7 +468,7 @@ class interface_fifo(Elaboratable):
 
 							# m.d.sync += fifo_index.eq(next_dstfifo_index) # prepare to do the next fifo
 
-							with m.If(self.refresher.ui.request_to_refresh_soon & ~too_busy_to_refresh):
+							with m.If(refresh_before_next_sequence & ~too_busy_to_refresh):
 								m.next = "REFRESH_OR_IDLE"
 								
 							with m.Else():
@@ -463,13 +489,24 @@ class interface_fifo(Elaboratable):
 					with m.Else():
 						m.d.sync += burst_index.eq(burst_index + 1)
 
-				increment_address_read_counter()
-				write_word_address_for_word_at_start_of_burst()
-				when_burst_ends_change_fifo_or_readwrite()
+				with m.If((burst_index != 0) | rw_ui.rw_copi.ready):
+					increment_address_read_counter()
+					write_word_address_for_word_at_start_of_burst()
+					when_burst_ends_change_fifo_or_readwrite()
+				with m.Else():
+					m.d.sync += rw_ui.rw_copi.task.eq(rw_cmds.RW_IDLE)
 			
 			with m.State("ERROR"):
 				pass
 
+		# let the refresher pull refreshes in while there's nothing to move to or from the sdram
+		# or has stopped for the next refresh
+		m.d.sync += self.refresher.ui.sdram_idle.eq(fsm.ongoing("REFRESH_OR_IDLE") & 
+			(refresh_before_next_sequence | ~(next_srcfifo_readable_to_sdram | next_dstfifo_writeable_from_sdram)))
+
+		# and skip refreshes while there is nothing in the sdram to preserve
+		m.d.sync += self.refresher.ui.sdram_empty.eq(fifo_control.words_stored_in_ram == 0)
+
 		# if we want to control the flags from sync domain
 		if hasattr(self.utest_params, "debug_flags"):
 			for flag in self.utest_params.debug_flags:
@@ -607,14 +644,75 @@ if __name__ == "__main__":
 				domain = self.config_params.fifo_read_domain
 				yield process, domain
 
+			elif test_id in ["fifoInterfaceTb_sim_withBusySdram_thatSequencesOnlyStartWithTimeBeforeTheNextRefresh",
+					"fifoInterfaceTb_sim_withRefreshesSkippedWhileEmpty_thatSequencesDontWaitForARefresh"]:
+				self.words_read_back = 0
+				self.all_written = False
+
+				def write_counter_values_to_fifo(fifo, num_writes):
+					def func():
+						i = 0
+						while i < num_writes:
+							yield Settle()
+							written = (yield fifo.w_rdy)
+							yield fifo.w_data.eq(i)
+							yield fifo.w_en.eq(written)
+							yield
+							i += written
+						yield fifo.w_en.eq(0)
+						self.all_written = True
+					return func
+
+				def read_counter_values_from_fifo(fifo, num_reads):
+					# only read once all are written, so the words have to go through the sdram
+					def func():
+						while not self.all_written:
+							yield
+						yield fifo.r_en.eq(1)
+						while self.words_read_back < num_reads:
+							yield Settle()
+							if (yield fifo.r_rdy):
+								data = (yield fifo.r_data)
+								assert data == self.words_read_back, f"read {hex(data)} but expected {hex(self.words_read_back)}"
+								self.words_read_back += 1
+							yield
+						yield fifo.r_en.eq(0)
+					return func
+
+				def check_sequences_start_with_time_before_the_next_refresh():
+					# the fsm decides to start a sequence from values registered a clock earlier, 
+					# so look two clocks back from the first clock of the sequence
+					def func():
+						yield Passive()
+						fsm = self.interface_fifo.fsm
+						refresher_ui = self.interface_fifo.refresher.ui
+						num_adjacent_words = self.config_params.num_adjacent_words
+						history = [] # (in_sequence, refresh_deadline, sdram_empty) for the last few clocks
+						self.sequences_started = 0
+						while True:
+							yield Settle()
+							in_sequence = (yield fsm.ongoing("WRITE_SRCFIFOS_TO_SDRAM")) | (yield fsm.ongoing("READ_SDRAM_TO_DSTFIFOS"))
+							history = (history + [(in_sequence, (yield refresher_ui.refresh_deadline), (yield refresher_ui.sdram_empty))])[-3:]
+							if (len(history) == 3) and in_sequence and not history[1][0]:
+								_, deadline, _ = history[0]
+								_, _, sdram_was_empty = history[1]
+								assert (deadline >= 2*num_adjacent_words) or sdram_was_empty, \
+									f"a sequence started with a refresh deadline of only {deadline} clocks"
+								self.sequences_started += 1
+							yield
+					return func
+
+				yield write_counter_values_to_fifo(self.interface_fifo.ui_fifo, self.utest_params.num_fifo_writes), self.config_params.fifo_write_domain
+				yield read_counter_values_from_fifo(self.interface_fifo.ui_fifo, self.utest_params.num_fifo_writes), self.config_params.fifo_read_domain
+				yield check_sequences_start_with_time_before_the_next_refresh(), "sync"
+
 		def elaborate(self, platform = None):
 			m = Module()
 
 			m.submodules.interface_fifo = self.interface_fifo
 
-			# test_id = self.utest.get_test_id()
-			# if (test_id == "fifoInterfaceTb_sim_thatWrittenFifosUsingFSM_canBeReadBack"):
-			if True:
+			# the other tests write and read the fifo from their sim processes instead
+			if (self.utest == None) or (self.utest.get_test_id() == "fifoInterfaceTb_sim_thatWrittenFifosUsingFSM_canBeReadBack"):
 
 				fifo_domain = self.config_params.fifo_write_domain
 
@@ -771,6 +869,97 @@ if __name__ == "__main__":
 					with sim.write_vcd(
 						f"{current_filename}_{self.get_test_id()}.vcd"):
 						sim.run()
+
+		if True:
+			class fifoInterfaceTb_sim_withBusySdram_thatSequencesOnlyStartWithTimeBeforeTheNextRefresh(FHDLTestCase):
+				def test_sim(self):
+					from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+								
+					config_params = Params()
+					config_params.ic_timing = ic_timing
+					config_params.ic_refresh_timing = ic_refresh_timing
+					config_params.rw_params = rw_params
+					config_params.clk_freq = 143e6
+					config_params.burstlen = 8
+					config_params.latency = 3
+					config_params.numbursts = 2 
+					config_params.refresh_debt_limit = 1 # so refreshes can't be pulled in far, and the deadline gets close while the sdram is busy
+					config_params.fifo_read_domain = "fifo"
+					config_params.fifo_write_domain = config_params.fifo_read_domain
+					config_params.fifo_width = 16
+					config_params.fifo_depth = config_params.burstlen * config_params.numbursts * 4 # 64
+					config_params.read_pipeline_clk_delay = 10 # ??
+
+					utest_params = Params()
+					utest_params.timeout_runtime = 400e-6 # arbitarily chosen, so the simulation won't run forever if it breaks
+					utest_params.use_sdram_model = True
+					utest_params.debug_flags = Array(Signal(name=f"debug_flag_{i}") for i in range(6))
+					utest_params.read_clk_freq = 100e6 # fast enough to keep the sdram busy
+					utest_params.write_clk_freq = utest_params.read_clk_freq
+					utest_params.num_fifo_writes = config_params.burstlen * config_params.numbursts * 50
+					utest_params.enable_detailed_model_printing = False
+
+					tb = Testbench(config_params, utest_params, utest=self)
+
+					sim = Simulator(tb)
+					sim.add_clock(period=1/config_params.clk_freq, 		domain="sync")
+					sim.add_clock(period=1/utest_params.read_clk_freq,	domain=config_params.fifo_read_domain)
+
+					for process, domain in tb.get_sim_sync_processes():
+						sim.add_sync_process(process, domain=domain)
+
+					with sim.write_vcd(
+						f"{current_filename}_{self.get_test_id()}.vcd"):
+						sim.run_until(utest_params.timeout_runtime)
+
+					assert tb.words_read_back == utest_params.num_fifo_writes, f"only {tb.words_read_back} of {utest_params.num_fifo_writes} words were read back"
+					assert tb.sequences_started > 0
+
+		if True:
+			class fifoInterfaceTb_sim_withRefreshesSkippedWhileEmpty_thatSequencesDontWaitForARefresh(FHDLTestCase):
+				def test_sim(self):
+					from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+								
+					config_params = Params()
+					config_params.ic_timing = ic_timing
+					config_params.ic_refresh_timing = ic_refresh_timing
+					config_params.rw_params = rw_params
+					config_params.clk_freq = 10e6
+					config_params.burstlen = 8
+					config_params.numbursts = 6
+					# while the sdram is empty no refresh is requested, so the deadline stays at 
+					# 2*39-1 clocks, which is less than the 96 that a sequence of 48 words needs
+					config_params.refresh_debt_limit = 2
+					config_params.fifo_read_domain = "fifo"
+					config_params.fifo_write_domain = config_params.fifo_read_domain
+					config_params.fifo_width = 16
+					config_params.fifo_depth = config_params.burstlen * config_params.numbursts * 4 # 192
+					config_params.read_pipeline_clk_delay = 10 # ??
+
+					utest_params = Params()
+					utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+					utest_params.use_sdram_model = True
+					utest_params.debug_flags = Array(Signal(name=f"debug_flag_{i}") for i in range(6))
+					utest_params.read_clk_freq = 8e6
+					utest_params.write_clk_freq = utest_params.read_clk_freq
+					utest_params.num_fifo_writes = config_params.burstlen * config_params.numbursts * 10
+					utest_params.enable_detailed_model_printing = False
+
+					tb = Testbench(config_params, utest_params, utest=self)
+
+					sim = Simulator(tb)
+					sim.add_clock(period=1/config_params.clk_freq, 		domain="sync")
+					sim.add_clock(period=1/utest_params.read_clk_freq,	domain=config_params.fifo_read_domain)
+
+					for process, domain in tb.get_sim_sync_processes():
+						sim.add_sync_process(process, domain=domain)
+
+					with sim.write_vcd(
+						f"{current_filename}_{self.get_test_id()}.vcd"):
+						sim.run_until(utest_params.timeout_runtime)
+
+					assert tb.words_read_back == utest_params.num_fifo_writes, f"only {tb.words_read_back} of {utest_params.num_fifo_writes} words were read back"
+					assert tb.sequences_started > 0
 	
 	
 	if args.action in ["generate", "simulate"]:
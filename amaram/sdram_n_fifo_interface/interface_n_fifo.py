@@ -44,7 +44,10 @@ persistent data storage in sdram through a fifo interface.
 
 def get_ui_layout(config_params):
 	ui_layout = [
-		("contains_data",	1,					DIR_FANIN) # not used yet
+		("contains_data",	1,					DIR_FANIN), # not used yet
+		("self_refresh",	1,					DIR_FANOUT), # stop using the sdram and hold it in self refresh, e.g. ahead of a warm restart
+		("low_power",		1,					DIR_FANIN), # the sdram is in self refresh (or power down), so it is safe to reset
+		("warm_restarted",	1,					DIR_FANIN), # the last reset kept the sdram initialised
 	]
 	return ui_layout
 
@@ -73,6 +76,10 @@ class sdram_n_fifo(Elaboratable):
 		self.utest_params = utest_params
 		self.utest = utest
 
+		if not hasattr(self.config_params, "warm_restart"): self.config_params.warm_restart = False # whether a reset while in self refresh skips the initialisation
+		if not hasattr(self.config_params, "warm_restart_keeps_fifo_data"): self.config_params.warm_restart_keeps_fifo_data = False # whether the data stored in the sdram is still read out after a warm restart
+		assert self.config_params.warm_restart or not self.config_params.warm_restart_keeps_fifo_data, "warm_restart_keeps_fifo_data needs warm_restart"
+
 		self.ui = Record(get_ui_layout(self.config_params))
 		# self.pin_ui = Record(controller_pin.get_ui_layout(self.config_params))
 		self.ui_fifos = Array(Record(get_ui_fifo_layout(self.config_params)) for _ in range(self.config_params.num_fifos))
@@ -93,6 +100,10 @@ class sdram_n_fifo(Elaboratable):
 		self.config_params.read_pipeline_clk_delay = 10 # todo - change the logic to get rid of this? or is this needed to avoid overreading?
 		self.config_params.num_adjacent_words = self.config_params.burstlen*self.config_params.numbursts
 
+		# refreshes are pulled in while the fifo waits for time for a sequence, so the most that can be pulled in has to leave enough
+		assert (2*self.config_params.refresh_debt_limit - 1) * self.refresher.increment_per_refresh >= 2*self.config_params.num_adjacent_words, \
+			f"A sequence of {self.config_params.num_adjacent_words} words won't fit between refreshes, so increase refresh_debt_limit or reduce numbursts"
+
 	def get_sim_sync_processes(self):
 		for process, domain in self.pin_ctrl.get_sim_sync_processes():
 			yield process, domain
@@ -122,13 +133,22 @@ class sdram_n_fifo(Elaboratable):
 				m.submodules[f"fifo_{i}_dst"] = dst_fifo
 
 			# and make some control signals 
-			fifo_controls = Array(Record([
-				("words_stored_in_ram", 			self.config_params.fifo_buf_word_addr_bits),
-				("fully_read",						1),
-				("request_to_store_data_in_ram", 	1),
-				("w_next_addr", 					self.config_params.fifo_buf_word_addr_bits),
-				("r_next_addr", 					self.config_params.fifo_buf_word_addr_bits),
-			]) for _ in range(self.config_params.num_fifos))
+			def get_fifo_control(i):
+				fields = None
+				if self.config_params.warm_restart_keeps_fifo_data:
+					# the pointers survive a reset, so the data left in the sdram can still be read out after a warm restart
+					fields = {name: Signal(self.config_params.fifo_buf_word_addr_bits, name=f"fifo_{i}_{name}", reset_less=True) 
+						for name in ["w_next_addr", "r_next_addr"]}
+
+				return Record([
+					("words_stored_in_ram", 			self.config_params.fifo_buf_word_addr_bits),
+					("fully_read",						1),
+					("request_to_store_data_in_ram", 	1),
+					("w_next_addr", 					self.config_params.fifo_buf_word_addr_bits),
+					("r_next_addr", 					self.config_params.fifo_buf_word_addr_bits),
+				], fields=fields)
+
+			fifo_controls = Array(get_fifo_control(i) for i in range(self.config_params.num_fifos))
 
 			# now make a 'virtual' fifo for each pair, made by tying the inputs and outputs together
 			""" ____________________________________________________
@@ -335,7 +355,8 @@ class sdram_n_fifo(Elaboratable):
 			m.d.sync += [
 				self.pin_ctrl.ui.bus_is_refresh_not_readwrite.eq(self.refresher.ui.enable_refresh | self.refresher.ui.refresh_in_progress),
 				self.refresher.controller_pin_ui.connect(self.pin_ctrl.ui.refresh),
-				self.readwriter.controller_pin_ui.connect(self.pin_ctrl.ui.readwrite)
+				self.readwriter.controller_pin_ui.connect(self.pin_ctrl.ui.readwrite),
+				rw_ui.refresh_in_progress.eq(self.refresher.ui.enable_refresh | self.refresher.ui.refresh_in_progress)
 			]
 
 		m = Module()
@@ -358,9 +379,24 @@ class sdram_n_fifo(Elaboratable):
 
 		fifo_index, next_srcfifo_index, next_srcfifo_readable_to_sdram, next_dstfifo_index, next_dstfifo_writeable_from_sdram = determine_what_to_do_next()
 
+		# a sequence of num_adjacent_words can take up to about twice that many clocks, 
+		# as its bursts wait for the bank timing and the read latency. Refreshes are skipped while the sdram is empty, so don't wait for one then
+		refresh_before_next_sequence = Signal()
+		sdram_stores_data = Signal()
+		m.d.comb += sdram_stores_data.eq(Cat([fifo_control.words_stored_in_ram != 0 for fifo_control in fifo_controls]).any())
+		# and stop between sequences while the sdram is to be held in self refresh
+		m.d.sync += refresh_before_next_sequence.eq(((self.refresher.ui.refresh_deadline < (2 * self.config_params.num_adjacent_words)) & sdram_stores_data) | self.ui.self_refresh)
+
+		m.d.sync += [
+			self.refresher.ui.self_refresh.eq(self.ui.self_refresh),
+			self.ui.low_power.eq(self.refresher.ui.low_power),
+			self.ui.warm_restarted.eq(self.refresher.ui.warm_restarted),
+		]
+
 		# self.refresher.ui = get_and_set_up_refresh_module()
 
 		with m.FSM(name="fifo_controller_fsm") as fsm:
+			self.fsm = fsm # so the testbench can follow when sequences start
 			
 			burst_index = Signal(shape=bits_for(self.config_params.burstlen-1))
 			numburst_index = Signal(shape=bits_for(self.config_params.numbursts-1))
@@ -371,8 +407,9 @@ class sdram_n_fifo(Elaboratable):
 						rw_ui.rw_copi.task.eq(rw_cmds.RW_IDLE)
 					]
 					# set the reset values here, which are not set elsewhere
-					m.d.sync += [fifo_controls[i].w_next_addr.eq(i<<self.config_params.fifo_buf_word_addr_bits) for i in range(self.config_params.num_fifos)]
-					m.d.sync += [fifo_controls[i].r_next_addr.eq(i<<self.config_params.fifo_buf_word_addr_bits) for i in range(self.config_params.num_fifos)]
+					with m.If(~(self.refresher.ui.warm_restarted & self.config_params.warm_restart_keeps_fifo_data)):
+						m.d.sync += [fifo_controls[i].w_next_addr.eq(i<<self.config_params.fifo_buf_word_addr_bits) for i in range(self.config_params.num_fifos)]
+						m.d.sync += [fifo_controls[i].r_next_addr.eq(i<<self.config_params.fifo_buf_word_addr_bits) for i in range(self.config_params.num_fifos)]
 					
 					m.d.sync += fifo_index.eq(0)
 					m.next = "REFRESH_OR_IDLE"
@@ -384,7 +421,10 @@ class sdram_n_fifo(Elaboratable):
 
 				Note that this needs to be an.. even number of clock cycles (or equal to the burstlen cycles?), if doing a memory access at the moment? so trying REFRESH_OR_IDLE_2 state to see if that fixes a bug
 				"""
-				with m.If(self.refresher.ui.request_to_refresh_soon):
+				# a refresh that has been pulled in can wait for the sdram to go idle, unless 
+				# there isn't time for another sequence before it has to be done
+				with m.If(self.refresher.ui.request_to_refresh_soon & 
+						(refresh_before_next_sequence | ~(next_srcfifo_readable_to_sdram | next_dstfifo_writeable_from_sdram))):
 					with m.If(~rw_ui.in_progress): # wait for sany reads/writes to finish / banks to go idle, is this needed?
 						m.d.sync += self.refresher.ui.enable_refresh.eq(1) # sync?
 
@@ -392,6 +432,9 @@ class sdram_n_fifo(Elaboratable):
 					pass # wait for it to finish, 
 					m.d.sync += self.refresher.ui.enable_refresh.eq(0)
 
+				with m.Elif(self.refresher.ui.enable_refresh | refresh_before_next_sequence):
+					pass # wait for the refresh to start, or to be requested, as sdram_idle is now high
+
 				with m.Else():
 					# m.next = "REFRESH_OR_IDLE_2"
 					with m.If(next_srcfifo_readable_to_sdram):
@@ -413,83 +456,87 @@ class sdram_n_fifo(Elaboratable):
 			with m.State("WRITE_SRCFIFOS_TO_SDRAM"):
 				m.d.sync += rw_ui.rw_copi.task.eq(Mux(burst_index==0, rw_cmds.RW_WRITE, rw_cmds.RW_IDLE))
 
-				with m.Switch(fifo_index):
-					for i, (src_fifo, dst_fifo, fifo_control) in enumerate(zip(src_fifos, dst_fifos, fifo_controls)):
-						# next_i = i + 1 if (i+1)<self.num_fifos else 0
-						with m.Case(i):									
-							def write_word_address_for_word_at_start_of_burst():
-								with m.If(burst_index == 0):
-									# todo - which of these is right?
-									m.d.sync += rw_ui.rw_copi.addr.eq(Cat(fifo_control.w_next_addr, Const(i, shape=2)))
-									# m.d.comb += self.sdram_addr.eq(Cat(i, fifo_control.w_next_addr))
-								with m.Else():
-									m.d.sync += rw_ui.rw_copi.addr.eq(0)
+				# only start a burst once the readwrite controller can queue it, then it runs to the end
+				with m.If((burst_index != 0) | rw_ui.rw_copi.ready):
+					with m.Switch(fifo_index):
+						for i, (src_fifo, dst_fifo, fifo_control) in enumerate(zip(src_fifos, dst_fifos, fifo_controls)):
+							# next_i = i + 1 if (i+1)<self.num_fifos else 0
+							with m.Case(i):									
+								def write_word_address_for_word_at_start_of_burst():
+									with m.If(burst_index == 0):
+										# todo - which of these is right?
+										m.d.sync += rw_ui.rw_copi.addr.eq(Cat(fifo_control.w_next_addr, Const(i, shape=2)))
+										# m.d.comb += self.sdram_addr.eq(Cat(i, fifo_control.w_next_addr))
+									with m.Else():
+										m.d.sync += rw_ui.rw_copi.addr.eq(0)
 								
-							def write_word_data_for_each_word_in_burst():
-								# this assumes that r_rdy has already been dealt with - so put this error transition to catch failure early
-								srcfifo_error = Signal()
-								with m.If(~src_fifo.r_rdy):
-									# m.next = "ERROR"
-									m.d.comb += srcfifo_error.eq(1)
-
-								m.d.comb += [
-									rw_ui.rw_copi.w_data.eq(src_fifo.r_data),
-									src_fifo.r_en.eq(1), 
-								]
-								m.d.sync += [
-									fifo_control.w_next_addr.eq(fifo_control.w_next_addr + 1)
-								]
+								def write_word_data_for_each_word_in_burst():
+									# this assumes that r_rdy has already been dealt with - so put this error transition to catch failure early
+									srcfifo_error = Signal()
+									with m.If(~src_fifo.r_rdy):
+										# m.next = "ERROR"
+										m.d.comb += srcfifo_error.eq(1)
+
+									m.d.comb += [
+										rw_ui.rw_copi.w_data.eq(src_fifo.r_data),
+										src_fifo.r_en.eq(1), 
+									]
+									m.d.sync += [
+										fifo_control.w_next_addr.eq(fifo_control.w_next_addr + 1)
+									]
 
 							
 												
-							write_word_address_for_word_at_start_of_burst()
-							write_word_data_for_each_word_in_burst()
-
-							# debug_rw_copi_addr = Signal(name=f"debug_{i}_rw_copi_addr", shape=Shape(rw_ui.rw_copi.addr))
-							# debug_rw_copi_w_data = Signal(name=f"debug_{i}_rw_copi_w_data", shape=Shape(rw_ui.rw_copi.w_data))
-							# debug_rw_copi_w_rdy = Signal(name=f"debug_{i}_copi_w_rdy")
-							# debug_rw_copi_w_en = Signal(name=f"debug_{i}_copi_w_en")
-							# m.d.comb += [
-							# 	debug_rw_copi_addr.eq(Mux(burst_index == 0, 	Cat(fifo_controls[i].w_next_addr, fifo_index)), 	0),
-							# 	debug_rw_copi_w_data.eq(src_fifos[i].r_data),
-							# 	src_fifos[i].r_en.eq(1), 
-							# 	# debug_rw_copi_w_rdy.eq(src_fifos[fifo_index].r_data),
-							# 	# debug_rw_copi_r_en.eq(src_fifos[fifo_index].r_data),
-							# ]
+								write_word_address_for_word_at_start_of_burst()
+								write_word_data_for_each_word_in_burst()
+
+								# debug_rw_copi_addr = Signal(name=f"debug_{i}_rw_copi_addr", shape=Shape(rw_ui.rw_copi.addr))
+								# debug_rw_copi_w_data = Signal(name=f"debug_{i}_rw_copi_w_data", shape=Shape(rw_ui.rw_copi.w_data))
+								# debug_rw_copi_w_rdy = Signal(name=f"debug_{i}_copi_w_rdy")
+								# debug_rw_copi_w_en = Signal(name=f"debug_{i}_copi_w_en")
+								# m.d.comb += [
+								# 	debug_rw_copi_addr.eq(Mux(burst_index == 0, 	Cat(fifo_controls[i].w_next_addr, fifo_index)), 	0),
+								# 	debug_rw_copi_w_data.eq(src_fifos[i].r_data),
+								# 	src_fifos[i].r_en.eq(1), 
+								# 	# debug_rw_copi_w_rdy.eq(src_fifos[fifo_index].r_data),
+								# 	# debug_rw_copi_r_en.eq(src_fifos[fifo_index].r_data),
+								# ]
 						
 					
 
-				def when_burst_ends_change_fifo_or_readwrite():
-					with m.If((burst_index + 1) == self.config_params.burstlen): # burst finished
-						m.d.sync += burst_index.eq(0)
+					def when_burst_ends_change_fifo_or_readwrite():
+						with m.If((burst_index + 1) == self.config_params.burstlen): # burst finished
+							m.d.sync += burst_index.eq(0)
 
-						with m.If((numburst_index + 1) == self.config_params.numbursts): # done several bursts with this fifo, now move on
-							m.d.sync += numburst_index.eq(0)
+							with m.If((numburst_index + 1) == self.config_params.numbursts): # done several bursts with this fifo, now move on
+								m.d.sync += numburst_index.eq(0)
 
-							m.d.sync += fifo_index.eq(next_srcfifo_index) # prepare to do the next fifo
+								m.d.sync += fifo_index.eq(next_srcfifo_index) # prepare to do the next fifo
 
-							with m.If(self.refresher.ui.request_to_refresh_soon):# | all_dstfifos_written):
-								m.next = "REFRESH_OR_IDLE"
+								with m.If(refresh_before_next_sequence):# | all_dstfifos_written):
+									m.next = "REFRESH_OR_IDLE"
 
-							with m.Else():
-								with m.If(~next_srcfifo_readable_to_sdram):
-									m.d.sync += fifo_index.eq(0)
+								with m.Else():
+									with m.If(~next_srcfifo_readable_to_sdram):
+										m.d.sync += fifo_index.eq(0)
 
-									with m.If(next_dstfifo_writeable_from_sdram):
-										m.next = "READ_SDRAM_TO_DSTFIFOS"
-									with m.Else():
-										m.next = "REFRESH_OR_IDLE"
+										with m.If(next_dstfifo_writeable_from_sdram):
+											m.next = "READ_SDRAM_TO_DSTFIFOS"
+										with m.Else():
+											m.next = "REFRESH_OR_IDLE"
 								
-								# with m.Else():
-								# 	m.d.sync += fifo_index.eq(next_srcfifo_index) # prepare to do the next fifo
+									# with m.Else():
+									# 	m.d.sync += fifo_index.eq(next_srcfifo_index) # prepare to do the next fifo
 
-						with m.Else():
-							m.d.sync += numburst_index.eq(numburst_index + 1)
+							with m.Else():
+								m.d.sync += numburst_index.eq(numburst_index + 1)
 
-					with m.Else():
-						m.d.sync += burst_index.eq(burst_index + 1)
+						with m.Else():
+							m.d.sync += burst_index.eq(burst_index + 1)
 						
-				when_burst_ends_change_fifo_or_readwrite()
+					when_burst_ends_change_fifo_or_readwrite()
+				with m.Else():
+					m.d.sync += rw_ui.rw_copi.task.eq(rw_cmds.RW_IDLE)
 
 			with m.State("READ_SDRAM_TO_DSTFIFOS"):
 			# 	# this state exists to ensure that the dqm pin is kept high for <latency> clock cycles,
@@ -503,65 +550,77 @@ class sdram_n_fifo(Elaboratable):
 			# with m.State("_READ_SDRAM_TO_DSTFIFOS"):
 				m.d.sync += rw_ui.rw_copi.task.eq(Mux(burst_index==0, rw_cmds.RW_READ, rw_cmds.RW_IDLE))
 
-				with m.Switch(fifo_index):
+				# only start a burst once the readwrite controller can queue it, then it runs to the end
+				with m.If((burst_index != 0) | rw_ui.rw_copi.ready):
+					with m.Switch(fifo_index):
 
-					for i in range(self.config_params.num_fifos): # for each fifo,
-						with m.Case(i):
+						for i in range(self.config_params.num_fifos): # for each fifo,
+							with m.Case(i):
 
-							def write_word_address_for_word_at_start_of_burst():
-								with m.If(burst_index == 0):
-									m.d.sync += rw_ui.rw_copi.addr.eq(Cat(fifo_controls[i].r_next_addr, fifo_index))
-								with m.Else():
-									m.d.sync += rw_ui.rw_copi.addr.eq(0)
-
-							def increment_address_read_counter():
-								""" 
-								Note - due to the sdram cas delay, the read back data is dealt with elsewhere,
-								this just helps to record how much data is still unread in sdram.
-								Note that we should only trust this after <cas_delay> cycles.
-								"""
-								m.d.sync += [
-									fifo_controls[i].r_next_addr.eq(fifo_controls[i].r_next_addr + 1)
-								]
+								def write_word_address_for_word_at_start_of_burst():
+									with m.If(burst_index == 0):
+										m.d.sync += rw_ui.rw_copi.addr.eq(Cat(fifo_controls[i].r_next_addr, fifo_index))
+									with m.Else():
+										m.d.sync += rw_ui.rw_copi.addr.eq(0)
+
+								def increment_address_read_counter():
+									""" 
+									Note - due to the sdram cas delay, the read back data is dealt with elsewhere,
+									this just helps to record how much data is still unread in sdram.
+									Note that we should only trust this after <cas_delay> cycles.
+									"""
+									m.d.sync += [
+										fifo_controls[i].r_next_addr.eq(fifo_controls[i].r_next_addr + 1)
+									]
 								
 
-							def when_burst_ends_change_fifo_or_readwrite():
-								with m.If((burst_index + 1) == self.config_params.burstlen): # burst finished
-									m.d.sync += burst_index.eq(0)
+								def when_burst_ends_change_fifo_or_readwrite():
+									with m.If((burst_index + 1) == self.config_params.burstlen): # burst finished
+										m.d.sync += burst_index.eq(0)
 
-									with m.If((numburst_index + 1) == self.config_params.numbursts): # done several bursts with this fifo, now move on
-										m.d.sync += numburst_index.eq(0)
+										with m.If((numburst_index + 1) == self.config_params.numbursts): # done several bursts with this fifo, now move on
+											m.d.sync += numburst_index.eq(0)
 
-										m.d.sync += fifo_index.eq(next_dstfifo_index) # prepare to do the next fifo
+											m.d.sync += fifo_index.eq(next_dstfifo_index) # prepare to do the next fifo
 
-										with m.If(self.refresher.ui.request_to_refresh_soon):
-											m.next = "REFRESH_OR_IDLE"
+											with m.If(refresh_before_next_sequence):
+												m.next = "REFRESH_OR_IDLE"
 											
-										with m.Else():
-											with m.If(~next_dstfifo_writeable_from_sdram):
-												m.d.sync += fifo_index.eq(0)
-
-												with m.If(next_srcfifo_readable_to_sdram):
-													m.next = "WRITE_SRCFIFOS_TO_SDRAM"
-												with m.Else():
-													m.next = "REFRESH_OR_IDLE"
+											with m.Else():
+												with m.If(~next_dstfifo_writeable_from_sdram):
+													m.d.sync += fifo_index.eq(0)
+
+													with m.If(next_srcfifo_readable_to_sdram):
+														m.next = "WRITE_SRCFIFOS_TO_SDRAM"
+													with m.Else():
+														m.next = "REFRESH_OR_IDLE"
 																								
-											# with m.Else():
-											# 	m.d.sync += fifo_index.eq(next_dstfifo_index) # do the next fifo
+												# with m.Else():
+												# 	m.d.sync += fifo_index.eq(next_dstfifo_index) # do the next fifo
 
-									with m.Else():
-										m.d.sync += numburst_index.eq(numburst_index + 1)
+										with m.Else():
+											m.d.sync += numburst_index.eq(numburst_index + 1)
 
-								with m.Else():
-									m.d.sync += burst_index.eq(burst_index + 1)
+									with m.Else():
+										m.d.sync += burst_index.eq(burst_index + 1)
 
-							increment_address_read_counter()
-							write_word_address_for_word_at_start_of_burst()
-							when_burst_ends_change_fifo_or_readwrite()
+								increment_address_read_counter()
+								write_word_address_for_word_at_start_of_burst()
+								when_burst_ends_change_fifo_or_readwrite()
+				with m.Else():
+					m.d.sync += rw_ui.rw_copi.task.eq(rw_cmds.RW_IDLE)
 			
 			with m.State("ERROR"):
 				pass
 
+		# let the refresher pull refreshes in while there's nothing to move to or from the sdram
+		# or has stopped for the next refresh
+		m.d.sync += self.refresher.ui.sdram_idle.eq(fsm.ongoing("REFRESH_OR_IDLE") & 
+			(refresh_before_next_sequence | ~(next_srcfifo_readable_to_sdram | next_dstfifo_writeable_from_sdram)))
+
+		# and skip refreshes while there is nothing in the sdram to preserve
+		m.d.sync += self.refresher.ui.sdram_empty.eq(~sdram_stores_data)
+
 
 		if isinstance(self.utest, FHDLTestCase):
 			add_clock(m, "sync")
@@ -723,55 +782,112 @@ if __name__ == "__main__":
 					domain = self.config_params.fifo_read_domains[i]
 					yield process, domain
 
+			elif test_id == "fifoInterfaceTb_sim_withRefreshesSkippedWhileEmpty_thatSequencesDontWaitForARefresh":
+				self.fifos_written = self.config_params.num_fifos * [False]
+
+				def write_counter_values_to_fifo(fifo, num_writes, fifo_id):
+					def func():
+						i = 0
+						while i < num_writes:
+							yield Settle()
+							written = (yield fifo.w_rdy)
+							yield fifo.w_data.eq((fifo_id << 4*3)|(i & 0xFFF))
+							yield fifo.w_en.eq(written)
+							yield
+							i += written
+						yield fifo.w_en.eq(0)
+						self.fifos_written[fifo_id] = True
+					return func
+
+				def read_from_fifo_once_all_written(fifo):
+					# once the src_fifos and dst_fifos are full, the writes can only finish if the words go through the sdram.
+					# todo - check the values read back, once words stop going missing on their way back from the sdram
+					def func():
+						yield Passive()
+						while not all(self.fifos_written):
+							yield
+						yield fifo.r_en.eq(1)
+					return func
+
+				def check_sequences_start_with_time_before_the_next_refresh():
+					# the fsm decides to start a sequence from values registered a clock earlier, 
+					# so look two clocks back from the first clock of the sequence
+					def func():
+						yield Passive()
+						fsm = self.sdram_n_fifo.fsm
+						refresher_ui = self.sdram_n_fifo.refresher.ui
+						num_adjacent_words = self.config_params.num_adjacent_words
+						history = [] # (in_sequence, refresh_deadline, sdram_empty) for the last few clocks
+						self.sequences_started = 0
+						while True:
+							yield Settle()
+							in_sequence = (yield fsm.ongoing("WRITE_SRCFIFOS_TO_SDRAM")) | (yield fsm.ongoing("READ_SDRAM_TO_DSTFIFOS"))
+							history = (history + [(in_sequence, (yield refresher_ui.refresh_deadline), (yield refresher_ui.sdram_empty))])[-3:]
+							if (len(history) == 3) and in_sequence and not history[1][0]:
+								_, deadline, _ = history[0]
+								_, _, sdram_was_empty = history[1]
+								assert (deadline >= 2*num_adjacent_words) or sdram_was_empty, \
+									f"a sequence started with a refresh deadline of only {deadline} clocks"
+								self.sequences_started += 1
+							yield
+					return func
+
+				for i in range(self.config_params.num_fifos):
+					yield write_counter_values_to_fifo(self.sdram_n_fifo.ui_fifos[i], self.utest_params.num_fifo_writes, i), self.config_params.fifo_write_domains[i]
+					yield read_from_fifo_once_all_written(self.sdram_n_fifo.ui_fifos[i]), self.config_params.fifo_read_domains[i]
+				yield check_sequences_start_with_time_before_the_next_refresh(), "sync"
+
 		def elaborate(self, platform = None):
 			m = Module()
 
 			m.submodules.sdram_n_fifo = self.sdram_n_fifo
 
 
-			with m.FSM(name="testbench_fsm") as fsm:
-				with m.State("INITIAL"):
-					write_counter = Signal(shape=bits_for(self.utest_params.num_fifo_writes))
-					m.next = "FILL_FIFOS"
+			# the other tests write and read the fifos from their sim processes instead
+			if self.utest.get_test_id() == "fifoInterfaceTb_sim_thatWrittenFifos_canBeReadBack":
+				with m.FSM(name="testbench_fsm") as fsm:
+					with m.State("INITIAL"):
+						write_counter = Signal(shape=bits_for(self.utest_params.num_fifo_writes))
+						m.next = "FILL_FIFOS"
 				
-				with m.State("FILL_FIFOS"):
-					m.d.sync += write_counter.eq(write_counter + 1)
-					with m.If(write_counter == self.utest_params.num_fifo_writes):
-						m.next = "READ_BACK_FIFOS"
-
-					for i, each_fifo in enumerate(self.sdram_n_fifo.ui_fifos):
-						m.d.sync += [
-							each_fifo.w_en.eq(each_fifo.w_rdy),
-							each_fifo.w_data.eq((i << 4*3)|(each_fifo.w_data & 0xFFF)),
-						]
+					with m.State("FILL_FIFOS"):
+						m.d.sync += write_counter.eq(write_counter + 1)
+						with m.If(write_counter == self.utest_params.num_fifo_writes):
+							m.next = "READ_BACK_FIFOS"
+
+						for i, each_fifo in enumerate(self.sdram_n_fifo.ui_fifos):
+							m.d.sync += [
+								each_fifo.w_en.eq(each_fifo.w_rdy),
+								each_fifo.w_data.eq((i << 4*3)|(each_fifo.w_data & 0xFFF)),
+							]
 							
 
-					...
+						...
 
-				# with m.State("WAIT"): # to confirm that refresh can preserve the data
-					# ...
+					# with m.State("WAIT"): # to confirm that refresh can preserve the data
+						# ...
 
-				with m.State("READ_BACK_FIFOS"):
-					m.d.sync += write_counter.eq(write_counter - 1)
-					with m.If(write_counter == 0):
-						m.next = "DONE"
+					with m.State("READ_BACK_FIFOS"):
+						m.d.sync += write_counter.eq(write_counter - 1)
+						with m.If(write_counter == 0):
+							m.next = "DONE"
 
-					for i, each_fifo in enumerate(self.sdram_n_fifo.ui_fifos):
-						last_read = Signal(name = f"last_read_{i}")
-						m.d.sync += [
-							each_fifo.r_en.eq(each_fifo.r_rdy),
+						for i, each_fifo in enumerate(self.sdram_n_fifo.ui_fifos):
+							last_read = Signal(name = f"last_read_{i}")
+							m.d.sync += [
+								each_fifo.r_en.eq(each_fifo.r_rdy),
 							
-						]
-						with m.If(each_fifo.r_en):
-							m.d.sync += last_read.eq(each_fifo.r_data) # not used yet
+							]
+							with m.If(each_fifo.r_en):
+								m.d.sync += last_read.eq(each_fifo.r_data) # not used yet
 						
-					...
+						...
 
-				with m.State("ERROR"): # not used yet
-					...
+					with m.State("ERROR"): # not used yet
+						...
 				
-				with m.State("DONE"):
-					...
+					with m.State("DONE"):
+						...
 
 			# if isinstance(self.utest, FHDLTestCase):
 			# 	add_clock(m, "sync")
@@ -850,6 +966,52 @@ if __name__ == "__main__":
 					f"{current_filename}_{self.get_test_id()}.vcd"):
 					sim.run()
 
+		class fifoInterfaceTb_sim_withRefreshesSkippedWhileEmpty_thatSequencesDontWaitForARefresh(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 10e6
+				config_params.burstlen = 8
+				config_params.numbursts = 6
+				# while the sdram is empty no refresh is requested, so the deadline stays at 
+				# 2*39-1 clocks, which is less than the 96 that a sequence of 48 words needs
+				config_params.refresh_debt_limit = 2
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.num_fifos = 2
+				config_params.fifo_read_domains = [f"fifo_{i}" for i in range(config_params.num_fifos)]
+				config_params.fifo_write_domains = config_params.fifo_read_domains
+				config_params.fifo_width = 16
+				config_params.fifo_depth = config_params.burstlen * config_params.numbursts * 4 # 192
+				config_params.readback_fifo_depth = 50
+
+				utest_params = Params()
+				utest_params.timeout_runtime = 1e-3 # arbitarily chosen, so the simulation won't run forever if it breaks
+				utest_params.fifo_clk_freqs = config_params.num_fifos * [8e6]
+				utest_params.num_fifo_writes = config_params.burstlen * config_params.numbursts * 20 # more than src_fifo and dst_fifo can hold, as their depth is rounded up to a power of 2
+				utest_params.debug_flags = Array(Signal(name=f"debug_flag_{i}") for i in range(6))
+				utest_params.enable_detailed_model_printing = False
+				utest_params.use_sdram_model = True
+
+				tb = Testbench(config_params, utest_params, utest=self)
+
+				sim = Simulator(tb)
+				sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+				for i, domain in enumerate(config_params.fifo_read_domains):
+					sim.add_clock(period=1/utest_params.fifo_clk_freqs[i], domain=domain)
+				
+				for process, domain in tb.get_sim_sync_processes():
+					sim.add_sync_process(process, domain=domain)
+
+				with sim.write_vcd(
+					f"{current_filename}_{self.get_test_id()}.vcd"):
+					sim.run_until(utest_params.timeout_runtime)
+
+				assert all(tb.fifos_written), f"the writes stalled, with only fifos {tb.fifos_written} fully written"
+				assert tb.sequences_started > 0
+
 
 	if args.action in ["generate", "simulate"]:
 		# now run each FHDLTestCase above 
@@ -4,8 +4,9 @@ from typing import List
 import textwrap
 import numpy as np
 import enum
+from collections import deque
 
-from amaranth import Elaboratable, Module, Signal, Mux, ClockSignal, ClockDomain, ResetSignal, Cat, Const
+from amaranth import Elaboratable, Module, Signal, Mux, ClockSignal, ClockDomain, ResetSignal, Cat, Const, Array
 from amaranth.hdl.ast import Rose, Stable, Fell, Past, Initial
 from amaranth.hdl.rec import DIR_NONE, DIR_FANOUT, DIR_FANIN, Layout, Record
 from amaranth.hdl.mem import Memory
@@ -22,19 +23,46 @@ from amaranth.utils import bits_for
 from amtest.boards.ulx3s.common.clks import add_clock
 from amtest.utils import FHDLTestCase, Params
 
-from parameters_standard_sdram import rw_cmds, sdram_cmds
+from parameters_standard_sdram import rw_cmds, sdram_cmds, mode_burst_length
 
 
-class sdram_sim_utils:
+class trace_levels(enum.IntEnum):
+	NONE	= 0 # nothing is printed
+	ERROR	= 1 # protocol errors, with a dump of the memory of the bank it happened in
+	WARNING	= 2 # e.g. reads of words that were never written, or lapsed refreshes
+	INFO	= 3 # periodic status, e.g. from the refresh monitor
+	DEBUG	= 4 # each command, as seen by the bank it is for
+	DUMP	= 5 # as DEBUG, and the bank's memory on every read and write, which is slow
+
+
+class model_tracer:
+	"""
+	Level-based tracing for the model. A message is given as a format string and its arguments,
+	which are only formatted if its level is enabled, so a disabled trace costs one comparison.
+	"""
+	def __init__(self, utest_params):
+		self.trace_level = utest_params.model_trace_level
+
+	def tracing(self, level):
+		return level <= self.trace_level
+
+	def trace(self, level, fmt, *args):
+		if level <= self.trace_level:
+			self.print_trace(fmt.format(*args))
+
+	def print_trace(self, outstr):
+		print(outstr)
+
+
+class sdram_sim_utils(model_tracer):
 	def __init__(self, config_params, utest_params):
+		super().__init__(utest_params)
 		self.config_params = config_params
 		self.utest_params = utest_params
 
-		# to enable the readback mechanism
-		self.reads_to_return = [
-			# {"bank_src" : 3, "data" : 0},	# for example
-			# {"bank_src" : None}
-		]
+		# to enable the readback mechanism, this is a model_read_returns, which is created when
+		# the simulation starts, as the cas latency may not have been set yet
+		self.reads_to_return = None
 
 
 	def num_clk_cycles(self, delay):
@@ -42,7 +70,7 @@ class sdram_sim_utils:
 			num_clk_cycles = int(np.ceil(self.config_params.clk_freq * delay.value))
 		else:
 			num_clk_cycles = int(np.ceil(self.config_params.clk_freq * delay))
-			print(f"Delay is {delay}, cycles is {num_clk_cycles}")
+			self.trace(trace_levels.DEBUG, "Delay is {}, cycles is {}", delay, num_clk_cycles)
 		# ceil, so we provide enough time
 		# num_clk_cycles -= 1
 		# print("Num clk cycles: ", num_clk_cycles)
@@ -52,516 +80,888 @@ class sdram_sim_utils:
 		decoded_cmd = sdram_cmds((yield io.decoded_cmd))
 		# print(f"cmd is {decoded_cmd}")
 		return decoded_cmd
-	
-	def assert_cmd_is(self, io, expected_cmd):
-		# print(f"Asserting {yield from self.get_cmd(io)} == {expected_cmd}")
-		assert (yield from self.get_cmd(io)) == expected_cmd
 
-	def assert_idle_cmd_for(self, io, min_duration, focus_bank = None):
-		""" 
-		This will assert that for at least <min_duration> [seconds], the cmdi is in <valid_idle_states>.
-		After that period, this function returns when cmdi not in <valid_idle_states>, with the new cmd.
 
-		This will do some yields, so when this function returns/finishes (?),
-		yields have been done so the next step can be done without more yields.
+class model_bank_memory:
+	"""
+	The words stored in one bank, as a preallocated rows x columns array, with a valid bit for each 
+	word so that reading a word that was never written can be caught.
+	np.zeros() only takes up memory for the pages that are written to, so filling the whole chip 
+	in a simulation still uses a bounded amount of memory, with no python object per word.
+	"""
+	def __init__(self, config_params):
+		rw_params = config_params.rw_params
+		shape = (1 << rw_params.ROW_BITS.value, 1 << rw_params.COL_BITS.value)
+		self.col_mask = shape[1] - 1 # the columns of a row. model_bank wraps each burst within its block of columns
+
+		self.data = np.zeros(shape, dtype=np.uint16 if rw_params.DATA_BITS.value <= 16 else np.uint32)
+		self.valid = np.zeros(shape, dtype=bool)
+		self.rows_written = set() # so the memory can be inspected without searching every row
 
-		thoughts
-		- must wait this much time... but how to catch for if invalid commands etc occur in this time? ...cover / bmc?
-		"""
-		valid_idle_states = [sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL]
-		initial_state = yield from self.get_cmd(io)
-		clks = 0
-		while True:
-			yield Settle() # trying using clki negedge clock # does this fix the simulations being a bit non-deterministic? (commant from pre-march 2022)
-			cmd = yield from self.get_cmd(io)
-			if (cmd not in valid_idle_states) and ((cmd != initial_state) | (clks > 0)) and (True if (focus_bank == None) else ((yield io.ba) == focus_bank)):# (cmd == end_state):
-				if not (clks >= self.num_clk_cycles(min_duration)):
-					print("Error: ", clks, self.num_clk_cycles(min_duration))
-					assert 0
-					# print("xx a")
-			return cmd, clks # the actual command that caused this block to stop
-		else:
-			# print("xx c")
-			# yield Settle() # trying using clki negedge clock
-			yield
-			# yield Settle() # trying using clki negedge clock
-			clks += 1
-			# print(clks)
+	def write(self, row, column, value):
+		self.data[row, column & self.col_mask] = value
+		self.valid[row, column & self.col_mask] = True
+		self.rows_written.add(row)
 
+	def read(self, row, column):
+		# returns None if this word hasn't been written
+		if not self.valid[row, column & self.col_mask]:
+			return None
+		return int(self.data[row, column & self.col_mask])
 
-class model_sdram_sims(sdram_sim_utils):
-	def __init__(self, config_params, utest_params):
+	def get_written_words(self, row):
+		columns = np.flatnonzero(self.valid[row])
+		return zip(columns.tolist(), self.data[row, columns].tolist())
 
-		if not hasattr(utest_params, "enable_detailed_model_printing"): utest_params.enable_detailed_model_printing = True
 
-		super().__init__(config_params, utest_params)
-	
-	""" 
-	todo:
-	- add startup monitor (i.e. the thing that monitors what the set burstlen is)
+class model_refresh_monitor(model_tracer):
+	"""
+	Monitors whether the refresh requirements of the chip are met, i.e. ic_refresh_timing.NUM_REF refreshes,
+	e.g. 8192, in every ic_refresh_timing.T_REF, as on p.24 of the datasheet. Only the refresh and self refresh 
+	commands step it, so it costs nothing on the other clocks:
+	- A counter stands for the charge left in the cells. It starts full, loses one for each clock, and gains 
+	T_REF / NUM_REF clocks' worth for each refresh, up to a full T_REF. The clocks since it was last brought 
+	up to date are all taken off at once, at the next refresh, self refresh or check, and if it would have run 
+	out in between, the clock it ran out at is recorded as the failure
+	- The requirement is also checked directly, over a sliding window of the clocks of the last NUM_REF refreshes
+	- Entering self refresh fills the counter and clears the window, as the chip then refreshes itself, 
+	and the model isn't clocked
+
+	check() brings both up to date, e.g. at the end of a simulation, and retention_failed_at is the first clock 
+	at which either failed. The chip's internal counter of the next row to refresh isn't modelled.
+	"""
+	def __init__(self, config_params, utest_params):
+		super().__init__(utest_params)
+
+		# the counter loses 1 for each clock, representing the time passing as a measure of capacitor leakage, 
+		# which is the whole reason the refresh mechanism exists, to compensate for it
+		period_s = config_params.ic_refresh_timing.T_REF.value
+		refreshes_per_period = config_params.ic_refresh_timing.NUM_REF.value
+		self.clks_per_period = period_s * config_params.clk_freq
+		self.increment_per_refresh = (self.clks_per_period / refreshes_per_period)
+
+		self.counter_max = self.clks_per_period # is this rignt?
+
+		# initialise the counter with some small value
+		# counter = increment_per_refresh 
+		# no! initialise it to be 'full'... as there is no data to refresh yet
+		self.counter = self.counter_max
+		self.clk_at_counter = 0 # the clock the counter was last brought up to date at
+
+		# the clocks of the last <refreshes_per_period> refreshes, the first of which 
+		# can't be more than a period before the next refresh
+		self.refresh_clks = deque(maxlen=refreshes_per_period)
+
+		self.interval_between_updates = 100
+		self.clk_at_update = 0
+		self.min_counter_value = self.counter
+		self.max_counter_value = self.counter
+		self.memory_lapsed = False
+		self.retention_failed_at = None # the first clock at which the refresh requirements were failed
+
+	def record_failure(self, clk):
+		self.memory_lapsed = True
+		if self.retention_failed_at == None:
+			self.retention_failed_at = clk
+
+	def update_counter(self, clk):
+		# the counter decrements once per clock, so take off all the clocks since it was last updated at once
+		elapsed_clks = clk - self.clk_at_counter
+		if elapsed_clks > 0:
+			if self.counter <= elapsed_clks:
+				self.record_failure(self.clk_at_counter + max(int(np.ceil(self.counter)) - 1, 0))
+			self.counter = max(self.counter - elapsed_clks, 0)
+			self.clk_at_counter = clk
+		self.min_counter_value = min(self.min_counter_value, self.counter)
+
+	def check_window(self, clk):
+		# fewer than <refreshes_per_period> refreshes in the period before this clock?
+		if (len(self.refresh_clks) == self.refresh_clks.maxlen) and ((clk - self.refresh_clks[0]) > self.clks_per_period):
+			self.record_failure(clk)
+
+	def step(self, cmd, clk):
+		# only needs calling on a refresh or self refresh command, at clock <clk> of the model
+		self.update_counter(clk)
+
+		if cmd == sdram_cmds.CMD_REF:
+			self.counter = (self.counter + self.increment_per_refresh) if ((self.counter + self.increment_per_refresh) < self.counter_max) else self.counter
+			self.check_window(clk)
+			self.refresh_clks.append(clk)
+
+		elif cmd == sdram_cmds.CMD_SELF:
+			# in self refresh, the chip refreshes each row itself, and the model isn't clocked,
+			# so the requirements start again from when it exits
+			self.counter = self.counter_max
+			self.refresh_clks.clear()
+
+		self.max_counter_value = max(self.max_counter_value, self.counter)
+
+		### monitoring
+		if (clk - self.clk_at_update) >= self.interval_between_updates:
+			self.report(clk)
+
+	def report(self, clk):
+		# is this maths right/useful? does the % really not matter, as long as it doesn't dip to 0?
+		# and if it dips to zero, indicate that the data has been lost, which isn't all bad, especially
+		# if it hadn't had new data loaded yet. So be able to recover from this situation
+		if self.tracing(trace_levels.INFO):
+			def as_percentage(val):
+				return f"{100*val/self.clks_per_period}%"
+			self.trace(trace_levels.INFO, "Refresh counter: {} (), min={}, max={}", 
+				as_percentage(self.counter), as_percentage(self.min_counter_value), as_percentage(self.max_counter_value))
+		self.clk_at_update = clk
+		self.min_counter_value = self.counter
+		self.max_counter_value = self.counter
+		if self.memory_lapsed:
+			self.trace(trace_levels.WARNING, "Warning! Memory lapsed, all data in ram is now lost.")
+			self.memory_lapsed = False
+
+	def check(self, clk):
+		# e.g. at the end of a simulation, returns whether the refresh requirements were met up to clock <clk>
+		self.update_counter(clk)
+		self.check_window(clk)
+		self.report(clk)
+		return self.retention_failed_at == None
+
+
+class model_read_returns:
 	"""
+	The words due on dq, in a ring buffer with one slot for each of the next <latency> clocks,
+	so scheduling and returning a word takes the same time whatever the latency and burst length.
 
-	def toggle_debug_flag(self, i):
-		yield self.utest_params.debug_flags[i].eq(~(yield self.utest_params.debug_flags[i]))
+	A read command makes its bank the one whose words go on dq, as a read interrupts the burst 
+	of any other bank, and each word of its burst goes in the slot <latency> clocks ahead.
+	Words from a burst that has been interrupted are dropped, whatever order the banks are stepped in.
+	"""
+	EMPTY = -2 # dq isn't driven by the model
+	BLANK = -1 # dq is driven, but not with a bank's word, e.g. before a read's latency has elapsed, or when dqm masked it
+
+	def __init__(self, latency):
+		self.has_latency = (latency != None) # it is only needed once there are reads, which some tests don't do
+		self.latency = latency if self.has_latency else 1
+		self.slot_bank = [model_read_returns.EMPTY] * self.latency # the bank_id for each slot, or EMPTY/BLANK
+		self.slot_data = [0] * self.latency
+		self.head = 0 # the slot for this clock
+		self.reading_bank = None
+
+	def start_read(self, bank_id):
+		assert self.has_latency, "A read needs config_params.latency to be set"
+		self.reading_bank = bank_id
+
+		# pad the duration before <latency> with blanks, if needed
+		for offset in range(self.latency - 1):
+			i = (self.head + offset) % self.latency
+			if self.slot_bank[i] == model_read_returns.EMPTY:
+				self.slot_bank[i] = model_read_returns.BLANK
+
+	def schedule(self, bank_id, data = None):
+		# a data of None schedules a blank
+		if bank_id != self.reading_bank:
+			return # this bank's burst was interrupted
+
+		i = (self.head + self.latency - 1) % self.latency
+		if data == None:
+			self.slot_bank[i] = model_read_returns.BLANK
+		else:
+			self.slot_bank[i] = bank_id
+			self.slot_data[i] = data
 
-	def get_refresh_monitor_process(self, io):
-		"""
-		todo - implement the self-refresh functionality, as on p.24 of the datasheet
-		- To represent the refresh state of the chip
-		- To identify if the refresh requirements are failed
-		- refresh requirements:
-			- datasheet says '8k per 32ms' 
-				- so, in no 32ms period should there be fewer than 8192 refreshes?
-		- timing
-			- num_clocks = 32e-3 * f_dram = 4576000
-		- what to do about it?
-			- maybe every refresh cycle adds x to a counter; max value = ???
-			- and every clock cycle it decrements by one, if zero, sets an error flag
-			- so x = 4576000 / 8192 = 558.6 -> 559 increments per refresh
-		- how to handle complexities?
-			- self-refresh: 
-				- increment the counter on an internal timer
-
-		- note: the datasheet says that when refresh is done, one of either 'auto' or 'self', 
-		an internal bank/row (?) counter is used to ensure that the chip internals refreshes
-		the correct memory location in a rollover way? we don't need to worry about this
-		"""
-		def func():
-			# this assumes that the counter will reduce by 1 each clock cycle,
-			# representing the time passing as a measure of capacitor leakage, which is the
-			# whole reason the refresh mechanism exists, to compensates for it
-			period_s = self.config_params.ic_refresh_timing.T_REF.value
-			refreshes_per_period = self.config_params.ic_refresh_timing.NUM_REF.value
-			clks_per_period = period_s * self.config_params.clk_freq
-			increment_per_refresh = (clks_per_period / refreshes_per_period)
+	def pop(self):
+		# returns the (bank_src, data) due on dq this clock, with a bank_src of EMPTY or BLANK if there is no word
+		bank_src = self.slot_bank[self.head]
+		data = self.slot_data[self.head]
+		self.slot_bank[self.head] = model_read_returns.EMPTY
+		self.head = (self.head + 1) % self.latency
+		return bank_src, data
 
-			counter_max = clks_per_period # is this rignt?
+	def is_empty(self):
+		return all(bank_src == model_read_returns.EMPTY for bank_src in self.slot_bank)
 
-			# initialise the counter with some small value
-			# counter = increment_per_refresh 
-			# no! initialise it to be 'full'... as there is no data to refresh yet
-			counter = counter_max
+	def get_slots(self):
+		for offset in range(self.latency):
+			i = (self.head + offset) % self.latency
+			yield self.slot_bank[i], self.slot_data[i]
 
-			yield Passive()
-			interval_between_updates = 100
-			past_counter_values = []
-			memory_lapsed = False
-			while True:
-				try:
-					# ensure the banks are precharged...?
-					yield from self.assert_cmd_is(io, sdram_cmds.CMD_REF)
-					yield from self.assert_idle_cmd_for(io, min_duration = self.config_params.ic_timing.T_RC)
-					
-					# print("Only gets here if a refresh was done succesfully, ", counter)
-					counter = (counter + increment_per_refresh) if ((counter + increment_per_refresh) < counter_max) else counter
-					
-					# yield from self.assert_cmd_then_delay(sdram_cmds.CMD_REF,		min_duration = self.config_params.ic_timing.T_RC)
-				except AssertionError as e:
-					# A refresh either was not attempted or failed
-					pass
-				
-				counter = counter - 1 if counter > 0 else counter # decrement once per clock
-
-				### monitoring
-				past_counter_values.append(counter)
-				if len(past_counter_values) == interval_between_updates:
-					# is this maths right/useful? does the % really not matter, as long as it doesn't dip to 0?
-					# and if it dips to zero, indicate that the data has been lost, which isn't all bad, especially
-					# if it hadn't had new data loaded yet. So be able to recover from this situation
-					def as_percentage(val):
-						return f"{100*val/clks_per_period}%"
-					print(f"Refresh counter: {as_percentage(counter)} (), min={as_percentage(min(past_counter_values))}, max={as_percentage(max(past_counter_values))}")
-					past_counter_values = []
-					if memory_lapsed:
-						print("Warning! Memory lapsed, all data in ram is now lost.")
-						memory_lapsed = False
-
-				# assert counter > 0
-				if counter == 0:
-					memory_lapsed = True
-
-				# yield Settle() # trying using clki negedge clock
-				yield
-				# yield Settle() # trying using clki negedge clock
-				# print(counter)
-		return func, "clki"
 
-	def get_readwrite_process_for_bank(self, bank_id, io):
-		""" 
-		This should be called once for each bank, to make a separate bank monitor process
+class model_bank(model_tracer):
+	"""
+	The state of one bank, which is stepped once per clock by model_sdram_sims, with the
+	command bus as sampled that clock. Reads are scheduled onto the model's shared reads_to_return.
+
+	This asserts the timing of each command to the bank, unless utest_params.model_check_timing is False:
+	- T_RCD from the activate to a read or write
+	- T_RAS from the activate, and T_DPL from the last word written, to a precharge
+	- T_DAL from the last word of a write with auto precharge, which the bank waits for before it is idle
+	- T_RP from a precharge, and T_RC from a refresh, to an activate or refresh
+	T_RRD, T_MRD and T_RC between activates are only checked by model_cmd_trace_checker.
+	"""
+	class bank_states(enum.Enum):
+		IDLE			= 0,
+		ROW_ACTIVATED	= 1,
+		READ 			= 2,
+		WRITE 			= 3,
+		PRECHARGE 		= 4,
+		ERROR 			= 5
+
+	def __init__(self, model, bank_id):
+		super().__init__(model.utest_params)
+		self.model = model # for the shared reads_to_return, config_params and utest_params
+		self.config_params = model.config_params
+		self.utest_params = model.utest_params
+		self.bank_id = bank_id
+
+		self.bank_state = model_bank.bank_states.IDLE
+
+		self.bank_memory = model_bank_memory(self.config_params)
+		self.activated_row = None
+		self.column = None
+
+		self.writes_remaining = None
+		self.reads_remaining = None
+
+		self.auto_precharge = False
+
+		self.clks_since_active = None
+		self.clks_at_last_write = None
+		self.clks_since_precharge = None
+		self.clks_since_refresh = None
+
+	def print_trace(self, outstr):
+		colors = ["red", "green", "yellow", "blue"]
+		cprint(f"Bank {self.bank_id}, {self.bank_state} : {outstr}", colors[self.bank_id % len(colors)])
+
+	def inspect_bank_memory(self):
+		# prints whatever the trace level, so it can be used on demand
+		for row_id in sorted(self.bank_memory.rows_written):
+			data_str = f"from bank {self.bank_id}, row {hex(row_id)}:"
+			for i, (col_id, col_data) in enumerate(self.bank_memory.get_written_words(row_id)):
+				if i == 0:
+					data_str += f"col {hex(col_id)}:"
+					self.print_trace(data_str)
+					data_str = ""
+				data_str += f"[{hex(col_data)}]"
+				if (i+1)%self.config_params.burstlen==0:
+					self.print_trace(data_str)
+					data_str = ""
+			if data_str != "":
+				self.print_trace(data_str)
+	
+	def inspect_reads_to_return(self):
+		data_str = ""
+		for bank_src, value in self.model.reads_to_return.get_slots():
+			if bank_src == model_read_returns.EMPTY:
+				break
+			elif bank_src == model_read_returns.BLANK:
+				data_str += f"[]"
+			else:
+				data_str += f"[{hex(value)}]"
+		self.print_trace(f"reads to return: {data_str}")
+
+	def add_read_to_return(self, read_from_bank):
+		# returns whether a word that was never written was read
+		if not read_from_bank:
+			self.model.reads_to_return.schedule(self.bank_id)
+			return False
+
+		read_value = self.bank_memory.read(self.activated_row, self.column)
+		never_written = (read_value == None)
+		if never_written:
+			# typical issue - fix better! 
+			# for now, print info instead
+			self.trace(trace_levels.WARNING, "Read of a word that was never written! Ignoring\n{:#x} {:#x}", self.activated_row, self.column)
+			
+			# add fake data instead
+			read_value = 0xFACE # this suggests that the error was in the writing stage
+		
+		self.model.reads_to_return.schedule(self.bank_id, read_value)
+		return never_written
+
+	def step_column(self):
+		# a burst wraps around within its burstlen aligned block of columns, e.g. 6,7,0,1..5 for a burst length of 8, 
+		# and a full page burst wraps around within the row
+		full_page = (self.config_params.full_page_bursts if hasattr(self.config_params, "full_page_bursts") else False) or (self.config_params.burstlen > 8)
+		wrap_mask = self.bank_memory.col_mask if full_page else self.config_params.burstlen - 1
+		self.column = (self.column & ~wrap_mask) | ((self.column + 1) & wrap_mask)
+
+	def is_quiescent(self):
+		# i.e. not part way through a burst
+		return self.bank_state in [model_bank.bank_states.IDLE, model_bank.bank_states.ROW_ACTIVATED, model_bank.bank_states.ERROR]
+
+	def fast_forward(self, clks):
+		self.clks_since_active = self.clks_since_active + clks if (self.clks_since_active != None) else None
+		self.clks_since_precharge = self.clks_since_precharge + clks if (self.clks_since_precharge != None) else None
+		self.clks_since_refresh = self.clks_since_refresh + clks if (self.clks_since_refresh != None) else None
+
+	def assert_timing(self, timing_met, message):
+		# unless the test sends commands without their timing, e.g. to check how they are decoded
+		if self.utest_params.model_check_timing:
+			assert timing_met, message
+
+	def assert_precharged_and_refreshed(self, cmd):
+		# before an activate or a refresh, T_RP after the last precharge and T_RC after the last refresh
+		if self.clks_since_precharge != None:
+			self.assert_timing(self.clks_since_precharge >= self.model.num_clk_cycles(self.config_params.ic_timing.T_RP), f"T_RP violated by {cmd}")
+		if self.clks_since_refresh != None:
+			self.assert_timing(self.clks_since_refresh >= self.model.num_clk_cycles(self.config_params.ic_timing.T_RC), f"T_RC violated by {cmd}")
+
+	def step(self, cmd, a, dq_copi, dqm):
 		"""
-		def func():
+		Advances this bank by one clock. cmd is NOP unless the command is for this bank.
+		Returns the ids of the debug flags to toggle.
+		"""
+		bank_states = model_bank.bank_states
+		debug_flags_to_toggle = []
+
+		if self.tracing(trace_levels.DEBUG) and (cmd not in [
+				sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL,
+				sdram_cmds.CMD_PRE, sdram_cmds.CMD_PALL,
+				sdram_cmds.CMD_REF, sdram_cmds.CMD_SELF,
+				sdram_cmds.CMD_MRS
+			]):
+			self.trace(trace_levels.DEBUG, "cmd: {}, clks since active: {}", cmd, self.clks_since_active)
+
+		while True: # so a command can be looked at again after a change of state
+			# --------------------------------------------------------
+			if self.bank_state == bank_states.IDLE:
+				if cmd == sdram_cmds.CMD_ACT:
+					self.assert_precharged_and_refreshed(cmd)
+					self.activated_row = a
+					self.trace(trace_levels.DEBUG, "Activated row: {:#x}", self.activated_row)
+					self.clks_since_active = 0
+					self.bank_state = bank_states.ROW_ACTIVATED
+
+				elif cmd == sdram_cmds.CMD_REF:
+					self.assert_precharged_and_refreshed(cmd)
+					self.clks_since_refresh = 0
+
+				elif cmd in [sdram_cmds.CMD_PRE, sdram_cmds.CMD_PALL]:
+					self.clks_since_precharge = 0 # as the bank is precharged again, even with no open row
+
+				elif cmd not in [
+						sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL,
+						sdram_cmds.CMD_PRE, sdram_cmds.CMD_PALL,
+						sdram_cmds.CMD_REF, sdram_cmds.CMD_SELF,
+						sdram_cmds.CMD_MRS
+					]:
+					self.trace(trace_levels.ERROR, "Error! cmd  is {}", cmd)
+					self.bank_state = bank_states.ERROR
+					if self.tracing(trace_levels.ERROR):
+						self.inspect_bank_memory()
+
+			elif self.bank_state == bank_states.ROW_ACTIVATED:
+				if cmd in [sdram_cmds.CMD_WRITE, sdram_cmds.CMD_WRITE_AP]:
+					self.assert_timing(self.clks_since_active >= self.model.num_clk_cycles(self.config_params.ic_timing.T_RCD), "T_RCD violated by write")
+					if self.tracing(trace_levels.DUMP):
+						self.inspect_bank_memory()
+
+					self.auto_precharge = (cmd == sdram_cmds.CMD_WRITE_AP)
+					self.column = a & self.bank_memory.col_mask
+					self.bank_memory.write(self.activated_row, self.column, dq_copi)
+					self.writes_remaining = self.config_params.burstlen - 1
+					if self.writes_remaining > 0: # this deals with the case of a burst length of 1
+						self.bank_state = bank_states.WRITE
+				
+				elif cmd in [sdram_cmds.CMD_READ, sdram_cmds.CMD_READ_AP]:
+					self.assert_timing(self.clks_since_active >= self.model.num_clk_cycles(self.config_params.ic_timing.T_RCD), "T_RCD violated by read")
+					if self.tracing(trace_levels.DUMP):
+						self.inspect_bank_memory()
+					self.auto_precharge = (cmd == sdram_cmds.CMD_READ_AP)
+					self.column = a & self.bank_memory.col_mask
+					self.reads_remaining = self.config_params.burstlen
+
+					# this bank is now controlling reads in <latency> cycles, so any reads other
+					# banks have scheduled from then on are dropped
+					self.model.reads_to_return.start_read(self.bank_id)
+
+					# now schedule in writes from this bank, do one for
+					# each clock after read, because that's when dqm is sampled
+					# note: these writes will appear on the dqm bus <latency> clocks later
+					if self.add_read_to_return(read_from_bank=not dqm):
+						debug_flags_to_toggle.append(1)
+
+					self.step_column()
+					self.reads_remaining -= 1
+
+					# todo - do reads of length 1 exist? or need to be implemented?
+					self.bank_state = bank_states.READ
+
+				elif cmd in [sdram_cmds.CMD_PRE, sdram_cmds.CMD_PALL]:
+					# the row was left open by a read/write without auto precharge, so close it now
+					self.assert_timing(self.clks_since_active >= self.model.num_clk_cycles(self.config_params.ic_timing.T_RAS), "T_RAS violated by precharge")
+					if self.clks_at_last_write != None:
+						self.assert_timing((self.clks_since_active-self.clks_at_last_write) >= self.model.num_clk_cycles(self.config_params.ic_timing.T_DPL), "T_DPL violated by precharge")
+
+					self.trace(trace_levels.DEBUG, "Precharged row: {:#x}", self.activated_row)
+
+					self.activated_row = None
+					self.clks_since_active = None
+					self.clks_at_last_write = None
+					self.clks_since_precharge = 0
+					self.bank_state = bank_states.IDLE
+
+				elif cmd == sdram_cmds.CMD_BST:
+					# bursts in this model always end after burstlen words, which is when
+					# a full page burst is stopped, so there is nothing left to stop
+					pass
 
-			num_banks = 1<<self.config_params.rw_params.BANK_BITS.value
-			# sdram_cmds
-			# ##################3
+			# --------------------------------------------------------
+			elif self.bank_state == bank_states.READ:
+				if self.reads_remaining != None:
+					if self.reads_remaining > 0:
+						if self.add_read_to_return(read_from_bank=not dqm):
+							debug_flags_to_toggle.append(3)
+						
+						self.step_column()
+						self.reads_remaining -= 1
+
+					if self.reads_remaining == 0:
+						self.reads_remaining = None
+					
+					if self.tracing(trace_levels.DEBUG):
+						self.inspect_reads_to_return()
+				
+				if (self.reads_remaining == None):
+					if not self.auto_precharge:
+						# the row stays open, until a precharge
+						self.bank_state = bank_states.ROW_ACTIVATED
+					else:
+						# the precharge starts in the clock after the last word, and this clock is counted below
+						self.clks_since_precharge = -1
+						self.bank_state = bank_states.IDLE
+
+			# --------------------------------------------------------
+			elif self.bank_state == bank_states.WRITE:
+				if cmd in [sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL]:
+					# then continue an existing burst write
+					# todo: exit early if another read/write command happens? p.50 of datasheet
+					if self.writes_remaining != None:
+						if self.writes_remaining > 0:
+							self.writes_remaining -= 1
+							self.step_column()
+							self.bank_memory.write(self.activated_row, self.column, dq_copi)
+						
+						if self.writes_remaining == 0:
+							self.writes_remaining = None
+							self.clks_at_last_write = self.clks_since_active
+							# how about timing?
+							if self.tracing(trace_levels.DUMP):
+								self.inspect_bank_memory()
+
+					self.trace(trace_levels.DEBUG, "clks since active: {}", self.clks_since_active)
+
+				if self.writes_remaining == None:
+					if self.auto_precharge:
+						if cmd in [sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL, sdram_cmds.CMD_ACT]:
+							if self.clks_at_last_write != None:
+								# we need T_ras, and T_dal between the last write and the next active cmd
+								timing_passed = self.clks_since_active >= self.model.num_clk_cycles(self.config_params.ic_timing.T_RAS)
+								timing_passed = timing_passed and ((self.clks_since_active-self.clks_at_last_write) >= self.model.num_clk_cycles(self.config_params.ic_timing.T_DAL))
+								
+								if timing_passed:
+									self.bank_state = bank_states.IDLE
+									self.clks_since_active = None
+									self.clks_at_last_write = None
+									self.clks_since_precharge = None # T_DAL includes the precharge
+									
+									self.trace(trace_levels.DEBUG, "passed")
+									continue # the command is looked at again, now the bank is idle
+								else:
+									self.trace(trace_levels.DEBUG, "Waiting")
+					else:
+						# the row stays open, and T_dpl after the last write is checked at the precharge
+						self.bank_state = bank_states.ROW_ACTIVATED
 
+			break
 
-			# sdram_cmds = dram_sim_model_IS42S16160G.sdram_cmds
-			# self.config_params.ic_timing = dram_sim_model_IS42S16160G.self.config_params.ic_timing
+		self.clks_since_active = self.clks_since_active + 1 if (self.clks_since_active != None) else None
+		self.clks_since_precharge = self.clks_since_precharge + 1 if (self.clks_since_precharge != None) else None
+		self.clks_since_refresh = self.clks_since_refresh + 1 if (self.clks_since_refresh != None) else None
+		return debug_flags_to_toggle
 
-			# woohoo! finally here
-			class bank_states(enum.Enum):
-				IDLE			= 0,
-				ROW_ACTIVATED	= 1,
-				READ 			= 2,
-				WRITE 			= 3,
-				PRECHARGE 		= 4,
-				ERROR 			= 5
 
-			bank_state = bank_states.IDLE
+class model_cmd_trace:
+	"""
+	Records the command bus, as (clk, cmd, ba, a, dqm, dq_copi, dq_cipo), for model_cmd_trace_checker 
+	to check once the simulation has finished, rather than the timing being checked clock by clock.
 
-			bank_memory = {}
-			activated_row = None
-			column = None
+	Only the clocks with a command, and the clocks after a read or write that its burst and 
+	read data can be on, are recorded, so a nop costs one sample of the bus.
+	"""
+	trace_dtype = np.dtype([
+		("clk",		np.int64),
+		("cmd",		np.uint8),
+		("ba",		np.uint8),
+		("a",		np.uint16),
+		("dqm",		np.uint8),
+		("dq_copi",	np.uint16),
+		("dq_cipo",	np.uint16),
+	])
+
+	def __init__(self, config_params):
+		self.config_params = config_params
+		self.records = []
+		self.clks = 0 # the clocks of the chip so far
 
-			writes_remaining = None
-			reads_remaining = None
-			cas_latency_elapsed = False
+		# as set by the mode register, until the first mode register set is seen
+		self.burstlen = get_trace_burstlen(config_params, None)
+		self.latency = config_params.latency if hasattr(config_params, "latency") else 3
 
-			auto_precharge = False
+	def fast_forward(self, clks):
+		# as model_sdram_sims.fast_forward(), only nops are skipped
+		self.clks += clks
 
-			clks_since_active = None
-			clks_at_read_cmd = None
-			clks_at_last_write = None
-			clks_at_last_read = None
+	def get_record_process(self, io):
+		def func():
+			idle_cmds = [sdram_cmds.CMD_NOP.value, sdram_cmds.CMD_DESL.value]
+			read_write_cmds = [sdram_cmds.CMD_READ.value, sdram_cmds.CMD_READ_AP.value, sdram_cmds.CMD_WRITE.value, sdram_cmds.CMD_WRITE_AP.value]
+			record_until = 0 # the clock after the last one that a burst or its read data can be on
 
-			
 			yield Passive()
-			
 			while True:
-				def add_read_to_return(bank_id, activated_row = None, column = None):
-					just_had_keyerror = False
-
-					if (bank_id == None):
-						self.reads_to_return.append({"bank_src" : bank_id})
-					else:
-						try:
-							read_value = bank_memory[activated_row].pop(column) # as reads on the sdram chip are destructive I think? test this!
-						except KeyError:
-							just_had_keyerror = True
-							# typical issue - fix better! 
-							# for now, print info instead
-							print("KeyError! Ignoring")
-
-							print(hex(activated_row), hex(column)) 
-							print(activated_row, column)
-							print(bank_memory)
-							print(bank_memory[activated_row])
-							# print("Appending to reads_to_return: ", hex(bank_memory[activated_row][column])) # so the issue is before here
-							
-							# add fake data instead
-							read_value = 0xFACE # this suggests that the error was in the writing stage
-						
-						self.reads_to_return.append({"bank_src" : bank_id, "data" : read_value}) 
-
-					return just_had_keyerror
-
-				
-
-				def bprint(*args):
-					# if print_bank_debug_statements:
-					if self.utest_params.enable_detailed_model_printing:
-						colors = ["red", "green", "yellow", "blue"]
-						outstr = f"Bank {bank_id}, {bank_state} : "
-						for arg in args:
-							outstr += str(arg)
-						cprint(outstr, colors[bank_id])
-
-
-				def inspect_bank_memory():
-					for row_id, row_data in bank_memory.items():
-						data_str = f"from bank {bank_id}, row {hex(row_id)}:"
-						for i, (col_id, col_data) in enumerate(row_data.items()):
-							if i == 0:
-								data_str += f"col {hex(col_id)}:"
-								bprint(data_str)
-								data_str = ""
-							data_str += f"[{hex(col_data)}]"
-							if (i+1)%self.config_params.burstlen==0:
-								bprint(data_str)
-								data_str = ""
-						if data_str != "":
-							bprint(data_str)
-				
-				def inspect_reads_to_return():
-					data_str = ""
-					for r in self.reads_to_return:
-						if r["bank_src"] == None:
-							# print(r["data"])
-							# bprint(None)
-							# data_str += 
-							data_str += f"[]"
-						else:
-							value = r["data"]
-							data_str += f"[{hex(value)}]"
-					bprint("reads to return: ", data_str)
-						
+				cmd = (yield io.decoded_cmd)
+				if (cmd not in idle_cmds) or (self.clks < record_until):
+					a = (yield io.a)
+					self.records.append((self.clks, cmd, (yield io.ba), a, (yield io.dqm), (yield io.dq_copi), (yield io.dq_cipo)))
+
+					if cmd == sdram_cmds.CMD_MRS.value:
+						self.burstlen = get_trace_burstlen(self.config_params, a)
+						self.latency = (a >> 4) & 0b111
+					elif cmd in read_write_cmds:
+						record_until = self.clks + self.burstlen + self.latency
+
+				self.clks += 1
+				yield
+		return func, "clki"
 
-					# print(f"Bank {bank_id}, {bank_state} : {[a for a in args]}")
-				if bank_id == (yield io.ba):		# 13mar2022 ah! but isn't .cmd always going to be one clock behind the actual ras cas etc signals? Yes - fix later, don't half-fix now..
-					cmd = sdram_cmds((yield io.decoded_cmd)) 
-				else:
-					cmd = sdram_cmds.CMD_NOP
-				
-				# self.dq_write_en = False # reset the default here
+	def to_array(self):
+		return np.array(self.records, dtype=model_cmd_trace.trace_dtype)
+
+	def check(self):
+		# returns the checks that failed, so {} if the trace is correct
+		return model_cmd_trace_checker(self.config_params, self.to_array()).get_violations()
+
+
+def get_trace_burstlen(config_params, mode_a):
+	# the burst length set by the mode register value <mode_a>, or by config_params if it is None
+	if mode_a == None:
+		burstlen = config_params.burstlen if hasattr(config_params, "burstlen") else 8
+		return burstlen if (burstlen <= 8) else (1 << config_params.rw_params.COL_BITS.value) # longer bursts use full page bursts
+	if (mode_a & 0b111) == mode_burst_length.MODE_BURSTLEN_PAGE.value:
+		return 1 << config_params.rw_params.COL_BITS.value
+	return 1 << (mode_a & 0b11)
+
+
+def latest_before(event_clks, event_keys, query_clks, query_keys):
+	# for each query, the index of the latest event with the same key before it, or -1
+	if len(event_clks) == 0:
+		return np.full(len(query_clks), -1)
+	span = int(max(event_clks.max(initial=0), query_clks.max(initial=0))) + 2
+	event_order = np.argsort(event_keys * span + event_clks, kind="stable")
+	sorted_events = (event_keys * span + event_clks)[event_order]
+	i = np.searchsorted(sorted_events, query_keys * span + query_clks, side="left") - 1
+	found = i >= 0
+	found[found] = event_keys[event_order[i[found]]] == query_keys[found]
+	return np.where(found, event_order[np.maximum(i, 0)], -1)
+
+
+def earliest_after(event_clks, event_keys, query_clks, query_keys):
+	# for each query, the index of the earliest event with the same key after it, or -1
+	if len(event_clks) == 0:
+		return np.full(len(query_clks), -1)
+	span = int(max(event_clks.max(initial=0), query_clks.max(initial=0))) + 2
+	event_order = np.argsort(event_keys * span + event_clks, kind="stable")
+	sorted_events = (event_keys * span + event_clks)[event_order]
+	i = np.searchsorted(sorted_events, query_keys * span + query_clks, side="right")
+	found = i < len(sorted_events)
+	found[found] = event_keys[event_order[i[found]]] == query_keys[found]
+	return np.where(found, event_order[np.minimum(i, len(sorted_events) - 1)], -1)
+
+
+def pick(values, i, default = -1):
+	# values[i], with <default> where i is -1
+	if len(values) == 0:
+		return np.full(len(i), default, dtype=np.int64)
+	return np.where(i == -1, default, values[np.maximum(i, 0)])
+
+
+class model_cmd_trace_checker:
+	"""
+	Checks a trace recorded by model_cmd_trace, all at once with numpy, for:
+	- the timing between commands, i.e. T_RCD, T_RP, T_RC, T_RAS, T_RRD, T_MRD, T_DPL and T_DAL
+	- reads and writes to a bank without an open row, and activates of a bank with one
+	- each word read being the last word written to that address
 
-				# if bank_id == 1:
-				if cmd not in [
-						sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL,
-						sdram_cmds.CMD_PRE, sdram_cmds.CMD_PALL,
-						sdram_cmds.CMD_REF, sdram_cmds.CMD_SELF,
-						sdram_cmds.CMD_MRS
-					]:
-					# in general, ignore these cmds for bank operation...? so no need to print them in general
-					pass
+	check() returns the clocks of the commands, or words, that failed each check, 
+	which are all empty if the trace is correct.
+	"""
+	def __init__(self, config_params, trace):
+		self.config_params = config_params
+		self.trace = trace
 
-					bprint("cmd: ", cmd, ", clks since active: ", clks_since_active)
-				# --------------------------------------------------------
-				if bank_state == bank_states.IDLE:
-					if cmd == sdram_cmds.CMD_ACT:
-						yield from self.assert_cmd_is(io, sdram_cmds.CMD_ACT)
-						temp_row = (yield io.a)
-						# yield from toggle_debug_flag(0)
-						new_cmd, waited_for_clks = yield from self.assert_idle_cmd_for(io, min_duration = self.config_params.ic_timing.T_RCD, focus_bank = bank_id)
-						# try:
-						# except:
-						# 	# yield self.flagC.eq(1)
-						# 	return 
-
-						activated_row = temp_row
-						bprint("Activated row: ", hex(activated_row))
-						clks_since_active = waited_for_clks
-						
+		self.rw_params = config_params.rw_params
+		self.num_banks = 1 << self.rw_params.BANK_BITS.value
+		self.reads_of_unwritten_words = 0 # as for model_bank, this isn't an error, as the data is undefined
 
-						if activated_row not in bank_memory:
-							bank_memory[activated_row] = {} #[None] * 512 # is this right?
+	def num_clk_cycles(self, delay):
+		return int(np.ceil(self.config_params.clk_freq * delay.value))
 
-						bank_state = bank_states.ROW_ACTIVATED
+	def rows_of(self, *cmds):
+		return np.flatnonzero(np.isin(self.trace["cmd"], [cmd.value for cmd in cmds]))
 
-						if new_cmd != cmd:
-							bprint(f"New command recieved: {new_cmd}, (last command was {cmd}")
-							# yield self.flagB.eq(1)
-							continue
-						# yield self.flagA.eq(0)
-					else:
-						# print("Error! cmd is ",cmd)
-						# print(".", end="")
-						# yield self.flagA.eq(1)
-						# assert cmd in [
-						if cmd not in [
-							sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL,
-							sdram_cmds.CMD_PRE, sdram_cmds.CMD_PALL,
-							sdram_cmds.CMD_REF, sdram_cmds.CMD_SELF,
-							sdram_cmds.CMD_MRS
-						]:
-							bprint("Error! cmd  is ",cmd)
-							# yield self.flagA.eq(1)
-							return
-
-				elif bank_state == bank_states.ROW_ACTIVATED:
-					# yield self.flagD.eq(1)
-					# print("woohoo! ", bank_id, cmd)
-					if cmd in [sdram_cmds.CMD_WRITE, sdram_cmds.CMD_WRITE_AP]:
-						inspect_bank_memory()
-
-						if cmd == sdram_cmds.CMD_WRITE_AP:
-							auto_precharge = True
-						else:
-							auto_precharge = False
-						column = (yield io.a) & 0x1FF
-						# yield from toggle_debug_flag(1)
-						bank_memory[activated_row][column] = (yield io.dq_copi)
-						writes_remaining = self.config_params.burstlen - 1
-						if writes_remaining > 0: # this deals with the case of a burst length of 1
-							bank_state = bank_states.WRITE
-					
-					elif cmd in [sdram_cmds.CMD_READ, sdram_cmds.CMD_READ_AP]:
-						inspect_bank_memory()
-						if cmd == sdram_cmds.CMD_READ_AP:
-							auto_precharge = True
-						else:
-							auto_precharge = False
-						column = (yield io.a) & 0x1FF
-						# yield from toggle_debug_flag(2)
-						reads_remaining = self.config_params.burstlen
-
-						clks_until_latency_elapsed = self.config_params.latency - 1
-
-						# this bank is now controlling reads in <latency> cycles,
-						if len(self.reads_to_return) > clks_until_latency_elapsed:
-							# so remove any reads other banks may have scheduled
-							self.reads_to_return = self.reads_to_return[:clks_until_latency_elapsed]
-						else:
-							# or pad the duration before <latency> with blanks, if needed
-							while len(self.reads_to_return) < clks_until_latency_elapsed:
-								just_had_keyerror = add_read_to_return(bank_id=None)
-								if just_had_keyerror:
-									yield from self.toggle_debug_flag(0)
-
-						# now schedule in writes from this bank, do one for
-						# each clock after read, because that's when dqm is sampled
-						# note: these writes will appear on the dqm bus <latency> clocks later
-						if ~(yield io.dqm):
-							just_had_keyerror = add_read_to_return(bank_id, activated_row, column)
-							if just_had_keyerror:
-									yield from self.toggle_debug_flag(1)
-
-						else:
-							just_had_keyerror = add_read_to_return(bank_id=None)
-							if just_had_keyerror:
-									yield from self.toggle_debug_flag(2)
-
-						# bprint("zzzz")
-						# bprint(self.reads_to_return)
-						column += 1
-						reads_remaining -= 1
-
-						# todo - do reads of length 1 exist? or need to be implemented?
-						# clks_at_read_cmd = clks_since_active
-						bank_state = bank_states.READ
-						# inspect_bank_memory()
-
-				# --------------------------------------------------------
-				elif bank_state == bank_states.READ:
-					# note! due to using an additional buf latch (so the output is stable on rising edge),
-					# the delay is 1 there, so we reduce the delay here
-					# latency_to_use = self.mode["latency"].value - 1
-
-					# cas_latency_elapsed = True if (clks_since_active - clks_at_read_cmd) >= latency_to_use else False
-
-					if reads_remaining != None:
-						if reads_remaining > 0:
-							if ~(yield io.dqm):
-								just_had_keyerror = add_read_to_return(bank_id, activated_row, column)
-								if just_had_keyerror:
-									yield from self.toggle_debug_flag(3)
-							else:
-								just_had_keyerror = add_read_to_return(bank_id=None)
-								if just_had_keyerror:
-									yield from self.toggle_debug_flag(4)
-
-							# bprint(self.reads_to_return)
-							
-							column += 1
-							reads_remaining -= 1
-
-						if reads_remaining == 0:
-							reads_remaining = None
-						
-						inspect_reads_to_return()
-					
-					if (reads_remaining == None):
-						if not auto_precharge:
-							assert 0, "not implemented yet"
-							bprint("-", end="")
-							# timing...? or do that in row_activated?
-							bank_state = bank_states.ROW_ACTIVATED
-						else:
-							bank_state = bank_states.IDLE # oh my fucking god
-							
+	def get_bursts(self, rw_rows):
+		""" 
+		Returns the (clk, bank, row, col, rw_index) of each word of the bursts of the reads/writes at <rw_rows>,
+		then the clk of the last word, and the cas latency, of each read/write.
+		A burst ends early at the next read, write or burst stop, or a precharge of its bank.
+		"""
+		clk, ba, a = self.trace["clk"], self.trace["ba"].astype(np.int64), self.trace["a"].astype(np.int64)
+		rw_clk, rw_bank = clk[rw_rows], ba[rw_rows]
+
+		# the mode register in use for each, from the latest mode register set before it
+		mrs_rows = self.rows_of(sdram_cmds.CMD_MRS)
+		mrs_i = latest_before(clk[mrs_rows], np.zeros(len(mrs_rows), np.int64), rw_clk, np.zeros(len(rw_rows), np.int64))
+		default_burstlen = get_trace_burstlen(self.config_params, None)
+		burstlen = np.array([default_burstlen if (i == -1) else get_trace_burstlen(self.config_params, int(a[mrs_rows[i]])) for i in mrs_i], dtype=np.int64)
+		default_latency = self.config_params.latency if hasattr(self.config_params, "latency") else 3
+		latency = np.where(mrs_i == -1, default_latency, (pick(a[mrs_rows], mrs_i) >> 4) & 0b111)
+
+		end = rw_clk + burstlen
+		stop_rows = np.concatenate([rw_rows, self.rows_of(sdram_cmds.CMD_BST)])
+		stop_i = earliest_after(clk[stop_rows], np.zeros(len(stop_rows), np.int64), rw_clk, np.zeros(len(rw_rows), np.int64))
+		end = np.where(stop_i == -1, end, np.minimum(end, pick(clk[stop_rows], stop_i)))
+		pre_clk, pre_bank = self.get_precharges()
+		pre_i = earliest_after(pre_clk, pre_bank, rw_clk, rw_bank)
+		end = np.where(pre_i == -1, end, np.minimum(end, pick(pre_clk, pre_i)))
+
+		# the row of each is from the latest activate of its bank
+		act_rows = self.rows_of(sdram_cmds.CMD_ACT)
+		act_i = latest_before(clk[act_rows], ba[act_rows], rw_clk, rw_bank)
+		row = pick(a[act_rows], act_i, 0)
+
+		# then each word
+		num_words = end - rw_clk
+		rw_index = np.repeat(np.arange(len(rw_rows)), num_words)
+		offset = np.arange(num_words.sum()) - np.repeat(np.cumsum(num_words) - num_words, num_words)
+		col0 = a[rw_rows] & ((1 << self.rw_params.COL_BITS.value) - 1)
+		word_burstlen = burstlen[rw_index]
+		col = (col0[rw_index] & ~(word_burstlen - 1)) | ((col0[rw_index] + offset) & (word_burstlen - 1)) # bursts wrap around
+		return rw_clk[rw_index] + offset, rw_bank[rw_index], row[rw_index], col, rw_index, end - 1, latency
+
+	def get_precharges(self):
+		# the (clk, bank) of each precharge command, with a precharge all being one for each bank
+		clk, ba = self.trace["clk"], self.trace["ba"].astype(np.int64)
+		pre_rows = self.rows_of(sdram_cmds.CMD_PRE)
+		pall_rows = self.rows_of(sdram_cmds.CMD_PALL)
+		pre_clk = np.concatenate([clk[pre_rows], np.repeat(clk[pall_rows], self.num_banks)])
+		pre_bank = np.concatenate([ba[pre_rows], np.tile(np.arange(self.num_banks), len(pall_rows))])
+		order = np.argsort(pre_clk, kind="stable")
+		return pre_clk[order], pre_bank[order]
+
+	def check(self):
+		T = self.config_params.ic_timing
+		clk, cmd, ba = self.trace["clk"], self.trace["cmd"], self.trace["ba"].astype(np.int64)
+		violations = {}
+
+		def same_key(n):
+			return np.zeros(n, np.int64)
+
+		def check_gaps(name, before_clks, after_clks, timing):
+			# both are for the same commands, and a gap of less than <timing> is a violation
+			failed = (after_clks - before_clks) < self.num_clk_cycles(timing)
+			violations[name] = np.concatenate([violations.get(name, np.zeros(0, np.int64)), after_clks[failed]])
+
+		act_rows = self.rows_of(sdram_cmds.CMD_ACT)
+		ref_rows = self.rows_of(sdram_cmds.CMD_REF)
+		rw_rows = self.rows_of(sdram_cmds.CMD_READ, sdram_cmds.CMD_READ_AP, sdram_cmds.CMD_WRITE, sdram_cmds.CMD_WRITE_AP)
+		act_clk, act_bank = clk[act_rows], ba[act_rows]
+		ref_clk = clk[ref_rows]
+		rw_clk, rw_bank = clk[rw_rows], ba[rw_rows]
+		is_write = np.isin(cmd[rw_rows], [sdram_cmds.CMD_WRITE.value, sdram_cmds.CMD_WRITE_AP.value])
+		is_auto_precharge = np.isin(cmd[rw_rows], [sdram_cmds.CMD_READ_AP.value, sdram_cmds.CMD_WRITE_AP.value])
+
+		word_clk, word_bank, word_row, word_col, word_rw, last_word_clk, latency = self.get_bursts(rw_rows)
+
+		# the clocks each bank is closed at, by a precharge, or after the last word of an auto precharge burst
+		pre_clk, pre_bank = self.get_precharges()
+		close_clk = np.concatenate([pre_clk, last_word_clk[is_auto_precharge] + 1])
+		close_bank = np.concatenate([pre_bank, rw_bank[is_auto_precharge]])
+		close_is_write = np.concatenate([np.zeros(len(pre_clk), bool), is_write[is_auto_precharge]])
+
+		# reads and writes, to the row opened T_RCD before
+		i = latest_before(act_clk, act_bank, rw_clk, rw_bank)
+		j = latest_before(close_clk, close_bank, rw_clk, rw_bank)
+		opened = pick(act_clk, i) > pick(close_clk, j) # i.e. activated since the bank was last closed
+		violations["no_open_row"] = rw_clk[~opened]
+		check_gaps("T_RCD", act_clk[i[opened]], rw_clk[opened], T.T_RCD)
+		rw_opened = opened
+
+		# activates and refreshes, T_RP after a precharge. After a write with auto precharge, T_DAL is checked instead
+		not_write_ap = ~close_is_write
+		i = latest_before(close_clk[not_write_ap], close_bank[not_write_ap], act_clk, act_bank)
+		check_gaps("T_RP", close_clk[not_write_ap][i[i != -1]], act_clk[i != -1], T.T_RP)
+		i = latest_before(close_clk[not_write_ap], same_key(not_write_ap.sum()), ref_clk, same_key(len(ref_rows)))
+		check_gaps("T_RP", close_clk[not_write_ap][i[i != -1]], ref_clk[i != -1], T.T_RP)
+
+		# activates of a closed bank, T_RC after the last of the same bank, and after a refresh, as are refreshes
+		i = latest_before(act_clk, act_bank, act_clk, act_bank)
+		violations["row_already_open"] = act_clk[pick(act_clk, i) > pick(close_clk, latest_before(close_clk, close_bank, act_clk, act_bank))]
+		check_gaps("T_RC", act_clk[i[i != -1]], act_clk[i != -1], T.T_RC)
+		for after_clk in [act_clk, ref_clk]:
+			i = latest_before(ref_clk, same_key(len(ref_clk)), after_clk, same_key(len(after_clk)))
+			check_gaps("T_RC", ref_clk[i[i != -1]], after_clk[i != -1], T.T_RC)
+
+		# activates of different banks, T_RRD apart
+		different_bank = act_bank[1:] != act_bank[:-1]
+		check_gaps("T_RRD", act_clk[:-1][different_bank], act_clk[1:][different_bank], T.T_RRD)
+
+		# precharges of an open row, T_RAS after it was activated, and T_DPL after its last word written
+		i = latest_before(act_clk, act_bank, pre_clk, pre_bank)
+		j = latest_before(close_clk, close_bank, pre_clk, pre_bank)
+		opened = pick(act_clk, i) > pick(close_clk, j)
+		check_gaps("T_RAS", act_clk[i[opened]], pre_clk[opened], T.T_RAS)
+		written = is_write[word_rw]
+		k = latest_before(word_clk[written], word_bank[written], pre_clk, pre_bank)
+		wrote_to_row = opened & (pick(word_clk[written], k) > pick(act_clk, i))
+		check_gaps("T_DPL", word_clk[written][k[wrote_to_row]], pre_clk[wrote_to_row], T.T_DPL)
+
+		# after a write with auto precharge, the next activate of its bank, or refresh, is T_DAL after its last word
+		write_ap = is_write & is_auto_precharge
+		i = earliest_after(act_clk, act_bank, last_word_clk[write_ap], rw_bank[write_ap])
+		check_gaps("T_DAL", last_word_clk[write_ap][i != -1], act_clk[i[i != -1]], T.T_DAL)
+		i = earliest_after(ref_clk, same_key(len(ref_clk)), last_word_clk[write_ap], same_key(write_ap.sum()))
+		check_gaps("T_DAL", last_word_clk[write_ap][i != -1], ref_clk[i[i != -1]], T.T_DAL)
+
+		# the next command after a mode register set, T_MRD after it
+		mrs_clk = clk[self.rows_of(sdram_cmds.CMD_MRS)]
+		cmd_clk = clk[~np.isin(cmd, [sdram_cmds.CMD_NOP.value, sdram_cmds.CMD_DESL.value])]
+		i = earliest_after(cmd_clk, same_key(len(cmd_clk)), mrs_clk, same_key(len(mrs_clk)))
+		check_gaps("T_MRD", mrs_clk[i != -1], cmd_clk[i[i != -1]], T.T_MRD)
+
+		# then the data, where each word read is the last written to its address, unless dqm masked either, 
+		# or its bank had no open row, which was a violation above
+		def lookup(clks):
+			# the trace rows of <clks>, and whether they were recorded
+			i = np.minimum(np.searchsorted(clk, clks), len(clk) - 1)
+			return i, (clk[i] == clks) if len(clk) else np.zeros(len(clks), bool)
+
+		word_addr = (((word_bank << self.rw_params.ROW_BITS.value) | word_row) << self.rw_params.COL_BITS.value) | word_col
+		word_i, word_recorded = lookup(word_clk)
+		word_masked = self.trace["dqm"][word_i] != 0
+
+		w = written & word_recorded & ~word_masked & rw_opened[word_rw]
+		write_clk, write_addr, write_data = word_clk[w], word_addr[w], self.trace["dq_copi"][word_i[w]]
+
+		r = ~written & ~word_masked & rw_opened[word_rw]
+		return_i, return_recorded = lookup(word_clk[r] + latency[word_rw[r]]) # a word read is on dq <latency> clocks later
+		i = latest_before(write_clk, write_addr, word_clk[r], word_addr[r])
+		self.reads_of_unwritten_words = int(((i == -1) & return_recorded).sum())
+		checked = (i != -1) & return_recorded
+		wrong = self.trace["dq_cipo"][return_i[checked]] != write_data[i[checked]]
+		violations["data"] = word_clk[r][checked][wrong]
+		violations["unrecorded_words"] = np.concatenate([word_clk[~word_recorded], word_clk[r][~return_recorded]])
+
+		return violations
+
+	def get_violations(self):
+		# only the checks that failed, e.g. for an assertEqual with {}
+		return {name: list(clks) for name, clks in self.check().items() if len(clks) > 0}
 
 
+class model_sdram_sims(sdram_sim_utils):
+	"""
+	A single event-driven model of the sdram chip. Once per clock of the chip, this samples the
+	command bus once, steps the refresh monitor and each bank with it, and drives dq with the
+	read data that is due.
 
-				# --------------------------------------------------------
-				elif bank_state == bank_states.WRITE: #[sdram_cmds.CMD_WRITE, sdram_cmds.CMD_WRITE_AP]:
-					
-					if cmd in [sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL]:
-						# yield self.flagB.eq(~(yield self.flagB))
-						# then continue an existing burst write
-						# todo: exit early if another read/write command happens? p.50 of datasheet
-						if writes_remaining != None:
-							if writes_remaining > 0:
-								writes_remaining -= 1
-								column += 1
-								bank_memory[activated_row][column] = (yield io.dq_copi)
-							
-							if writes_remaining == 0:
-								writes_remaining = None
-								clks_at_last_write = clks_since_active
-								# how about timing?
-								inspect_bank_memory()
-
-						bprint(f"clks since active: {clks_since_active}")
-
-					if writes_remaining == None:
-						if auto_precharge:
-							if cmd in [sdram_cmds.CMD_NOP, sdram_cmds.CMD_DESL, sdram_cmds.CMD_ACT]:
-								if clks_at_last_write != None:
-									# we need T_dpl + T_rp between the last write and the next active cmd
-									timing_passed = True
-									timing_passed = clks_since_active >= self.num_clk_cycles(self.config_params.ic_timing.T_RAS) if timing_passed else False
-									
-									if not auto_precharge:
-										timing_passed = (clks_since_active-clks_at_last_write) >= self.num_clk_cycles(self.config_params.ic_timing.T_DPL.value + self.config_params.ic_timing.T_RP.value) if timing_passed else False
-									else:
-										timing_passed = (clks_since_active-clks_at_last_write) >= self.num_clk_cycles(self.config_params.ic_timing.T_DAL) if timing_passed else False
-									
-									if timing_passed:
-										bank_state = bank_states.IDLE
-										clks_since_active = None
-										clks_at_last_write = None
-										
-										bprint("passed")
-										continue
-									else:
-										bprint("Waiting")
-						elif not auto_precharge:
-							# then we need a discreet state for 'precharge', T_dpl after the last write
-							# or just return to active?
-							assert 0, "not implemented yet"
-							bank_state = bank_states.ROW_ACTIVATED
-
-				# --------------------------------------------------------
-				elif bank_state == bank_states.PRECHARGE:
-					pass
+	todo:
+	- add startup monitor (i.e. the thing that monitors what the set burstlen is)
+	"""
+	def __init__(self, config_params, utest_params):
 
-				# --------------------------------------------------------
-				elif bank_state == bank_states.ERROR:
-					pass
+		if not hasattr(utest_params, "enable_detailed_model_printing"): utest_params.enable_detailed_model_printing = True
+		if not hasattr(utest_params, "model_record_trace"): utest_params.model_record_trace = False # to check the command bus with model_cmd_trace_checker after the simulation
+		if not hasattr(utest_params, "model_check_timing"): utest_params.model_check_timing = True # whether the banks assert the timing of each command, see model_bank
+		if not hasattr(utest_params, "model_trace_level"): utest_params.model_trace_level = trace_levels.DEBUG if utest_params.enable_detailed_model_printing else trace_levels.WARNING
 
-				# yield from self.assert_cmd_is(sdram_cmds.CMD_ACT)
-				# print(bank_memory)
-				
-				clks_since_active = clks_since_active + 1 if (clks_since_active != None) else None
-				# yield Settle() # trying using clki negedge clock # this should deal with not using a negedge sim clock
-				yield
-				# yield Settle() # trying using clki negedge clock # this should deal with not using a negedge sim clock
-				# print(",")
+		super().__init__(config_params, utest_params)
 
-			# assert the bank state is inactive
+		self.banks = [model_bank(self, bank_id) for bank_id in range(2**self.config_params.rw_params.BANK_BITS.value)]
+		self.refresh_monitor = model_refresh_monitor(self.config_params, self.utest_params)
+		self.clks = 0 # the clocks of the chip so far
+		self.cmd_trace = model_cmd_trace(self.config_params) if self.utest_params.model_record_trace else None
+
+	def fast_forward(self, clks):
+		# for when the testbench skips <clks> clocks of nops, e.g. with controller_refresh.sim_wait_until_initialised(),
+		# so the timing checks and refresh accounting still see them
+		assert all(bank.is_quiescent() for bank in self.banks), "Can't fast forward part way through a burst"
+		assert (self.reads_to_return == None) or self.reads_to_return.is_empty(), "Can't fast forward with reads still to return"
+		self.clks += clks
+		for bank in self.banks:
+			bank.fast_forward(clks)
+		if self.cmd_trace != None:
+			self.cmd_trace.fast_forward(clks)
+
+	def check_refresh_retention(self):
+		# e.g. at the end of a simulation
+		return self.refresh_monitor.check(self.clks)
+
+	def dump_banks(self):
+		# on demand, e.g. from a testbench process when a readback check fails
+		for bank in self.banks:
+			bank.inspect_bank_memory()
 
-		return func, "clki"
+	def toggle_debug_flag(self, i):
+		yield self.utest_params.debug_flags[i].eq(~(yield self.utest_params.debug_flags[i]))
 
-	def propagate_i_dq_reads(self, io):
+	def get_model_process(self, io):
 		def func():
-			""" 
-			Use with a negedge sim clock! otherwise instability possible
-			This will only use the dq bus if a valid write occured <latency> clocks ago
-			"""
+			self.reads_to_return = model_read_returns(self.config_params.latency if hasattr(self.config_params, "latency") else None)
+
 			yield Passive()
 			while True:
-				# print(self.reads_to_return)
-				if len(self.reads_to_return) > 0:
-					next_write = self.reads_to_return.pop(0) # {"bank_src" : x, "data" : y}
-					# print(f"next write: {next_write}")
-					if next_write["bank_src"] != None:
-						# print("next write is ", next_write["bank_src"], hex(next_write["data"]))
-						yield io.dq_cipo.eq(next_write["data"])
-						# yield self.nflagA.eq(1)
+				# sample the command bus once
+				decoded_cmd = sdram_cmds((yield io.decoded_cmd))
+				ba = (yield io.ba)
+				a = (yield io.a)
+				dq_copi = (yield io.dq_copi)
+				dqm = (yield io.dqm)
+
+				if decoded_cmd in [sdram_cmds.CMD_REF, sdram_cmds.CMD_SELF]:
+					self.refresh_monitor.step(decoded_cmd, self.clks)
+
+				for bank in self.banks:
+					if (bank.bank_id == ba) or (decoded_cmd in [sdram_cmds.CMD_PALL, sdram_cmds.CMD_REF, sdram_cmds.CMD_SELF]):
+						cmd = decoded_cmd # note that precharge-all and the refreshes apply to every bank, whatever ba is
+					else:
+						cmd = sdram_cmds.CMD_NOP
+
+					try:
+						debug_flags_to_toggle = bank.step(cmd, a, dq_copi, dqm)
+					except AssertionError:
+						if self.tracing(trace_levels.ERROR):
+							self.dump_banks()
+						raise
+
+					for i in debug_flags_to_toggle:
+						yield from self.toggle_debug_flag(i)
+
+				bank_src, data = self.reads_to_return.pop()
+				if bank_src != model_read_returns.EMPTY:
+					yield Tick("sync") # the read data goes out on dq on the fpga's clock edge, half a clock after this one
+					if bank_src != model_read_returns.BLANK:
+						yield io.dq_cipo.eq(data)
 					else:
 						yield io.dq_cipo.eq(0xBEAD) # this indicates that the error is with reading
 						yield from self.toggle_debug_flag(5)
-				yield
-		return func, "sync" #"clki" # 7apr22 - this is important! need to use a different clk domain as this is giving it back to the fpga
 
+				self.clks += 1
+				yield
+		return func, "clki"
 
 	def get_sim_sync_processes(self, io):
-		for bank_id in range(2**self.config_params.rw_params.BANK_BITS.value):
-			yield self.get_readwrite_process_for_bank(bank_id, io)
-		
-		yield self.get_refresh_monitor_process(io)
-		yield self.propagate_i_dq_reads(io)
+		yield self.get_model_process(io)
+		if self.cmd_trace != None:
+			yield self.cmd_trace.get_record_process(io)
 
 
 def get_model_sdram_io_layout(config_params):
@@ -585,6 +985,46 @@ def get_model_sdram_io_layout(config_params):
 	return io_layout
 
 
+def add_cmd_decoder(m, io):
+	# decodes the command pins into io.decoded_cmd, in the sync domain of m, 
+	# which the models rename to their clki domain
+	# decoded_cmd = Signal(shape=sdram_cmds, reset=sdram_cmds.CMD_NOP)
+	encoded_cmd = Signal(shape=9)
+
+	m.d.comb += encoded_cmd.eq(Cat(reversed(
+		[Past(io.clk_en), 
+		io.clk_en, 
+		~io.cs, 	# using ~ as these are inverted by the use of PinsN in the Platform() upload stuff
+		~io.ras,
+		~io.cas, 
+		~io.we, 
+		io.ba[1], 
+		io.ba[0], 
+		io.a[10]],
+	)))
+
+	def set_state(new_state):
+		m.d.comb += io.decoded_cmd.eq(new_state) # or clki?
+	
+	# I'm trying out a few ways to approach how to represent this, this is closet
+	# to what is specified on p.9 of the datasheet. The meaning of the matches() string is:
+	# past(clk_en) | clk_en | n_cs | n_ras | n_cas | n_we | ba[1] | ba[0] | a[10] 
+	with m.If(	encoded_cmd.matches("1-1------")): set_state(sdram_cmds.CMD_DESL)
+	with m.Elif(encoded_cmd.matches("1-0111---", "0--------", "--1------")): set_state(sdram_cmds.CMD_NOP)
+	with m.Elif(encoded_cmd.matches("1-0110---")): set_state(sdram_cmds.CMD_BST)
+	with m.Elif(encoded_cmd.matches("1-0101--0")): set_state(sdram_cmds.CMD_READ)
+	with m.Elif(encoded_cmd.matches("1-0101--1")): set_state(sdram_cmds.CMD_READ_AP)
+	with m.Elif(encoded_cmd.matches("1-0100--0")): set_state(sdram_cmds.CMD_WRITE)
+	with m.Elif(encoded_cmd.matches("1-0100--1")): set_state(sdram_cmds.CMD_WRITE_AP)
+	with m.Elif(encoded_cmd.matches("1-0011---")): set_state(sdram_cmds.CMD_ACT)
+	with m.Elif(encoded_cmd.matches("1-0010--0")): set_state(sdram_cmds.CMD_PRE)
+	with m.Elif(encoded_cmd.matches("1-0010--1")): set_state(sdram_cmds.CMD_PALL)
+	with m.Elif(encoded_cmd.matches("110001---")): set_state(sdram_cmds.CMD_REF)
+	with m.Elif(encoded_cmd.matches("100001---")): set_state(sdram_cmds.CMD_SELF)
+	with m.Elif(encoded_cmd.matches("1-0000000")): set_state(sdram_cmds.CMD_MRS)
+	with m.Else(): set_state(sdram_cmds.CMD_ILLEGAL)
+
+
 class model_sdram(Elaboratable):
 	def __init__(self, config_params, utest_params = None, utest: FHDLTestCase = None):
 		super().__init__()
@@ -612,43 +1052,7 @@ class model_sdram(Elaboratable):
 		assert self.io.ba.width == 2
 		# assert self.config_params.rw_params.A_BITS.value == 13 # is this assert needed?
 
-		# add command decoding functionality
-		# decoded_cmd = Signal(shape=sdram_cmds, reset=sdram_cmds.CMD_NOP)
-		encoded_cmd = Signal(shape=9)
-
-		m.d.comb += encoded_cmd.eq(Cat(reversed(
-			[Past(self.io.clk_en), 
-			self.io.clk_en, 
-			~self.io.cs, 	# using ~ as these are inverted by the use of PinsN in the Platform() upload stuff
-			~self.io.ras,
-			~self.io.cas, 
-			~self.io.we, 
-			self.io.ba[1], 
-			self.io.ba[0], 
-			self.io.a[10]],
-		)))
-
-		def set_state(new_state):
-			m.d.comb += self.io.decoded_cmd.eq(new_state) # or clki?
-		
-		# I'm trying out a few ways to approach how to represent this, this is closet
-		# to what is specified on p.9 of the datasheet. The meaning of the matches() string is:
-		# past(clk_en) | clk_en | n_cs | n_ras | n_cas | n_we | ba[1] | ba[0] | a[10] 
-		with m.If(	encoded_cmd.matches("1-1------")): set_state(sdram_cmds.CMD_DESL)
-		with m.Elif(encoded_cmd.matches("1-0111---", "0--------", "--1------")): set_state(sdram_cmds.CMD_NOP)
-		with m.Elif(encoded_cmd.matches("1-0110---")): set_state(sdram_cmds.CMD_BST)
-		with m.Elif(encoded_cmd.matches("1-0101--0")): set_state(sdram_cmds.CMD_READ)
-		with m.Elif(encoded_cmd.matches("1-0101--1")): set_state(sdram_cmds.CMD_READ_AP)
-		with m.Elif(encoded_cmd.matches("1-0100--0")): set_state(sdram_cmds.CMD_WRITE)
-		with m.Elif(encoded_cmd.matches("1-0100--1")): set_state(sdram_cmds.CMD_WRITE_AP)
-		with m.Elif(encoded_cmd.matches("1-0011---")): set_state(sdram_cmds.CMD_ACT)
-		with m.Elif(encoded_cmd.matches("1-0010--0")): set_state(sdram_cmds.CMD_PRE)
-		with m.Elif(encoded_cmd.matches("1-0010--1")): set_state(sdram_cmds.CMD_PALL)
-		with m.Elif(encoded_cmd.matches("110001---")): set_state(sdram_cmds.CMD_REF)
-		with m.Elif(encoded_cmd.matches("100001---")): set_state(sdram_cmds.CMD_SELF)
-		with m.Elif(encoded_cmd.matches("1-0000000")): set_state(sdram_cmds.CMD_MRS)
-		with m.Else(): set_state(sdram_cmds.CMD_ILLEGAL)
-
+		add_cmd_decoder(m, self.io)
 
 		# now sort out the clock
 		# according to the sdram datasheet, the pins are sampled on the rising edge of the clock pin.
@@ -667,6 +1071,227 @@ class model_sdram(Elaboratable):
 		return DomainRenamer("clki")(m)
 
 
+class model_sdram_rtl(Elaboratable):
+	"""
+	An alternative to model_sdram, with the bank state, cas latency and storage in logic rather than 
+	in simulation processes, so long simulations need no python each clock, and it can also be built
+	into the fpga, e.g. as a loopback for the controllers.
+
+	- The mode register sets the burst length, incl. full page bursts, and the cas latency, as on the chip
+	- Only the low model_rtl_row_bits of each row are stored, as a Memory of every row would be far 
+	too large for pysim or block ram. Rows that differ only in the bits above this share their words, 
+	so the bits above are stored with each word, and reading a word last written from another of these rows returns 0xBEAD
+	- Writes to a bank with no open row are dropped, and reads from one return 0xBEAD
+	- Refresh and the low power modes are accepted but not modelled, and timing is not checked here. 
+	model_cmd_trace_checker checks it from a trace, with utest_params.model_record_trace, 
+	and model_sdram checks some of it, see model_bank.step()
+	"""
+	def __init__(self, config_params, utest_params = None, utest: FHDLTestCase = None):
+		super().__init__()
+		self.io = Record([
+			("decoded_cmd",	sdram_cmds, 	DIR_FANOUT)
+		] + get_model_sdram_io_layout(config_params))
+
+		self.config_params = config_params
+		self.utest_params = utest_params
+		self.utest = utest
+
+		if not hasattr(self.config_params, "model_rtl_row_bits"): self.config_params.model_rtl_row_bits = 1 # the low bits of each row that are stored
+
+		# the timing isn't checked in the logic, so it can be checked from a trace instead
+		record_trace = self.utest_params.model_record_trace if hasattr(self.utest_params, "model_record_trace") else False
+		self.cmd_trace = model_cmd_trace(self.config_params) if record_trace else None
+
+	def fast_forward(self, clks):
+		# as model_sdram_sims.fast_forward(), e.g. for controller_refresh.sim_wait_until_initialised()
+		if self.cmd_trace != None:
+			self.cmd_trace.fast_forward(clks)
+
+	def get_sim_sync_processes(self):
+		# everything else is in the logic
+		if self.cmd_trace != None:
+			yield self.cmd_trace.get_record_process(self.io)
+
+	def elaborate(self, platform = None):
+		m = Module()
+
+		rw_params = self.config_params.rw_params
+		num_banks = 1 << rw_params.BANK_BITS.value
+		col_bits = rw_params.COL_BITS.value
+		row_bits = min(self.config_params.model_rtl_row_bits, rw_params.ROW_BITS.value)
+		max_latency = 3 # as in mode_latency
+
+		add_cmd_decoder(m, self.io)
+		cmd = self.io.decoded_cmd
+		is_read = (cmd == sdram_cmds.CMD_READ) | (cmd == sdram_cmds.CMD_READ_AP)
+		is_write = (cmd == sdram_cmds.CMD_WRITE) | (cmd == sdram_cmds.CMD_WRITE_AP)
+
+		# the mode register, which the refresh controller loads after power up, and which is reset to the same burst length
+		if not hasattr(self.config_params, "burstlen"):
+			reset_burstlen = mode_burst_length.MODE_BURSTLEN_8
+		elif (self.config_params.full_page_bursts if hasattr(self.config_params, "full_page_bursts") else False) or (self.config_params.burstlen > 8):
+			reset_burstlen = mode_burst_length.MODE_BURSTLEN_PAGE
+		else:
+			reset_burstlen = mode_burst_length[f"MODE_BURSTLEN_{self.config_params.burstlen}"]
+		burstlen_code = Signal(3, reset=reset_burstlen.value)
+		latency = Signal(range(max_latency + 1), reset=self.config_params.latency if hasattr(self.config_params, "latency") else max_latency)
+		with m.If(cmd == sdram_cmds.CMD_MRS):
+			m.d.sync += [
+				burstlen_code.eq(self.io.a[0:3]),
+				latency.eq(self.io.a[4:7]),
+			]
+		full_page = burstlen_code == mode_burst_length.MODE_BURSTLEN_PAGE.value
+		burstlen = Mux(full_page, 1 << col_bits, 1 << burstlen_code[:2])
+
+		# the row each bank has open
+		bank_open = Array(Signal(name=f"bank_{i}_open") for i in range(num_banks))
+		bank_row = Array(Signal(rw_params.ROW_BITS.value, name=f"bank_{i}_row") for i in range(num_banks))
+		with m.Switch(cmd):
+			with m.Case(sdram_cmds.CMD_ACT):
+				m.d.sync += [
+					bank_open[self.io.ba].eq(1),
+					bank_row[self.io.ba].eq(self.io.a),
+				]
+			with m.Case(sdram_cmds.CMD_PRE):
+				m.d.sync += bank_open[self.io.ba].eq(0)
+			with m.Case(sdram_cmds.CMD_PALL):
+				m.d.sync += [bank_open[i].eq(0) for i in range(num_banks)]
+
+		# only one burst is on the bus at a time, so the banks share this. It moves on to the next word 
+		# each clock, and a read or write command ends it early, as does a burst stop
+		burst_active = Signal()
+		burst_write = Signal()
+		burst_auto_precharge = Signal()
+		burst_bank = Signal(rw_params.BANK_BITS.value)
+		burst_col = Signal(col_bits)
+		burst_remaining = Signal(col_bits + 1) # words after this one
+
+		# a burst wraps around within its burstlen aligned block of columns, so only the low bits are counted on,
+		# and a full page burst wraps around within the row
+		burst_wrap_mask = Signal(col_bits)
+		m.d.comb += burst_wrap_mask.eq(burstlen - 1)
+		def next_burst_col(col):
+			return (col & ~burst_wrap_mask) | ((col + 1) & burst_wrap_mask)
+
+		# the word this clock
+		word_en = Signal()
+		word_write = Signal()
+		word_bank = Signal.like(burst_bank)
+		word_col = Signal.like(burst_col)
+
+		with m.If(is_read | is_write):
+			m.d.comb += [
+				word_en.eq(1),
+				word_write.eq(is_write),
+				word_bank.eq(self.io.ba),
+				word_col.eq(self.io.a[:col_bits]),
+			]
+			m.d.sync += [
+				burst_active.eq(burstlen > 1),
+				burst_write.eq(is_write),
+				burst_auto_precharge.eq(self.io.a[10]),
+				burst_bank.eq(self.io.ba),
+				burst_col.eq(next_burst_col(self.io.a[:col_bits])),
+				burst_remaining.eq(burstlen - 1),
+			]
+			with m.If(self.io.a[10] & (burstlen == 1)):
+				m.d.sync += bank_open[self.io.ba].eq(0)
+
+		with m.Elif(burst_active & (cmd == sdram_cmds.CMD_BST)):
+			m.d.sync += burst_active.eq(0)
+
+		with m.Elif(burst_active):
+			m.d.comb += [
+				word_en.eq(1),
+				word_write.eq(burst_write),
+				word_bank.eq(burst_bank),
+				word_col.eq(burst_col),
+			]
+			m.d.sync += [
+				burst_col.eq(next_burst_col(burst_col)),
+				burst_remaining.eq(burst_remaining - 1),
+			]
+			# full page bursts go around the row until a burst stop
+			with m.If((burst_remaining == 1) & ~full_page):
+				m.d.sync += burst_active.eq(0)
+				with m.If(burst_auto_precharge):
+					m.d.sync += bank_open[burst_bank].eq(0)
+
+		# the storage, with a port each for writing and reading the word this clock. A bank without an open row 
+		# has no row to write the word to, or to read it from
+		m.submodules.storage = storage = Memory(width=rw_params.DATA_BITS.value, depth=1 << (col_bits + row_bits + rw_params.BANK_BITS.value))
+		word_addr = Cat(word_col, bank_row[word_bank][:row_bits], word_bank)
+		word_bank_open = Signal()
+		m.d.comb += word_bank_open.eq(bank_open[word_bank])
+
+		m.submodules.write_port = write_port = storage.write_port()
+		m.d.comb += [
+			write_port.addr.eq(word_addr),
+			write_port.data.eq(self.io.dq_copi),
+			write_port.en.eq(word_en & word_write & word_bank_open & ~self.io.dqm), # dqm masks the word being written
+		]
+
+		m.submodules.read_port = read_port = storage.read_port(transparent=False)
+		m.d.comb += read_port.addr.eq(word_addr)
+
+		# the row bits above row_bits are stored alongside each word, so a read can tell if the word was last written from another row
+		high_row_bits = rw_params.ROW_BITS.value - row_bits
+		if high_row_bits > 0:
+			m.submodules.high_rows = high_rows = Memory(width=high_row_bits, depth=storage.depth)
+			word_high_row = bank_row[word_bank][row_bits:]
+
+			m.submodules.high_row_write_port = high_row_write_port = high_rows.write_port()
+			m.d.comb += [
+				high_row_write_port.addr.eq(word_addr),
+				high_row_write_port.data.eq(word_high_row),
+				high_row_write_port.en.eq(write_port.en),
+			]
+
+			m.submodules.high_row_read_port = high_row_read_port = high_rows.read_port(transparent=False)
+			read_high_row = Signal(high_row_bits)
+			m.d.comb += high_row_read_port.addr.eq(word_addr)
+			m.d.sync += read_high_row.eq(word_high_row)
+			aliased = Signal()
+			m.d.comb += aliased.eq(high_row_read_port.data != read_high_row)
+		else:
+			aliased = Const(0)
+		read_bank_closed = Signal()
+		m.d.sync += read_bank_closed.eq(~word_bank_open)
+
+		# the read data then goes along <latency> clocks, with the dqm it was read with, and the read port is the first of them.
+		# A word is undefined if it was read from a bank without an open row, or was last written from another row
+		read_valid = Array(Signal(name=f"read_{i}_valid") for i in range(max_latency))
+		read_masked = Array(Signal(name=f"read_{i}_masked") for i in range(max_latency))
+		read_undefined = Array([read_bank_closed | aliased] + [Signal(name=f"read_{i}_undefined") for i in range(1, max_latency)])
+		read_data = Array([read_port.data] + [Signal.like(read_port.data, name=f"read_{i}_data") for i in range(1, max_latency)])
+		m.d.sync += [
+			read_valid[0].eq(word_en & ~word_write),
+			read_masked[0].eq(self.io.dqm),
+		]
+		for i in range(1, max_latency):
+			m.d.sync += [
+				read_valid[i].eq(read_valid[i-1]),
+				read_masked[i].eq(read_masked[i-1]),
+				read_undefined[i].eq(read_undefined[i-1]),
+				read_data[i].eq(read_data[i-1]),
+			]
+
+		# and is put on dq half a clock after the clock it is due, as on the chip
+		due = Signal(range(max_latency))
+		m.d.comb += due.eq(latency - 1)
+
+		m.domains.clki_n = clki_n = ClockDomain("clki_n", clk_edge="neg")
+		m.d.comb += clki_n.clk.eq(self.io.clk & self.io.clk_en)
+		with m.If(read_valid[due]):
+			m.d.clki_n += self.io.dq_cipo.eq(Mux(read_masked[due] | read_undefined[due], 0xBEAD, read_data[due]))
+
+		# the pins are sampled on the rising edge of the clock pin, as for model_sdram
+		m.domains.clki = clki = ClockDomain("clki", clk_edge="pos")
+		m.d.comb += clki.clk.eq(self.io.clk & self.io.clk_en)
+
+		return DomainRenamer("clki")(m)
+
+
 if __name__ == "__main__":
 	""" 
 	feb2022 - apr2022
@@ -890,6 +1515,68 @@ if __name__ == "__main__":
 
 	elif args.action == "simulate": # time-domain testing
 
+		def get_rtl_model_config_params():
+			from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+			config_params = Params()
+			config_params.clk_freq = 143e6 # so T_RCD, T_RP, T_MRD and T_DPL are 3 clks, T_RAS is 6, and T_RC is 9
+			config_params.ic_timing = ic_timing
+			config_params.ic_refresh_timing = ic_refresh_timing
+			config_params.rw_params = rw_params
+			config_params.burstlen = 8
+			config_params.latency = 3
+			return config_params
+
+		def get_rtl_model_mode(config_params):
+			return (config_params.latency << 4) | mode_burst_length[f"MODE_BURSTLEN_{config_params.burstlen}"].value
+
+		def run_rtl_model_with_cmds(utest, config_params, cmds, w_data, num_clks):
+			# drives model_sdram_rtl through controller_pin, with cmds[clk] = (cmd, ba, a) and w_data[clk] = dq, 
+			# and returns the trace it recorded
+			from controller_pin import controller_pin
+
+			utest_params = Params()
+			utest_params.use_sdram_model = True
+			utest_params.model_sdram_rtl = model_sdram_rtl
+			utest_params.model_record_trace = True
+
+			m = Module()
+			m.submodules.pin_ctrl = pin_ctrl = controller_pin(config_params, utest_params)
+			add_clock(m, "sync")
+
+			def drive_cmds():
+				ui = pin_ctrl.ui.refresh
+				yield pin_ctrl.ui.bus_is_refresh_not_readwrite.eq(1)
+				yield ui.clk_en.eq(1)
+				for clk in range(num_clks):
+					cmd, ba, a = cmds[clk] if clk in cmds else (sdram_cmds.CMD_NOP, 0, 0)
+					yield ui.cmd.eq(cmd)
+					yield ui.rw_copi.ba.eq(ba)
+					yield ui.rw_copi.a.eq(a)
+					yield ui.rw_copi.dq.eq(w_data[clk] if clk in w_data else 0)
+					yield
+
+			sim = Simulator(m)
+			sim.add_clock(period=1/config_params.clk_freq, domain="sync")
+			for process, domain in pin_ctrl.get_sim_sync_processes():
+				sim.add_sync_process(process, domain=domain)
+			sim.add_sync_process(drive_cmds, domain="sync")
+
+			with sim.write_vcd(
+				f"{current_filename}_{utest.get_test_id()}.vcd"):
+				sim.run()
+
+			return pin_ctrl.sdram_model.cmd_trace
+
+		def get_rtl_model_read_back(config_params, trace):
+			# the words of each read burst in the trace, which are on dq <latency> clocks after they are read
+			records = trace.to_array()
+			read_clks = records["clk"][np.isin(records["cmd"], [sdram_cmds.CMD_READ.value, sdram_cmds.CMD_READ_AP.value])]
+			def read_back(read_clk):
+				first_clk = read_clk + config_params.latency
+				return records["dq_cipo"][(first_clk <= records["clk"]) & (records["clk"] < first_clk + config_params.burstlen)].tolist()
+			return [read_back(clk) for clk in read_clks]
+
 		class modelSdramAsModule_sim_thatEachCommandAndSignal_IsDecodedCorrectlyAndInSync(FHDLTestCase):
 			def test_sim(self):
 				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
@@ -901,6 +1588,7 @@ if __name__ == "__main__":
 				config_params.rw_params = rw_params
 
 				utest_params = Params()
+				utest_params.model_check_timing = False # as each command is sent in the clock after the last
 
 				tb = Testbench(config_params, utest_params, utest=self)
 
@@ -929,6 +1617,283 @@ if __name__ == "__main__":
 					f"{current_filename}_{self.get_test_id()}.vcd"):
 					sim.run()
 
+		class modelCmdTraceChecker_sim_thatTracesBreakingOneRule_FailOnlyThatCheck(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6 # so T_RCD, T_RP, T_RRD, T_MRD and T_DPL are 3 clks, T_DAL is 5, T_RAS is 6, and T_RC is 9
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+
+				def get_trace(act_clk = 6, pre_clk = 15, read_data = 0x10):
+					# a burst of 4 is written to row 5 of bank 0, and read back once the row is opened again
+					mode = (3 << 4) | mode_burst_length.MODE_BURSTLEN_4.value # and a cas latency of 3
+					records = {
+						0: 			(sdram_cmds.CMD_PALL, 0, 0),
+						3: 			(sdram_cmds.CMD_MRS, 0, mode),
+						act_clk: 	(sdram_cmds.CMD_ACT, 0, 5),
+						9: 			(sdram_cmds.CMD_WRITE, 0, 0),
+						pre_clk: 	(sdram_cmds.CMD_PRE, 0, 0),
+						18: 		(sdram_cmds.CMD_ACT, 0, 5),
+						21: 		(sdram_cmds.CMD_READ, 0, 0),
+						28: 		(sdram_cmds.CMD_PRE, 0, 0),
+					}
+					trace = []
+					for clk in range(30):
+						cmd, ba, a = records[clk] if clk in records else (sdram_cmds.CMD_NOP, 0, 0)
+						dq_copi = (0x10 + clk - 9) if (9 <= clk < 13) else 0
+						dq_cipo = (read_data + clk - 24) if (24 <= clk < 28) else 0
+						trace.append((clk, cmd.value, ba, a, 0, dq_copi, dq_cipo))
+					return np.array(trace, dtype=model_cmd_trace.trace_dtype)
+
+				def get_violations(trace):
+					return model_cmd_trace_checker(config_params, trace).get_violations()
+
+				self.assertEqual(get_violations(get_trace()), {})
+				self.assertEqual(get_violations(get_trace(act_clk=5)), {"T_MRD": [5]})
+				self.assertEqual(get_violations(get_trace(act_clk=7)), {"T_RCD": [9]})
+				self.assertEqual(get_violations(get_trace(pre_clk=14)), {"T_DPL": [14]})
+				self.assertEqual(get_violations(get_trace(pre_clk=16)), {"T_RP": [18]})
+				self.assertEqual(get_violations(get_trace(read_data=0x11)), {"data": [21, 22, 23, 24]})
+
+		class modelSdramRtl_sim_withRecordedTrace_thatABurstStartedPartWayThroughABlock_wrapsAroundWithinTheBlock(FHDLTestCase):
+			def test_sim(self):
+				config_params = get_rtl_model_config_params()
+
+				# a burst of 8 is written to row 5 of bank 0 from column 6, so it wraps around to columns 0-5, 
+				# then the block is read back from column 0, and from column 6
+				cmds = {
+					2: 	(sdram_cmds.CMD_PALL, 0, 0),
+					5: 	(sdram_cmds.CMD_MRS, 0, get_rtl_model_mode(config_params)),
+					8: 	(sdram_cmds.CMD_ACT, 0, 5),
+					11: (sdram_cmds.CMD_WRITE, 0, 6),
+					19: (sdram_cmds.CMD_READ, 0, 0),
+					27: (sdram_cmds.CMD_READ, 0, 6),
+				}
+				w_data = {11 + i: 0x60 + i for i in range(8)}
+				trace = run_rtl_model_with_cmds(self, config_params, cmds, w_data, num_clks=45)
+
+				self.assertEqual(trace.check(), {})
+				self.assertEqual(get_rtl_model_read_back(config_params, trace), [
+					[0x62, 0x63, 0x64, 0x65, 0x66, 0x67, 0x60, 0x61],
+					[0x60, 0x61, 0x62, 0x63, 0x64, 0x65, 0x66, 0x67],
+				])
+
+		class modelSdramRtl_sim_withRecordedTrace_thatReadsAndWritesOfABankWithNoOpenRow_AreDroppedAndReadBackAsBead(FHDLTestCase):
+			def test_sim(self):
+				config_params = get_rtl_model_config_params()
+
+				# a burst of 8 is written to row 5 of bank 0, which is then precharged. Writing to it again is dropped, 
+				# and reading it reads back 0xBEAD, until the row is opened again. Bank 1 is never activated
+				cmds = {
+					2: 	(sdram_cmds.CMD_PALL, 0, 0),
+					5: 	(sdram_cmds.CMD_MRS, 0, get_rtl_model_mode(config_params)),
+					8: 	(sdram_cmds.CMD_ACT, 0, 5),
+					11: (sdram_cmds.CMD_WRITE, 0, 0),
+					22: (sdram_cmds.CMD_PRE, 0, 0),
+					26: (sdram_cmds.CMD_WRITE, 0, 0),
+					34: (sdram_cmds.CMD_READ, 0, 0),
+					42: (sdram_cmds.CMD_ACT, 0, 5),
+					45: (sdram_cmds.CMD_READ, 0, 0),
+					53: (sdram_cmds.CMD_READ, 1, 0),
+				}
+				w_data = {**{11 + i: 0x60 + i for i in range(8)}, **{26 + i: 0x70 + i for i in range(8)}}
+				trace = run_rtl_model_with_cmds(self, config_params, cmds, w_data, num_clks=70)
+
+				self.assertEqual(trace.check(), {"no_open_row": [26, 34, 53]})
+				self.assertEqual(get_rtl_model_read_back(config_params, trace), [
+					8*[0xBEAD],
+					[0x60, 0x61, 0x62, 0x63, 0x64, 0x65, 0x66, 0x67],
+					8*[0xBEAD],
+				])
+
+		class modelBank_sim_thatReadingWordsNeverWritten_IsFlaggedButReadingAWrittenFace_IsNot(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.burstlen = 4
+				config_params.latency = 3
+
+				utest_params = Params()
+				utest_params.model_trace_level = trace_levels.NONE
+
+				model = model_sdram_sims(config_params, utest_params)
+				model.reads_to_return = model_read_returns(config_params.latency)
+				bank = model.banks[0]
+
+				# a burst starting with 0xFACE is written to columns 0-3 of row 5, then columns 0-7 are read back
+				cmds = {
+					0: 	(sdram_cmds.CMD_ACT, 5),
+					3: 	(sdram_cmds.CMD_WRITE, 0),
+					7: 	(sdram_cmds.CMD_READ, 0),
+					11: (sdram_cmds.CMD_READ, 4),
+				}
+				flags = {}
+				read_back = []
+				for clk in range(18):
+					cmd, a = cmds[clk] if clk in cmds else (sdram_cmds.CMD_NOP, 0)
+					dq_copi = [0xFACE, 0x11, 0x12, 0x13][clk - 3] if (3 <= clk < 7) else 0
+					flags_toggled = bank.step(cmd, a, dq_copi, dqm=0)
+					if flags_toggled:
+						flags[clk] = flags_toggled
+					bank_src, data = model.reads_to_return.pop()
+					if bank_src >= 0:
+						read_back.append(data)
+
+				self.assertEqual(read_back, [0xFACE, 0x11, 0x12, 0x13] + 4*[0xFACE])
+				self.assertEqual(flags, {11: [1], 12: [3], 13: [3], 14: [3]})
+
+		class modelBank_sim_thatABurstStartedPartWayThroughABlock_wrapsAroundWithinTheBlock(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.burstlen = 4
+				config_params.latency = 3
+
+				utest_params = Params()
+				utest_params.model_trace_level = trace_levels.NONE
+
+				model = model_sdram_sims(config_params, utest_params)
+				model.reads_to_return = model_read_returns(config_params.latency)
+				bank = model.banks[0]
+
+				# a burst is written to row 5 from column 6, so it wraps around to columns 4 and 5, then columns 4-7 are read back
+				cmds = {
+					0: 	(sdram_cmds.CMD_ACT, 5),
+					3: 	(sdram_cmds.CMD_WRITE, 6),
+					7: 	(sdram_cmds.CMD_READ, 4),
+				}
+				read_back = []
+				for clk in range(14):
+					cmd, a = cmds[clk] if clk in cmds else (sdram_cmds.CMD_NOP, 0)
+					dq_copi = (0x60 + clk - 3) if (3 <= clk < 7) else 0
+					bank.step(cmd, a, dq_copi, dqm=0)
+					bank_src, data = model.reads_to_return.pop()
+					if bank_src >= 0:
+						read_back.append(data)
+
+				self.assertEqual(read_back, [0x62, 0x63, 0x60, 0x61])
+				self.assertEqual(sorted(bank.bank_memory.get_written_words(5)), [(4, 0x62), (5, 0x63), (6, 0x60), (7, 0x61)])
+
+		class modelBank_sim_thatCommandsTooSoonAfterAnActivatePrechargeOrRefresh_FailThatTimingCheck(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 143e6 # so T_RCD, T_RP and T_DPL are 3 clks, T_RAS is 6, and T_RC is 9
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+				config_params.burstlen = 4
+				config_params.latency = 3
+
+				utest_params = Params()
+				utest_params.model_trace_level = trace_levels.NONE
+
+				def get_failed_check(act_clk = 9, write_clk = 12, second_act_clk = 21, second_ref_clk = 33):
+					# row 5 of bank 0 is opened after a refresh, written, precharged, opened again, read, and precharged before another refresh
+					model = model_sdram_sims(config_params, utest_params)
+					model.reads_to_return = model_read_returns(config_params.latency)
+					bank = model.banks[0]
+					cmds = {
+						0: 					(sdram_cmds.CMD_REF, 0),
+						act_clk: 			(sdram_cmds.CMD_ACT, 5),
+						write_clk: 			(sdram_cmds.CMD_WRITE, 0),
+						18: 				(sdram_cmds.CMD_PRE, 0),
+						second_act_clk: 	(sdram_cmds.CMD_ACT, 5),
+						24: 				(sdram_cmds.CMD_READ, 0),
+						30: 				(sdram_cmds.CMD_PRE, 0),
+						second_ref_clk: 	(sdram_cmds.CMD_REF, 0),
+					}
+					try:
+						for clk in range(40):
+							cmd, a = cmds[clk] if clk in cmds else (sdram_cmds.CMD_NOP, 0)
+							bank.step(cmd, a, dq_copi=clk, dqm=0)
+							model.reads_to_return.pop()
+					except AssertionError as e:
+						return str(e)
+					return None
+
+				self.assertEqual(get_failed_check(), None)
+				self.assertEqual(get_failed_check(act_clk=8), f"T_RC violated by {sdram_cmds.CMD_ACT}")
+				self.assertEqual(get_failed_check(write_clk=11), "T_RCD violated by write")
+				self.assertEqual(get_failed_check(second_act_clk=20), f"T_RP violated by {sdram_cmds.CMD_ACT}")
+				self.assertEqual(get_failed_check(second_ref_clk=32), f"T_RP violated by {sdram_cmds.CMD_REF}")
+
+		class modelReadReturns_sim_thatAReadFromAnotherBank_DropsTheRestOfTheInterruptedBurst(FHDLTestCase):
+			def test_sim(self):
+				EMPTY, BLANK = model_read_returns.EMPTY, model_read_returns.BLANK
+				reads_to_return = model_read_returns(latency=3)
+				self.assertTrue(reads_to_return.is_empty())
+
+				# the calls made by the banks each clock, in the order they are stepped. Bank 1's read on 
+				# clk 2 interrupts bank 0's burst, which is dropped whether bank 0 is stepped before or after bank 1
+				calls = {
+					0: [("start_read", 0), ("schedule", 0, 0xA0)],
+					1: [("schedule", 0, 0xA1)],
+					2: [("schedule", 0, 0xA2), ("start_read", 1), ("schedule", 1, 0xB0)],
+					3: [("schedule", 1, 0xB1), ("schedule", 0, 0xA3)],
+					4: [("schedule", 1)], # dqm masked this word
+					5: [("schedule", 1, 0xB3)],
+				}
+				returned = []
+				for clk in range(9):
+					for name, *args in calls[clk] if clk in calls else []:
+						getattr(reads_to_return, name)(*args)
+					returned.append(reads_to_return.pop())
+
+				self.assertEqual([bank_src for bank_src, _ in returned], [BLANK, BLANK, 0, 0, 1, 1, BLANK, 1, EMPTY])
+				self.assertEqual([data for bank_src, data in returned if bank_src >= 0], [0xA0, 0xA1, 0xB0, 0xB1, 0xB3])
+				self.assertTrue(reads_to_return.is_empty())
+
+		class modelRefreshMonitor_sim_thatMissedOrBunchedRefreshes_FailRetentionAtTheExpectedClk(FHDLTestCase):
+			def test_sim(self):
+				from parameters_IS42S16160G_ic import ic_timing, ic_refresh_timing, rw_params
+
+				config_params = Params()
+				config_params.clk_freq = 25.6e6 # so 32ms is 819200 clks, and a refresh is needed every 100 clks
+				config_params.ic_timing = ic_timing
+				config_params.ic_refresh_timing = ic_refresh_timing
+				config_params.rw_params = rw_params
+
+				utest_params = Params()
+				utest_params.model_trace_level = trace_levels.NONE
+
+				def get_monitor(refresh_clks):
+					monitor = model_refresh_monitor(config_params, utest_params)
+					for clk in refresh_clks:
+						monitor.step(sdram_cmds.CMD_REF, clk)
+					return monitor
+
+				# a refresh every 100 clks meets the requirements indefinitely
+				monitor = get_monitor(range(0, 3*819200, 100))
+				self.assertTrue(monitor.check(3*819200))
+				self.assertEqual(monitor.retention_failed_at, None)
+
+				# if they stop after clk 100000, the 819100 clks that were left on the counter run out
+				monitor = get_monitor(range(0, 100000+1, 100))
+				self.assertFalse(monitor.check(2*819200))
+				self.assertEqual(monitor.retention_failed_at, 100000 + 819100 - 1)
+
+				# 8192 refreshes bunched at the start, then one every 150 clks, keep the counter up for 
+				# over 2 million clks, but the 5444th of the spaced out refreshes is the first to come more
+				# than 819200 clks after the refresh 8192 before it
+				monitor = get_monitor(list(range(8192)) + list(range(8191+150, 1000000, 150)))
+				self.assertFalse(monitor.check(1000000))
+				self.assertEqual(monitor.retention_failed_at, 8191 + 150*5444)
+
 	if args.action in ["generate", "simulate"]:
 		# now run each FHDLTestCase above 
 		import unittest
@@ -13,6 +13,8 @@ class ic_timing(Enum): # minimums
 	T_DAL	= 30e-9 # input data to active / refresh command delay time, during auto precharge
 	T_XSR	= 70e-9
 	T_DPL 	= 14e-9
+	T_RRD	= 14e-9 # activate to activate, on a different bank
+	T_CK_CL2 = 10e-9 # the shortest clock period that supports a cas latency of 2
 	# T_RAS 	= 0 # for precharge ?
 
 class ic_refresh_timing(Enum):
@@ -46,4 +46,16 @@ class mode_operation(enum.Enum):
 
 class mode_write_burst(enum.Enum):
 	MODE_WBST_ENABLE	= 0b0
-	MODE_WBST_SINGLE	= 0b1
\ No newline at end of file
+	MODE_WBST_SINGLE	= 0b1
+
+class addr_mapping(enum.Enum):
+	# how controller_readwrite splits a word address into row, bank and column, from the msb down
+	ROW_COL_BANK		= 0 # the bank bits sit just above the burst, so consecutive bursts go to different banks
+	ROW_BANK_COL		= 1 # a whole row of one bank is used before moving on to the next bank
+	BANK_ROW_COL		= 2 # the top address bits pick the bank, e.g. so each fifo in interface_n_fifo has its own bank
+
+def get_mode_latency(clk_freq, ic_timing):
+	# the shortest cas latency the chip supports at this clock frequency
+	if (1/clk_freq) >= ic_timing.T_CK_CL2.value:
+		return mode_latency.MODE_CAS_2
+	return mode_latency.MODE_CAS_3